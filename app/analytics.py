@@ -0,0 +1,170 @@
+"""Route analytics: rides, offered and booked seats, bookings, revenue and booking rate per route and departure day.
+
+Every ride and booking change appends its effect on the stats (record) in the transaction of the change,
+the ride expiry job folds these deltas into the route daily stats table (fold) and the reads add up the stats
+and the deltas not folded yet (route_stats). Reads are exact at any time and cost an index scan of the stats
+of the asked routes and days, however long the history is. Rides written around the crud functions,
+like the seeded ones, are counted after a rebuild from the rides and bookings tables.
+
+Usage:
+    python -m app.analytics rebuild
+    python -m app.analytics fold
+"""
+import argparse
+from datetime import date
+from sqlalchemy import Float, Numeric, cast, delete, func, insert, literal, select, text, true, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+from . import models
+
+
+STATS_COLUMNS = ("rides", "seats", "bookings", "seats_booked", "revenue")
+KEY_COLUMNS = ("start_city", "destination_city", "day")
+
+
+def _round(value, digits: int):
+    # PostgreSQL rounds to digits numerics only
+    return cast(func.round(cast(value, Numeric), digits), Float)
+
+
+def record(db: Session, ride_id: int, **deltas):
+    """Appends the effect of a ride change on the stats of its route and departure day, within the transaction of the change
+
+    Args:
+        db (Session): database session
+        ride_id (int): ride id
+        **deltas: change of the stats columns, numbers or SQL expressions over the ride row, e.g. rides=1, seats=models.Ride.seats
+    """
+    record_rides(db, models.Ride.id == ride_id, **deltas)
+
+
+def record_rides(db: Session, condition, **deltas):
+    """Appends the effect of a change of the matching rides on the stats, one delta per ride, in a single statement
+
+    Args:
+        db (Session): database session
+        condition: SQL condition on the rides, e.g. models.Ride.id.in_(ride_ids)
+        **deltas: change of the stats columns, as in record
+    """
+    values = (deltas.get(column, 0) for column in STATS_COLUMNS)
+    rides = select(models.Ride.start_city, models.Ride.destination_city, func.date(models.Ride.departure_date),
+                   *(literal(value) if isinstance(value, (int, float)) else value for value in values)) \
+        .where(condition)
+    db.execute(insert(models.RouteStatsDelta).from_select([*KEY_COLUMNS, *STATS_COLUMNS], rides))
+
+
+def fold(db: Session) -> int:
+    """Adds up the pending deltas into the route daily stats and deletes them, in one transaction.
+    On PostgreSQL a single statement deletes the deltas and adds up exactly the deleted ones, so deltas
+    committed meanwhile wait for the next fold; SQLite serializes the writers, the deltas read are deleted by id.
+
+    Args:
+        db (Session): database session
+
+    Returns:
+        int: number of updated route days
+    """
+    deltas, stats = models.RouteStatsDelta.__table__, models.RouteDailyStats.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        source, condition, dialect_insert = delete(deltas).returning(*deltas.c).cte("folded"), true(), postgresql.insert
+    else:
+        last = db.execute(select(func.max(deltas.c.id))).scalar()
+        if last is None:
+            return 0
+        source, condition, dialect_insert = deltas, deltas.c.id <= last, sqlite.insert
+    key = [source.c[column] for column in KEY_COLUMNS]
+    totals = select(*key, *(func.sum(source.c[column]) for column in STATS_COLUMNS)).where(condition).group_by(*key)
+    upsert = dialect_insert(stats).from_select([*KEY_COLUMNS, *STATS_COLUMNS], totals)
+    upsert = upsert.on_conflict_do_update(index_elements=list(KEY_COLUMNS),
+                                          set_={column: stats.c[column] + upsert.excluded[column] for column in STATS_COLUMNS})
+    updated = db.execute(upsert).rowcount
+    if source is deltas:
+        db.execute(delete(deltas).where(condition))
+    db.commit()
+    return updated
+
+
+def rebuild(db: Session):
+    """Recomputes the route daily stats from the rides and bookings tables and drops the pending deltas.
+    On PostgreSQL the deltas table is locked meanwhile, so changes committed during the rebuild are neither lost nor counted twice.
+
+    Args:
+        db (Session): database session
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE route_stats_deltas IN EXCLUSIVE MODE"))
+    db.execute(delete(models.RouteStatsDelta))
+    db.execute(delete(models.RouteDailyStats))
+    booked = select(models.Booking.ride_id, func.count(models.Booking.id).label("bookings"),
+                    func.sum(models.Booking.seats).label("seats_booked")).group_by(models.Booking.ride_id).subquery()
+    day = func.date(models.Ride.departure_date)
+    totals = select(models.Ride.start_city, models.Ride.destination_city, day, func.count(models.Ride.id),
+                    func.sum(models.Ride.seats), func.coalesce(func.sum(booked.c.bookings), 0),
+                    func.coalesce(func.sum(booked.c.seats_booked), 0),
+                    func.coalesce(func.sum(booked.c.seats_booked * models.Ride.price), 0)) \
+        .outerjoin(booked, booked.c.ride_id == models.Ride.id) \
+        .group_by(models.Ride.start_city, models.Ride.destination_city, day)
+    db.execute(insert(models.RouteDailyStats).from_select([*KEY_COLUMNS, *STATS_COLUMNS], totals))
+    db.commit()
+
+
+def route_stats(db: Session, start_city: str | None = None, destination_city: str | None = None,
+                day_from: date | None = None, day_to: date | None = None, daily: bool = False, limit: int = 100) -> list[Row]:
+    """Gets the stats per route, or per route and departure day, adding up the folded stats and the pending deltas
+
+    Args:
+        db (Session): database session
+        start_city (str | None, optional): start city. Defaults to None (any).
+        destination_city (str | None, optional): destination city. Defaults to None (any).
+        day_from (date | None, optional): earliest departure day. Defaults to None.
+        day_to (date | None, optional): latest departure day. Defaults to None.
+        daily (bool, optional): one row per departure day instead of one per route. Defaults to False.
+        limit (int, optional): limits to x records. Defaults to 100.
+
+    Returns:
+        list[Row]: rows with the schemas.RouteStats fields (and day), routes with the highest revenue first or days in order
+    """
+    parts = []
+    for table in (models.RouteDailyStats.__table__, models.RouteStatsDelta.__table__):
+        part = select(*(table.c[column] for column in (*KEY_COLUMNS, *STATS_COLUMNS)))
+        if start_city is not None:
+            part = part.where(table.c.start_city == start_city)
+        if destination_city is not None:
+            part = part.where(table.c.destination_city == destination_city)
+        if day_from is not None:
+            part = part.where(table.c.day >= day_from)
+        if day_to is not None:
+            part = part.where(table.c.day <= day_to)
+        parts.append(part)
+    source = union_all(*parts).subquery()
+    key = [source.c.start_city, source.c.destination_city, *([source.c.day] if daily else [])]
+    seats, seats_booked = func.sum(source.c.seats), func.sum(source.c.seats_booked)
+    query = select(*key, func.sum(source.c.rides).label("rides"), seats.label("seats"),
+                   func.sum(source.c.bookings).label("bookings"), seats_booked.label("seats_booked"),
+                   _round(func.sum(source.c.revenue), 2).label("revenue"),
+                   _round(seats_booked * 1.0 / func.nullif(seats, 0), 4).label("booking_rate")) \
+        .group_by(*key).having(func.sum(source.c.rides) != 0)
+    order = [*key] if daily else [func.sum(source.c.revenue).desc(), *key]
+    return db.execute(query.order_by(*order).limit(limit)).all()
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    from .database import get_session_local
+
+    parser = argparse.ArgumentParser(prog="python -m app.analytics", description="Maintain the route analytics.")
+    parser.add_argument("command", choices=["rebuild", "fold"],
+                        help="rebuild: recompute the stats from the rides and bookings, fold: add up the pending deltas")
+    args = parser.parse_args(argv)
+    with get_session_local()() as db:
+        if args.command == "rebuild":
+            rebuild(db)
+            print("rebuilt the route daily stats")
+        else:
+            print(f"folded the deltas into {fold(db)} route days")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""In-process caches of the current user lookups and of the ride lists, kept coherent between the workers
+by PostgreSQL LISTEN/NOTIFY.
+
+The crud mutations queue an invalidation message (Invalidator.invalidate) which is sent by pg_notify within
+their transaction, so PostgreSQL delivers it to every worker on commit only, and applied to the local caches
+right after the commit. Every worker runs a listener (InvalidationListener) on its own connection, applying
+the messages of all the workers. While the listener is disconnected the caches are bypassed, on reconnect
+they are cleared as messages may have been missed meanwhile. With other databases (SQLite, a single process)
+the caches are invalidated locally only. The listener also delivers the ride feed events of all the workers (app.feed).
+
+Entries expire after CACHE_TTL_SECONDS anyway, 0 disables the caches.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from .config import Envs
+from .feed import ride_feed, CHANNEL as FEED_CHANNEL
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+
+
+class LocalCache:
+    """Bounded in-process cache with expiring entries, the least recently used are dropped over the limit.
+    Every invalidation bumps the generation: a value read from the database is stored only if no invalidation
+    happened since the read started, so a slow reader never stores data older than an invalidation
+    """
+    def __init__(self, name: str, max_entries: int | None = None, ttl: float | None = None):
+        """
+        Args:
+            name (str): name of the cache in the metrics
+            max_entries (int | None, optional): maximum number of entries. Defaults to CACHE_MAX_ENTRIES.
+            ttl (float | None, optional): seconds an entry is kept for. Defaults to CACHE_TTL_SECONDS.
+        """
+        self.name = name
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.generation = 0
+        self._lock = threading.Lock()
+
+
+    @property
+    def max_entries(self) -> int:
+        return self._max_entries if self._max_entries is not None else int(Envs.CACHE_MAX_ENTRIES)
+
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl if self._ttl is not None else float(Envs.CACHE_TTL_SECONDS)
+
+
+    def get(self, key: Hashable) -> Any | None:
+        """Gets a value
+
+        Args:
+            key (Hashable): key
+
+        Returns:
+            Any | None: the value, None if missing or expired
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                metrics.inc(f"cache.{self.name}.misses")
+                return None
+            self.entries.move_to_end(key)
+        metrics.inc(f"cache.{self.name}.hits")
+        return entry[1]
+
+
+    def set(self, key: Hashable, value: Any, generation: int):
+        """Stores a value unless the cache was invalidated since the value was read
+
+        Args:
+            key (Hashable): key
+            value (Any): value, never None
+            generation (int): generation of the cache taken before the value was read
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+    def invalidate(self, predicate: Callable[[Hashable, Any], bool] | None = None) -> int:
+        """Drops the matching entries
+
+        Args:
+            predicate (Callable[[Hashable, Any], bool] | None, optional): takes a key and its value. Defaults to None, all entries.
+
+        Returns:
+            int: number of dropped entries
+        """
+        with self._lock:
+            self.generation += 1
+            if predicate is None:
+                dropped = len(self.entries)
+                self.entries.clear()
+            else:
+                keys = [key for key, (_, value) in self.entries.items() if predicate(key, value)]
+                for key in keys:
+                    del self.entries[key]
+                dropped = len(keys)
+        metrics.inc(f"cache.{self.name}.invalidations", dropped)
+        return dropped
+
+
+# login -> detached copy of the user; (start city, destination city, *query) -> ride rows
+user_cache = LocalCache("users")
+ride_list_cache = LocalCache("rides")
+
+
+class Invalidator:
+    """Sends the invalidation messages of the crud mutations and applies them to the local caches.
+    Messages are dictionaries: {"user": login}, {"user_id": id}, {"route": [start city, destination city]}
+    or {"rides": true} for all the ride lists
+    """
+    def __init__(self):
+        # whether the local caches see every invalidation: set by the listener, or for a database without NOTIFY
+        self.coherent = False
+
+
+    @property
+    def active(self) -> bool:
+        return float(Envs.CACHE_TTL_SECONDS) > 0
+
+
+    @property
+    def enabled(self) -> bool:
+        return self.active and self.coherent
+
+
+    def invalidate(self, db: Session, **message):
+        """Queues an invalidation in the transaction of a mutation: notifies the other workers on PostgreSQL,
+        the local caches are invalidated after the commit. Does nothing while the caches are disabled.
+
+        Args:
+            db (Session): database session, before the commit
+            **message: invalidation message
+        """
+        if not self.active:
+            return
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(select(func.pg_notify(CHANNEL, json.dumps(message, separators=(",", ":")))))
+        db.info.setdefault("invalidations", []).append(message)
+
+
+    def apply(self, message: dict):
+        """Invalidates the cache entries a message is about
+
+        Args:
+            message (dict): invalidation message
+        """
+        if "user" in message:
+            login = message["user"]
+            user_cache.invalidate(lambda key, user: key == login)
+        if "user_id" in message:
+            user_id = message["user_id"]
+            user_cache.invalidate(lambda key, user: user.id == user_id)
+        if "route" in message:
+            start_city, destination_city = message["route"]
+            ride_list_cache.invalidate(lambda key, rides: key[0] in (start_city, None) and key[1] in (destination_city, None))
+        if message.get("rides"):
+            ride_list_cache.invalidate()
+
+
+    def resync(self):
+        """Clears the caches and trusts them again, after the listener (re)connected
+        """
+        user_cache.invalidate()
+        ride_list_cache.invalidate()
+        self.coherent = True
+
+
+    def suspend(self):
+        """Bypasses the caches, while invalidations may be missed
+        """
+        self.coherent = False
+        user_cache.invalidate()
+        ride_list_cache.invalidate()
+
+
+invalidator = Invalidator()
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session: Session):
+    for message in session.info.pop("invalidations", ()):
+        invalidator.apply(message)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_invalidations(session: Session, previous_transaction):
+    session.info.pop("invalidations", None)
+
+
+class InvalidationListener:
+    """Background task of a worker listening to the invalidation messages and the ride feed events of all the workers,
+    on a dedicated PostgreSQL connection outside of the pool. Reconnects with a growing delay
+    and resyncs the caches on every connection, the feed subscribers are told they lagged on every disconnection
+    """
+    def __init__(self, engine: Engine, reconnect_delay: float = 1, max_reconnect_delay: float = 30, keepalive: float = 30):
+        """
+        Args:
+            engine (Engine): PostgreSQL engine
+            reconnect_delay (float, optional): seconds before the first reconnection attempt. Defaults to 1.
+            max_reconnect_delay (float, optional): maximum seconds between the reconnection attempts. Defaults to 30.
+            keepalive (float, optional): seconds of silence before the connection is checked. Defaults to 30.
+        """
+        self.engine = engine
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.keepalive = keepalive
+        self._task: asyncio.Task | None = None
+
+
+    def _connect(self):
+        cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+        connection = self.engine.dialect.connect(*cargs, **cparams)
+        connection.autocommit = True
+        connection.cursor().execute(f"LISTEN {CHANNEL}; LISTEN {FEED_CHANNEL}")
+        return connection
+
+
+    def _ping(self, connection):
+        connection.cursor().execute("SELECT 1")
+
+
+    def _apply(self, channel: str, payload: str):
+        try:
+            if channel == FEED_CHANNEL:
+                ride_feed.receive(payload)
+            else:
+                invalidator.apply(json.loads(payload))
+        except (ValueError, TypeError, KeyError):
+            logger.warning("malformed %s message %r", channel, payload)
+
+
+    async def _listen(self, connection):
+        """Applies the notifications as they arrive, until the connection fails
+        """
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(connection.fileno(), readable.set)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(readable.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self._ping, connection)
+                readable.clear()
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    self._apply(notification.channel, notification.payload)
+        finally:
+            loop.remove_reader(connection.fileno())
+
+
+    async def run(self):
+        """Listens until cancelled, reconnecting after failures
+        """
+        delay = self.reconnect_delay
+        while True:
+            connection = None
+            try:
+                connection = await asyncio.to_thread(self._connect)
+                invalidator.resync()
+                metrics.inc("cache.listener.connects")
+                delay = self.reconnect_delay
+                await self._listen(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("cache invalidation listener disconnected, retrying in %.0f s", delay, exc_info=True)
+            finally:
+                invalidator.suspend()
+                ride_feed.lagged()
+                if connection is not None:
+                    connection.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+    def start(self):
+        """Starts listening in the background
+        """
+        self._task = asyncio.create_task(self.run(), name="cache-invalidation-listener")
+
+
+    async def stop(self):
+        """Stops listening
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
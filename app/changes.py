@@ -0,0 +1,176 @@
+"""Ride change log: the incremental sync of the clients mirroring the ride catalogue.
+
+Every ride mutation of crud appends an entry (insert, update or delete of a ride) in its own transaction (record).
+Clients keep the cursor of the last page and ask for the changes after it (changes_since): a page holds the ride ids
+changed since the cursor along with their current rows, so the sync traffic follows the churn, not the catalogue size.
+
+The cursor is the sequence of the entries. On PostgreSQL it is the id of the writing transaction and a page only holds
+the transactions older than any still running one, so an entry committed late never lands behind a cursor already
+handed out. SQLite runs one writer at a time, the sequence simply grows by one per statement.
+
+The ride expiry job compacts the log (compact): an entry superseded by a later change of the same ride is dropped,
+and so are the entries older than CHANGE_LOG_RETENTION_HOURS, leaving a compaction marker. A cursor older than
+the marker is stale, its client refetches the rides and takes the current cursor again.
+
+Usage:
+    python -m app.changes compact
+"""
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, exists, func, insert, literal, or_, select
+from sqlalchemy.orm import Session
+from . import models, schemas
+
+
+INSERT, UPDATE, DELETE, COMPACTED = "insert", "update", "delete", "compacted"
+
+# the fields of schemas.Ride, as the change pages carry the rides like the ride lists do
+RIDE_COLUMNS = tuple(models.Ride.__table__.c[field] for field in schemas.Ride.model_fields)
+
+
+def _sequence(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.txid_current()
+    return select(func.coalesce(func.max(models.RideChange.sequence), 0) + 1).scalar_subquery()
+
+
+def _settled(db: Session):
+    # the entries of the transactions which can no longer commit anything behind them
+    if db.get_bind().dialect.name == "postgresql":
+        return models.RideChange.sequence < func.txid_snapshot_xmin(func.txid_current_snapshot())
+    return None
+
+
+def record(db: Session, operation: str, condition):
+    """Appends a change of the matching rides to the log, within the transaction of the change.
+    Deletes are recorded before the rides are deleted
+
+    Args:
+        db (Session): database session
+        operation (str): INSERT, UPDATE or DELETE
+        condition: SQL condition on the rides, e.g. models.Ride.id == ride_id
+    """
+    rides = select(_sequence(db), models.Ride.id, literal(operation), literal(datetime.utcnow())).where(condition)
+    db.execute(insert(models.RideChange).from_select(["sequence", "ride_id", "operation", "changed_at"], rides))
+
+
+def current_cursor(db: Session) -> int:
+    """Gets the cursor a client starts syncing from, taken before it fetches the rides
+
+    Args:
+        db (Session): database session
+
+    Returns:
+        int: cursor
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return db.execute(select(func.txid_snapshot_xmin(func.txid_current_snapshot()) - 1)).scalar()
+    return db.execute(select(func.coalesce(func.max(models.RideChange.sequence), 0))).scalar()
+
+
+def changes_since(db: Session, since: int, limit: int = 500) -> dict | None:
+    """Gets the rides changed after a cursor, usually in one statement. A page holds whole transactions,
+    a transaction changing more rides than the limit makes a page of its own
+
+    Args:
+        db (Session): database session
+        since (int): cursor of the previous page
+        limit (int, optional): limits to about x changes. Defaults to 500.
+
+    Returns:
+        dict | None: the next cursor, whether more changes follow and the changes, oldest first: operation, ride_id
+            and the current ride row (None for deleted rides). None if the cursor is older than the compacted log
+    """
+    change, ride = models.RideChange, models.Ride
+    entries = select(change.id, change.sequence, change.operation, change.ride_id).where(change.sequence > since)
+    settled = _settled(db)
+    if settled is not None:
+        entries = entries.where(settled)
+
+    def read(source):
+        page = source.subquery()
+        return db.execute(select(page.c.sequence, page.c.operation, page.c.ride_id, *RIDE_COLUMNS)
+                          .outerjoin(ride, ride.id == page.c.ride_id).order_by(page.c.sequence, page.c.id)).all()
+    rows = read(entries.order_by(change.sequence, change.id).limit(limit + 1))
+    if rows and rows[0].operation == COMPACTED:
+        return None
+    has_more = len(rows) > limit
+    if has_more:
+        last = rows[limit].sequence
+        if rows[0].sequence == last:
+            rows = read(entries.where(change.sequence == last))
+        else:
+            rows = [row for row in rows[:limit] if row.sequence != last]
+    latest = {}
+    for row in rows:
+        latest.pop(row.ride_id, None)
+        latest[row.ride_id] = row
+    changes = []
+    for row in latest.values():
+        current = {column.key: row._mapping[column] for column in RIDE_COLUMNS}
+        if current["id"] is None:
+            changes.append({"operation": DELETE, "ride_id": row.ride_id, "ride": None})
+        else:
+            changes.append({"operation": row.operation, "ride_id": row.ride_id, "ride": current})
+    return {"cursor": rows[-1].sequence if rows else since, "has_more": has_more, "changes": changes}
+
+
+def compact(db: Session, now: datetime, retention: timedelta) -> int:
+    """Drops the entries superseded by a later change of the same ride and the entries older than the retention,
+    leaving a compaction marker at the highest dropped sequence, in one transaction
+
+    Args:
+        db (Session): database session
+        now (datetime): current date
+        retention (timedelta): how long the entries are kept for
+
+    Returns:
+        int: number of dropped entries
+    """
+    change = models.RideChange.__table__
+    later = change.alias("later")
+    superseded = exists().where(later.c.ride_id == change.c.ride_id,
+                                or_(later.c.sequence > change.c.sequence,
+                                    and_(later.c.sequence == change.c.sequence, later.c.id > change.c.id)))
+    dropped = db.execute(delete(change).where(change.c.ride_id.isnot(None), superseded)).rowcount
+    horizon = db.execute(select(func.max(change.c.sequence)).where(change.c.changed_at < now - retention,
+                                                                   change.c.operation != COMPACTED)).scalar()
+    if horizon is not None:
+        dropped += db.execute(delete(change).where(change.c.sequence <= horizon, change.c.operation != COMPACTED)).rowcount
+        db.execute(delete(change).where(change.c.operation == COMPACTED))
+        db.execute(insert(change).values(sequence=horizon, ride_id=None, operation=COMPACTED, changed_at=now))
+    db.commit()
+    return dropped
+
+
+def clear(db: Session, now: datetime):
+    """Drops the whole log, leaving a compaction marker at the current sequence so every cursor handed out is stale,
+    within the transaction of the caller, e.g. emptying the rides tables
+
+    Args:
+        db (Session): database session
+        now (datetime): current date
+    """
+    change = models.RideChange.__table__
+    sequence = db.execute(select(_sequence(db))).scalar()
+    db.execute(delete(change))
+    db.execute(insert(change).values(sequence=sequence, ride_id=None, operation=COMPACTED, changed_at=now))
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    from .config import Envs
+    from .database import get_session_local
+
+    parser = argparse.ArgumentParser(prog="python -m app.changes", description="Maintain the ride change log.")
+    parser.add_argument("command", choices=["compact"],
+                        help="compact: drop the superseded entries and the entries older than CHANGE_LOG_RETENTION_HOURS")
+    parser.parse_args(argv)
+    with get_session_local()() as db:
+        dropped = compact(db, datetime.utcnow(), timedelta(hours=float(Envs.CHANGE_LOG_RETENTION_HOURS)))
+        print(f"dropped {dropped} change log entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import os
+from functools import lru_cache
+from pydantic import AliasChoices, Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """App settings read from the environmental variables and the .env file
+    """
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    DATABASE_URL: str = "postgresql://myuser:secret@db:5432/rides_db"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_MAX_CONNECTIONS: int = 90
+
+    WEB_CONCURRENCY: int | None = None
+    HOST: str = "0.0.0.0"
+    PORT: int = 8008
+    KEEP_ALIVE_SECONDS: int = 5
+    BACKLOG: int = 2048
+
+    MAIL_USERNAME: str | None = None
+    MAIL_PASSWORD: str | None = None
+    MAIL_FROM: str | None = None
+    MAIL_PORT: int | None = None
+    MAIL_SERVER: str | None = None
+    MAIL_SUPPRESS_SEND: bool = Field(default=False, validation_alias=AliasChoices("MAIL_SUPPRESS_SEND", "SUPPRESS_SEND"))
+
+    TEST_MAIL: str | None = None
+    TEST_DATABASE_URL: str = "sqlite://"
+
+    SECRET_KEY: str | None = None
+    ALGORITHM: str | None = None
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24
+    IDEMPOTENCY_WAIT_SECONDS: float = 30
+    IDEMPOTENCY_LEASE_SECONDS: float = 60
+
+    RIDE_EXPIRY_INTERVAL_SECONDS: float = 60
+    RIDE_EXPIRY_BATCH_SIZE: int = 500
+    CHANGE_LOG_RETENTION_HOURS: float = 168
+
+    LOOP_LAG_INTERVAL_SECONDS: float = 0.1
+    LOOP_LAG_THRESHOLD_SECONDS: float = 0.1
+
+    TRACE_SAMPLE_RATIO: float = 0.01
+    TRACE_TRUST_PARENT: bool = False
+    TRACE_BUFFER_SIZE: int = 200
+    TRACE_FILE: str | None = None
+
+    FEED_BUFFER_SIZE: int = 100
+    FEED_HEARTBEAT_SECONDS: float = 15
+
+    CACHE_TTL_SECONDS: float = 60
+    CACHE_MAX_ENTRIES: int = 10000
+
+    RATE_LIMIT_BACKEND: str = "memory"
+    LOGIN_IP_BURST: float = 30
+    LOGIN_IP_PER_MINUTE: float = 60
+    LOGIN_USER_BURST: float = 5
+    LOGIN_USER_PER_MINUTE: float = 5
+    LOGIN_MAX_CONCURRENT: int = os.cpu_count() or 1
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Loads the settings once per process, on first use
+
+    Returns:
+        Settings
+    """
+    return Settings()
+
+
+class LazySettings:
+    """Stand-in for the settings object that loads it on first attribute access,
+    so importing the app doesn't read the environment
+    """
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+
+    def __setattr__(self, name: str, value):
+        setattr(get_settings(), name, value)
+
+
+Envs = LazySettings()
@@ -1,10 +1,19 @@
 import random
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
-from .utils import SecurityUtils
-from . import models, schemas
-
-
+import secrets
+from datetime import datetime, timedelta
+from typing import Callable
+from sqlalchemy import and_, case, func, insert, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, Query
+from .utils import SecurityUtils, RideOrder
+from .tracing import traced
+from .feed import ride_feed
+from .cache import invalidator, ride_list_cache, user_cache
+from . import analytics, changes, models, schemas
+
+
+@traced
 def get_user_by_ID (db: Session, user_id: int) -> schemas.User:
     """Gets an User object providing user id
 
@@ -19,6 +28,7 @@ def get_user_by_ID (db: Session, user_id: int) -> schemas.User:
     return user
 
 
+@traced
 def get_user_by_login (db: Session, user_login: str) -> schemas.User:
     """Gets an User object providing user login
 
@@ -33,76 +43,210 @@ def get_user_by_login (db: Session, user_login: str) -> schemas.User:
     return user
 
 
-def create_user(db: Session, user: schemas.CreateUser) -> schemas.User:
+USER_ROW_COLUMNS = tuple(getattr(models.User, field) for field in schemas.User.model_fields)
+
+
+@traced
+def get_cached_user_by_login(db: Session, user_login: str) -> models.User | None:
+    """Gets an User object providing user login, from the user cache while it is enabled.
+    Cached users are read-only copies detached from any session, without the password hash
+
+    Args:
+        db (Session): database session
+        user_login (str): user login
+
+    Returns:
+        models.User | None
+    """
+    if not invalidator.enabled:
+        return get_user_by_login(db, user_login)
+    user = user_cache.get(user_login)
+    if user is None:
+        generation = user_cache.generation
+        found = get_user_by_login(db, user_login)
+        if found is None:
+            return None
+        user = models.User(**{column.name: getattr(found, column.name) for column in models.User.__table__.columns
+                              if column.name != "hashed_password"})
+        user_cache.set(user_login, user, generation)
+    return user
+
+
+@traced
+def get_users(db: Session, after: int = 0, limit: int = 50, is_active: bool | None = None, is_admin: bool | None = None,
+              login_prefix: str | None = None) -> list[Row]:
+    """Gets a page of users ordered by id, optionally filtered by status and login prefix.
+    Pages are keyset paginated: the next page starts after the id of the last user, so every page
+    costs the same index range scan however deep it is.
+
+    Args:
+        db (Session): database session
+        after (int, optional): id of the last user of the previous page. Defaults to 0, the first page.
+        limit (int, optional): limits to x records. Defaults to 50.
+        is_active (bool | None, optional): active status. Defaults to None (any).
+        is_admin (bool | None, optional): admin status. Defaults to None (any).
+        login_prefix (str | None, optional): beginning of the login. Defaults to None.
+
+    Returns:
+        list[Row]: users as read-only rows with the schemas.User fields, without password hashes and activation codes
+    """
+    query = db.query(*USER_ROW_COLUMNS).filter(models.User.id > after)
+    if is_active is not None:
+        query = query.filter(models.User.is_active == is_active)
+    if is_admin is not None:
+        query = query.filter(models.User.is_admin == is_admin)
+    if login_prefix:
+        query = query.filter(models.User.login.startswith(login_prefix, autoescape=True))
+    return query.order_by(models.User.id).limit(limit).all()
+
+
+@traced
+def create_user(db: Session, user: schemas.CreateUser) -> models.User | None:
     """Creates an User object based on the CreateUser schema.
     Activation code is created based on the pseudorandom algorithm.
+    A taken login is turned away by an existence probe before the password is hashed, so a repeated signup
+    costs no bcrypt round, while a login taken concurrently is still caught by the unique constraint of the INSERT.
 
     Args:
         db (Session): database session
         user (schemas.CreateUser): user creation schema object
 
     Returns:
-        schemas.User
+        models.User | None: None if the login is already registered
     """
-    user = models.User(login = user.login, first_name = user.first_name,
-                       last_name = user.last_name, address = user.address,
-                        hashed_password =  SecurityUtils.get_password_hash(user.hashed_password),
-                        is_admin = user.is_admin, is_active = user.is_admin,
-                        activation_code = user.last_name[-1]+str(random.randint(1,10))+user.login[0]+user.address[-1]+str(random.randint(1,6539)))
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return schemas.User.from_orm(user)
+    if db.query(select(models.User.id).where(models.User.login == user.login).exists()).scalar():
+        return None
+    values = dict(login = user.login, first_name = user.first_name,
+                  last_name = user.last_name, address = user.address,
+                  hashed_password =  SecurityUtils.get_password_hash(user.hashed_password),
+                  is_admin = user.is_admin, is_active = user.is_admin,
+                  activation_code = user.last_name[-1]+str(random.randint(1,10))+user.login[0]+user.address[-1]+str(random.randint(1,6539)))
+    try:
+        user_id = db.execute(insert(models.User.__table__).values(values)).inserted_primary_key[0]
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return models.User(id = user_id, **values)
 
 
-def remove_user(db: Session, user_login: str):
-    """Removes user from database providing user login
+@traced
+def remove_user(db: Session, user_id: int):
+    """Removes user from database along with their bookings and refresh tokens providing user id.
+    The booked seats are given back to their rides, reactivating the upcoming rides archivised when full,
+    published to the live feed as updates, and the bookings are taken out of the route analytics.
+    The single-seat rides the user took lose their user_id_taken, a change of these rides
 
     Args:
         db (Session): database session
-        user_login (str): user login
+        user_id (int): user id
     """    
-    user = get_user_by_login(db, user_login)
-    if user is not None:
-        db.delete(user)
-        db.commit()
+    booked_rides = select(models.Booking.ride_id).where(models.Booking.user_id == user_id)
+    seats_booked = select(func.sum(models.Booking.seats)) \
+        .where(models.Booking.user_id == user_id, models.Booking.ride_id == models.Ride.id).scalar_subquery()
+    db.query(models.Ride).filter(models.Ride.id.in_(booked_rides)).update(
+        {models.Ride.seats_available: models.Ride.seats_available + seats_booked,
+         models.Ride.is_active: case((and_(models.Ride.seats_available == 0, models.Ride.departure_date > datetime.utcnow()), True),
+                                     else_=models.Ride.is_active)}, synchronize_session=False)
+    changes.record(db, changes.UPDATE, models.Ride.id.in_(booked_rides))
+    ride_feed.notify(db, "update", models.Ride.id.in_(booked_rides))
+    updated_rides = db.execute(booked_rides.distinct()).scalars().all() if ride_feed.publishing else []
+    bookings = select(func.count(models.Booking.id)) \
+        .where(models.Booking.user_id == user_id, models.Booking.ride_id == models.Ride.id).scalar_subquery()
+    analytics.record_rides(db, models.Ride.id.in_(booked_rides), bookings=-bookings, seats_booked=-seats_booked,
+                           revenue=-seats_booked * models.Ride.price)
+    db.query(models.Booking).filter(models.Booking.user_id == user_id).delete(synchronize_session=False)
+    db.query(models.RefreshToken).filter(models.RefreshToken.user_id == user_id).delete(synchronize_session=False)
+    changes.record(db, changes.UPDATE, models.Ride.user_id_taken == user_id)
+    db.query(models.User).filter(models.User.id == user_id).delete(synchronize_session=False)
+    # the seats given back and the cleared user_id_taken change rides on any route
+    invalidator.invalidate(db, user_id=user_id, rides=True)
+    db.commit()
+    if updated_rides:
+        _publish_rides(db, "update", models.Ride.id.in_(updated_rides))
 
 
-def activate_user(db: Session, user_login: str) -> schemas.User:
-    """Activates an user providing user login
+def _update_user(db: Session, user_login: str, condition, values: dict) -> Row | None:
+    """Updates an user by a single conditional UPDATE, returning the updated row with RETURNING where
+    the database supports it, otherwise (SQLite) reading it back by its login
 
     Args:
         db (Session): database session
         user_login (str): user login
+        condition: condition the user has to meet, like models.User.is_active == False
+        values (dict): new values
 
     Returns:
-        schemas.User
+        Row | None: updated user, None if there's no such user or it doesn't meet the condition
     """
-    user = get_user_by_login(db, user_login)
-    if user != None:
-        user.is_active = True
-        db.commit()
+    statement = update(models.User.__table__).where(models.User.login == user_login, condition).values(values)
+    invalidator.invalidate(db, user=user_login)
+    if db.get_bind().dialect.full_returning:
+        user = db.execute(statement.returning(*USER_ROW_COLUMNS)).first()
+    elif db.execute(statement).rowcount:
+        user = db.execute(select(*USER_ROW_COLUMNS).where(models.User.login == user_login)).first()
+    else:
+        user = None
+    db.commit()
     return user
 
+
+@traced
+def activate_user(db: Session, user_login: str) -> Row | None:
+    """Activates an inactive user providing user login
+
+    Args:
+        db (Session): database session
+        user_login (str): user login
+
+    Returns:
+        Row | None: None if there's no such user or it is already active
+    """
+    return _update_user(db, user_login, models.User.is_active == False, {"is_active": True})
+
+
+@traced
+def activate_user_with_code(db: Session, user_id: int, activation_code: str) -> bool:
+    """Activates an inactive user providing user id and its activation code
+
+    Args:
+        db (Session): database session
+        user_id (int): user id
+        activation_code (str): activation code generated by account creation
+
+    Returns:
+        bool: False if there's no such user, it is already active or the code is incorrect
+    """
+    activated = db.query(models.User).filter(models.User.id == user_id, models.User.is_active == False,
+                                             models.User.activation_code == activation_code) \
+        .update({models.User.is_active: True}, synchronize_session=False)
+    if activated:
+        invalidator.invalidate(db, user_id=user_id)
+    db.commit()
+    return activated > 0
+
         
-def deactivate_user(db: Session, user_login: str) -> schemas.User:
-    """Deactivates an user providing user login
+@traced
+def deactivate_user(db: Session, user_login: str) -> Row | None:
+    """Deactivates an active user providing user login, revoking all of the user's refresh token families
+    in the same transaction, so the user is signed out on every device
 
     Args:
         db (Session): database session
         user_login (str): user login
 
     Returns:
-        schemas.User
+        Row | None: None if there's no such user or it is already inactive
     """
-    user = get_user_by_login(db, user_login)
-    user.is_active = False
-    if user != None:
-        db.commit()
-    return user
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_id.in_(select(models.User.id).where(models.User.login == user_login)),
+        models.RefreshToken.revoked_at == None).update({models.RefreshToken.revoked_at: datetime.utcnow()},
+                                                       synchronize_session=False)
+    return _update_user(db, user_login, models.User.is_active == True, {"is_active": False})
 
 
-def grant_admin_status(db: Session, user_login: str) -> schemas.User:
+@traced
+def grant_admin_status(db: Session, user_login: str) -> Row | None:
     """Grants the admin status to an user providing user login
 
     Args:
@@ -110,16 +254,13 @@ def grant_admin_status(db: Session, user_login: str) -> schemas.User:
         user_login (str): user login
 
     Returns:
-        schemas.User
+        Row | None: None if there's no such user or it is already an admin
     """
-    user = get_user_by_login(db, user_login)
-    if user is not None:
-        user.is_admin = True
-        db.commit()
-    return user
+    return _update_user(db, user_login, models.User.is_admin == False, {"is_admin": True})
 
 
-def remove_admin_status(db: Session, user_login: str) -> schemas.User:
+@traced
+def remove_admin_status(db: Session, user_login: str) -> Row | None:
     """Takes the admin status from an user providing user login
 
     Args:
@@ -127,16 +268,71 @@ def remove_admin_status(db: Session, user_login: str) -> schemas.User:
         user_login (str): user login
 
     Returns:
-        schemas.User
+        Row | None: None if there's no such user or it is not an admin
     """
-    user = get_user_by_login(db, user_login)
-    if user is not None:
-        user.is_admin = False
+    return _update_user(db, user_login, models.User.is_admin == True, {"is_admin": False})
+
+
+@traced
+def create_refresh_token(db: Session, user_id: int, expires_delta: timedelta, family: str | None = None) -> str:
+    """Issues a refresh token for an user, storing only its hash
+
+    Args:
+        db (Session): database session
+        user_id (int): user ID
+        expires_delta (timedelta): time until the token expires
+        family (str | None, optional): family of the rotated token, None starts a new one. Defaults to None.
+
+    Returns:
+        str: refresh token
+    """
+    token = SecurityUtils.create_refresh_token()
+    db.add(models.RefreshToken(user_id = user_id, token_hash = SecurityUtils.hash_refresh_token(token),
+                               family = family or secrets.token_hex(16), expires_at = datetime.utcnow() + expires_delta))
+    db.commit()
+    return token
+
+
+@traced
+def rotate_refresh_token(db: Session, token: str, expires_delta: timedelta) -> tuple[str, str] | None:
+    """Exchanges a refresh token for a new one. Each token can be used once:
+    presenting an already used token revokes its whole family, as it has likely been stolen.
+    Only active users can refresh, an inactive user has to sign in with the password again.
+
+    Args:
+        db (Session): database session
+        token (str): refresh token
+        expires_delta (timedelta): time until the new token expires
+
+    Returns:
+        tuple[str, str] | None: user login and the new refresh token, None if the token is not valid
+    """
+    now = datetime.utcnow()
+    found = db.query(models.RefreshToken, models.User.login) \
+        .join(models.User, and_(models.User.id == models.RefreshToken.user_id, models.User.is_active == True)) \
+        .filter(models.RefreshToken.token_hash == SecurityUtils.hash_refresh_token(token)).first()
+    if found is None:
+        return None
+    stored, login = found
+    if stored.revoked_at is not None:
+        db.query(models.RefreshToken).filter(models.RefreshToken.family == stored.family,
+                                             models.RefreshToken.revoked_at == None).update(
+            {models.RefreshToken.revoked_at: now}, synchronize_session=False)
         db.commit()
-    return user
+        return None
+    active = select(models.User.id).where(models.User.id == models.RefreshToken.user_id, models.User.is_active == True).exists()
+    used = db.query(models.RefreshToken).filter(models.RefreshToken.id == stored.id, models.RefreshToken.revoked_at == None,
+                                                models.RefreshToken.expires_at > now, active).update(
+        {models.RefreshToken.revoked_at: now}, synchronize_session=False)
+    if not used:
+        db.rollback()
+        return None
+    return login, create_refresh_token(db, stored.user_id, expires_delta, family=stored.family)
+
     
 #rides
 
+@traced
 def get_ride_by_ID (db: "Session", ride_id: int) -> schemas.Ride:
     """Gets ride providing ride id
 
@@ -151,65 +347,143 @@ def get_ride_by_ID (db: "Session", ride_id: int) -> schemas.Ride:
     return ride
     
 
-def get_rides_by_start_city(db: Session, start_city: str) -> schemas.Ride:
-    """Gets all active rides from a given city
+# list queries select these columns (the fields of schemas.Ride) as plain rows, skipping the ORM instances,
+# their identity map entries and change tracking
+RIDE_ROW_COLUMNS = tuple(getattr(models.Ride, field) for field in schemas.Ride.model_fields)
+
+
+def _filter_and_order_rides(query: Query, departure_from: datetime | None = None, departure_to: datetime | None = None,
+                            order: RideOrder = RideOrder.departure_asc) -> Query:
+    """Narrows a rides query to the given departure date range and applies ordering.
+    Both bounds are inclusive. Ties are broken by ride id so that results are stable.
+
+    Args:
+        query (Query): rides query
+        departure_from (datetime | None, optional): earliest departure date. Defaults to None.
+        departure_to (datetime | None, optional): latest departure date. Defaults to None.
+        order (RideOrder, optional): ordering of the results. Defaults to RideOrder.departure_asc.
+
+    Returns:
+        Query
+    """
+    if departure_from is not None:
+        query = query.filter(models.Ride.departure_date >= departure_from)
+    if departure_to is not None:
+        query = query.filter(models.Ride.departure_date <= departure_to)
+    order_by = {
+        RideOrder.departure_asc: (models.Ride.departure_date.asc(), models.Ride.id.asc()),
+        RideOrder.departure_desc: (models.Ride.departure_date.desc(), models.Ride.id.desc()),
+        RideOrder.price_asc: (models.Ride.price.asc(), models.Ride.id.asc()),
+        RideOrder.price_desc: (models.Ride.price.desc(), models.Ride.id.desc()),
+    }[order]
+    return query.order_by(*order_by)
+
+
+def _cached_rides(key: tuple, load: Callable[[], list[Row]]) -> list[Row]:
+    """Gets a ride list from the ride list cache, loading and caching it on a miss. Loads it straight while the cache is disabled
+
+    Args:
+        key (tuple): start city, destination city (None for any) and the rest of the query
+        load (Callable[[], list[Row]]): runs the query
+
+    Returns:
+        list[Row]: rides
+    """
+    if not invalidator.enabled:
+        return load()
+    rides = ride_list_cache.get(key)
+    if rides is None:
+        generation = ride_list_cache.generation
+        rides = load()
+        ride_list_cache.set(key, rides, generation)
+    return rides
+
+
+@traced
+def get_rides_by_start_city(db: Session, start_city: str, departure_from: datetime | None = None,
+                            departure_to: datetime | None = None, order: RideOrder = RideOrder.departure_asc) -> list[Row]:
+    """Gets all active rides from a given city. Optionally providing departure date range and ordering
 
     Args:
         db (Session): database session
         start_city (str): starting city
+        departure_from (datetime | None, optional): earliest departure date. Defaults to None.
+        departure_to (datetime | None, optional): latest departure date. Defaults to None.
+        order (RideOrder, optional): ordering of the results. Defaults to RideOrder.departure_asc.
 
     Returns:
-        schemas.Ride
+        list[Row]: rides as read-only rows with the schemas.Ride fields
     """
-    rides = db.query(models.Ride).filter(and_(models.Ride.start_city == start_city, models.Ride.is_active == True)).all()
-    return rides
+    query = db.query(*RIDE_ROW_COLUMNS).filter(and_(models.Ride.start_city == start_city, models.Ride.is_active == True))
+    return _cached_rides((start_city, None, departure_from, departure_to, order),
+                         lambda: _filter_and_order_rides(query, departure_from, departure_to, order).all())
 
 
-def get_rides_by_destination_city(db: Session, destination_city: str) -> schemas.Ride:
-    """Gets all active rides to a given city
+@traced
+def get_rides_by_destination_city(db: Session, destination_city: str, departure_from: datetime | None = None,
+                                  departure_to: datetime | None = None, order: RideOrder = RideOrder.departure_asc) -> list[Row]:
+    """Gets all active rides to a given city. Optionally providing departure date range and ordering
 
     Args:
         db (Session): database session
         destination_city (str): destination city
+        departure_from (datetime | None, optional): earliest departure date. Defaults to None.
+        departure_to (datetime | None, optional): latest departure date. Defaults to None.
+        order (RideOrder, optional): ordering of the results. Defaults to RideOrder.departure_asc.
 
     Returns:
-        schemas.Ride
+        list[Row]: rides as read-only rows with the schemas.Ride fields
     """
-    rides = db.query(models.Ride).filter(and_(models.Ride.destination_city == destination_city, models.Ride.is_active == True)).all()
-    return rides
+    query = db.query(*RIDE_ROW_COLUMNS).filter(and_(models.Ride.destination_city == destination_city, models.Ride.is_active == True))
+    return _cached_rides((None, destination_city, departure_from, departure_to, order),
+                         lambda: _filter_and_order_rides(query, departure_from, departure_to, order).all())
 
 
-def get_rides_by_cities(db: Session, start_city: str, destination_city: str) -> schemas.Ride:
-    """Gets all active rides from a given city to a second given city
+@traced
+def get_rides_by_cities(db: Session, start_city: str, destination_city: str, departure_from: datetime | None = None,
+                        departure_to: datetime | None = None, order: RideOrder = RideOrder.departure_asc) -> list[Row]:
+    """Gets all active rides from a given city to a second given city. Optionally providing departure date range and ordering.
+    Served by the ix_rides_route_departure index as a single range scan.
 
     Args:
         db (Session): database session
         start_city (str): starting city
         destination_city (str): destination city
+        departure_from (datetime | None, optional): earliest departure date. Defaults to None.
+        departure_to (datetime | None, optional): latest departure date. Defaults to None.
+        order (RideOrder, optional): ordering of the results. Defaults to RideOrder.departure_asc.
 
     Returns:
-        schemas.Ride
+        list[Row]: rides as read-only rows with the schemas.Ride fields
     """
-    rides = db.query(models.Ride).filter(and_(models.Ride.destination_city == destination_city,
-                                        models.Ride.start_city == start_city,models.Ride.is_active == True)).all()
-    return rides
+    query = db.query(*RIDE_ROW_COLUMNS).filter(and_(models.Ride.destination_city == destination_city,
+                                        models.Ride.start_city == start_city,models.Ride.is_active == True))
+    return _cached_rides((start_city, destination_city, departure_from, departure_to, order),
+                         lambda: _filter_and_order_rides(query, departure_from, departure_to, order).all())
 
 
-def get_all_rides(db: Session, skip: int = 0, limit: int = 50) -> schemas.Ride:
-    """Gets all active rides. Optionally providing offset and limit values
+@traced
+def get_all_rides(db: Session, skip: int = 0, limit: int = 50, departure_from: datetime | None = None,
+                  departure_to: datetime | None = None, order: RideOrder = RideOrder.departure_asc) -> list[Row]:
+    """Gets all active rides. Optionally providing offset and limit values, departure date range and ordering
 
     Args:
         db (Session): database session
         skip (int, optional): skips x first records. Defaults to 0.
         limit (int, optional): limits to x records. Defaults to 50.
+        departure_from (datetime | None, optional): earliest departure date. Defaults to None.
+        departure_to (datetime | None, optional): latest departure date. Defaults to None.
+        order (RideOrder, optional): ordering of the results. Defaults to RideOrder.departure_asc.
 
     Returns:
-        schemas.Ride
+        list[Row]: rides as read-only rows with the schemas.Ride fields
     """
-    rides = db.query(models.Ride).filter(models.Ride.is_active == True).offset(skip).limit(limit).all()
-    return rides
+    query = db.query(*RIDE_ROW_COLUMNS).filter(models.Ride.is_active == True)
+    return _cached_rides((None, None, skip, limit, departure_from, departure_to, order),
+                         lambda: _filter_and_order_rides(query, departure_from, departure_to, order).offset(skip).limit(limit).all())
     
 
+@traced
 def create_ride(db: Session, new_ride: schemas.RideCreate) -> schemas.Ride:
     """Creates a ride based on the RideCreate schema
 
@@ -223,20 +497,28 @@ def create_ride(db: Session, new_ride: schemas.RideCreate) -> schemas.Ride:
     ride = models.Ride(start_city = new_ride.start_city, destination_city = new_ride.destination_city,
                        distance = new_ride.distance, km_fee = new_ride.km_fee,
                        departure_date = new_ride.departure_date, price = round(new_ride.km_fee * new_ride.distance, 2),
-                       is_active = True, user_id_taken = None)
+                       is_active = True, user_id_taken = None, seats = new_ride.seats, seats_available = new_ride.seats)
     db.add(ride)
+    db.flush()
+    analytics.record(db, ride.id, rides=1, seats=models.Ride.seats)
+    changes.record(db, changes.INSERT, models.Ride.id == ride.id)
+    ride_feed.notify(db, "create", models.Ride.id == ride.id)
+    invalidator.invalidate(db, route=[ride.start_city, ride.destination_city])
     db.commit()
     db.refresh(ride)
-    return schemas.Ride.from_orm(ride)
+    created = schemas.Ride.from_orm(ride)
+    ride_feed.publish("create", created.model_dump())
+    return created
 
 
-def archivise_ride(db: Session, ride_id: int, user_id_taken: int) -> schemas.Ride:
-    """Archivises a ride and binds it with id of the user who booked it providing ride id
+@traced
+def archivise_ride(db: Session, ride_id: int, user_id_taken: int | None = None) -> schemas.Ride:
+    """Archivises a ride providing ride id, optionally binding it with id of the user who booked it
 
     Args:
         db (Session): database session
         ride_id (int): ride id
-        user_id_taken (int): id of the user who booked the ride
+        user_id_taken (int | None, optional): id of the user who booked the ride. Defaults to None, keeping the current one.
 
     Returns:
         schemas.Ride
@@ -244,13 +526,142 @@ def archivise_ride(db: Session, ride_id: int, user_id_taken: int) -> schemas.Rid
     ride = db.query(models.Ride).filter(models.Ride.id == ride_id).first()
     if ride != None:
         ride.is_active = False
-        ride.user_id_taken = user_id_taken
+        if user_id_taken is not None:
+            ride.user_id_taken = user_id_taken
+        db.flush()
+        changes.record(db, changes.UPDATE, models.Ride.id == ride_id)
+        ride_feed.notify(db, "archive", models.Ride.id == ride_id)
+        invalidator.invalidate(db, route=[ride.start_city, ride.destination_city])
         db.commit()
+        if ride_feed.publishing:
+            ride_feed.publish("archive", schemas.Ride.from_orm(ride).model_dump())
     return ride
 
 
+def _publish_rides(db: Session, event: str, condition):
+    """Publishes a change of the matching rides to the live feed of this worker, after the commit,
+    reading the rides only while anyone is subscribed
+
+    Args:
+        db (Session): database session
+        event (str): event type
+        condition: SQL condition on the rides, e.g. models.Ride.id == ride_id
+    """
+    if ride_feed.publishing:
+        for ride in db.execute(select(*RIDE_ROW_COLUMNS).where(condition)):
+            ride_feed.publish(event, ride._asdict())
+
+
+# SQLSTATE of "tuple to be locked was already moved to another partition due to concurrent update"
+SERIALIZATION_FAILURE = "40001"
+
+
+@traced
+def reserve_ride(db: Session, ride_id: int, user_id: int, seats: int = 1) -> models.Booking | None:
+    """Reserves seats on an active ride and records the booking.
+
+    Seats are taken with a single conditional UPDATE decrementing the seat counter, so the row
+    lock is held only for the duration of that statement and concurrent bookers can never oversell the ride.
+    The ride is archivised when its last seat is taken. On partitioned PostgreSQL storage (app.partitions) archivising moves
+    the row to another partition, and a concurrent booker of the moved row fails with a serialization error: it lost
+    the race for the last seats, so it gets no booking like a booker finding the ride full. The booking is added to the route analytics as a delta row,
+    so concurrent bookings of a route don't wait on each other's stats, and the ride change to the change log.
+
+    Args:
+        db (Session): database session
+        ride_id (int): ride id
+        user_id (int): id of the user who books the ride
+        seats (int, optional): number of seats to book. Defaults to 1.
+
+    Returns:
+        models.Booking | None: None if the ride is inactive or has not enough seats left
+    """
+    try:
+        reserved = db.query(models.Ride).filter(models.Ride.id == ride_id, models.Ride.is_active == True,
+                                                models.Ride.seats_available >= seats).update(
+            {models.Ride.seats_available: models.Ride.seats_available - seats,
+             models.Ride.is_active: models.Ride.seats_available > seats,
+             # bookings are the record of who took a shared ride, only a single-seat ride names its passenger
+             models.Ride.user_id_taken: case((models.Ride.seats == 1, user_id), else_=models.Ride.user_id_taken)},
+            synchronize_session=False)
+    except OperationalError as error:
+        if getattr(error.orig, "pgcode", None) != SERIALIZATION_FAILURE:
+            raise
+        reserved = 0
+    if not reserved:
+        db.rollback()
+        return None
+    booking = models.Booking(ride_id = ride_id, user_id = user_id, seats = seats)
+    db.add(booking)
+    analytics.record(db, ride_id, bookings=1, seats_booked=seats, revenue=models.Ride.price * seats)
+    changes.record(db, changes.UPDATE, models.Ride.id == ride_id)
+    ride_feed.notify(db, "reserve", models.Ride.id == ride_id)
+    if invalidator.active:
+        # the ride loaded by the caller is taken from the session, not read again
+        ride = db.get(models.Ride, ride_id)
+        invalidator.invalidate(db, route=[ride.start_city, ride.destination_city])
+    db.commit()
+    _publish_rides(db, "reserve", models.Ride.id == ride_id)
+    return booking
+
+
+BOOKED_RIDE_COLUMNS = (models.Booking.id.label("booking_id"), models.Booking.seats.label("seats_booked"),
+                       models.Booking.created_at.label("booked_at"), *RIDE_ROW_COLUMNS)
+
+
+@traced
+def get_booked_rides(db: Session, user_id: int, before: int | None = None, limit: int = 50) -> list[Row]:
+    """Gets the bookings of an user along with the booked rides, newest first.
+    Pages are keyset paginated on the booking id, read by a range scan of the (user_id, id) bookings index.
+
+    Args:
+        db (Session): database session
+        user_id (int): user id
+        before (int | None, optional): booking id of the last booking of the previous page. Defaults to None, the first page.
+        limit (int, optional): limits to x records. Defaults to 50.
+
+    Returns:
+        list[Row]: read-only rows with the schemas.BookedRide fields
+    """
+    query = db.query(*BOOKED_RIDE_COLUMNS).join(models.Ride, models.Ride.id == models.Booking.ride_id) \
+        .filter(models.Booking.user_id == user_id)
+    if before is not None:
+        query = query.filter(models.Booking.id < before)
+    return query.order_by(models.Booking.id.desc()).limit(limit).all()
+
+
+@traced
+def archivise_expired_rides(db: Session, now: datetime, batch_size: int = 500) -> int:
+    """Archivises one batch of active rides which departure date has already passed, oldest first.
+    The batch is picked, then updated and added to the change log in its own short transaction;
+    on PostgreSQL rows locked by concurrent bookings are skipped and picked up by a later batch.
+    Nothing is published to the live feed, the clients drop the departed rides by their departure date.
+
+    Args:
+        db (Session): database session
+        now (datetime): current date
+        batch_size (int, optional): maximum number of rides to archivise. Defaults to 500.
+
+    Returns:
+        int: number of archivised rides
+    """
+    expired = select(models.Ride.id).where(models.Ride.is_active == True, models.Ride.departure_date < now) \
+        .order_by(models.Ride.departure_date).limit(batch_size).with_for_update(skip_locked=True)
+    ride_ids = db.execute(expired).scalars().all()
+    if not ride_ids:
+        db.commit()
+        return 0
+    archivised = db.query(models.Ride).filter(models.Ride.id.in_(ride_ids), models.Ride.is_active == True) \
+        .update({models.Ride.is_active: False}, synchronize_session=False)
+    changes.record(db, changes.UPDATE, models.Ride.id.in_(ride_ids))
+    invalidator.invalidate(db, rides=True)
+    db.commit()
+    return archivised
+
+
+@traced
 def remove_ride(db: Session, ride_id: int):
-    """Removing a ride from the database providing ride id
+    """Removing a ride from the database along with its bookings providing ride id, taking them out of the route analytics
 
     Args:
         db (Session): database session
@@ -258,5 +669,16 @@ def remove_ride(db: Session, ride_id: int):
     """
     ride = db.query(models.Ride).filter(models.Ride.id == ride_id).first()
     if ride != None:
+        bookings = db.query(models.Booking).filter(models.Booking.ride_id == ride_id)
+        seats_booked = bookings.with_entities(func.coalesce(func.sum(models.Booking.seats), 0)).scalar_subquery()
+        analytics.record(db, ride_id, rides=-1, seats=-models.Ride.seats,
+                         bookings=-bookings.with_entities(func.count(models.Booking.id)).scalar_subquery(),
+                         seats_booked=-seats_booked, revenue=-seats_booked * models.Ride.price)
+        deleted = {"id": ride.id, "start_city": ride.start_city, "destination_city": ride.destination_city}
+        changes.record(db, changes.DELETE, models.Ride.id == ride_id)
+        ride_feed.notify(db, "delete", models.Ride.id == ride_id, fields=("id", "start_city", "destination_city"))
+        bookings.delete(synchronize_session=False)
         db.delete(ride)
-        db.commit()
\ No newline at end of file
+        invalidator.invalidate(db, route=[ride.start_city, ride.destination_city])
+        db.commit()
+        ride_feed.publish("delete", deleted)
\ No newline at end of file
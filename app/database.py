@@ -1,26 +1,79 @@
-from sqlalchemy import create_engine
+from functools import lru_cache
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
+from .config import Envs
+
+# engines and session makers are created on first use, so importing the app never touches the database
 
 #actual database
 
-SQLALCHEMY_DATABASE_URL = "postgresql://myuser:secret@db:5432/rides_db"
+@lru_cache
+def get_engine() -> Engine:
+    """Creates the engine of the database set by DATABASE_URL. PostgreSQL connection pool
+    is sized with DB_POOL_SIZE and DB_MAX_OVERFLOW, set per worker by app.serve.
+
+    Returns:
+        Engine
+    """
+    if make_url(Envs.DATABASE_URL).get_backend_name() == "postgresql":
+        return create_engine(Envs.DATABASE_URL, pool_pre_ping=True,
+                             pool_size=int(Envs.DB_POOL_SIZE), max_overflow=int(Envs.DB_MAX_OVERFLOW))
+    return create_engine(Envs.DATABASE_URL, pool_pre_ping=True)
+
 
-engine = create_engine (SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker (autocommit=False, autoflush=False, bind=engine)
+@lru_cache
+def get_session_local() -> sessionmaker:
+    """Creates the session maker bound to the actual database
+
+    Returns:
+        sessionmaker
+    """
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
 
 #tests database
 
-engine_tests = create_engine(
-    "sqlite://",
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool
-)
+@lru_cache
+def get_test_engine() -> Engine:
+    """Creates the SQLite engine used by the tests: a file set by TEST_DATABASE_URL (one per test worker)
+    or an in-memory database. SAVEPOINTs are enabled, so every test can run in a transaction rolled back at its end.
 
+    Returns:
+        Engine
+    """
+    url = Envs.TEST_DATABASE_URL
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    else:
+        engine = create_engine(url, connect_args={"check_same_thread": False})
 
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine_tests)
+    # pysqlite begins transactions on its own and breaks SAVEPOINTs, let SQLAlchemy emit BEGIN instead
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
 
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    return engine
 
-Base = declarative_base()
 
+_lazy_attributes = {
+    "engine": get_engine,
+    "SessionLocal": get_session_local,
+    "engine_tests": get_test_engine,
+}
+
+
+def __getattr__(name: str):
+    """Resolves engine, SessionLocal and engine_tests on first access
+    """
+    if name in _lazy_attributes:
+        return _lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+Base = declarative_base()
@@ -1,57 +1,36 @@
-import os
-from dotenv import load_dotenv
+from functools import lru_cache
 from typing import Annotated
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from fastapi.security import OAuth2PasswordBearer
-from .database import SessionLocal, TestingSessionLocal
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from .config import Envs
+from .database import get_engine, get_session_local
+from .ratelimit import LoginRateLimiter, Limit, InMemoryBackend, PostgresBackend
 from . import crud, schemas
 
 
-load_dotenv("./.env")
-
-
-class Envs:
-   """Environmental variables
-   """ 
-   SECRET_KEY=os.getenv('SECRET_KEY')
-   ALGORITHM=os.getenv('ALGORITHM')
-
-
 def get_db():
     """Tries to yield database session maker and closes it in any case
 
     Yields:
         Iterator[SessionLocal]
     """
-    db = SessionLocal()
+    db = get_session_local()()
     try:
         yield db
     finally:
         db.close()
 
 
-def override_get_db():
-    """Tries to yield in-memory database session maker and closes it in any case
-
-    Yields:
-        Iterator[SessionLocal]
-    """
-    try:
-        db = TestingSessionLocal()
-        yield db
-    finally:
-        db.close()
-
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)) -> schemas.User:
     """Creates an user dependency based on a token and database session dependency.
     Uses JWT (JSON Web Token) to decode a token and get an username (subject), then uses it
-    to get an user schemas.User object
+    to get an user schemas.User object, from the user cache while it is enabled
 
     Args:
         token (Annotated[str, Depends): depended on oauth2 scheme
@@ -78,7 +57,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Se
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_login(db, user_login=token_data.username)
+    user = crud.get_cached_user_by_login(db, user_login=token_data.username)
     if user is None:
         raise credentials_exception
     return user
@@ -124,4 +103,45 @@ async def get_current_active_admin(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not a superuser."
             )
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+@lru_cache
+def get_login_limiter() -> LoginRateLimiter:
+    """Creates the login rate limiter dependency, configured with environmental variables.
+    RATE_LIMIT_BACKEND=postgres shares the limits between workers.
+
+    Returns:
+        LoginRateLimiter
+    """
+    if Envs.RATE_LIMIT_BACKEND == "postgres":
+        backend = PostgresBackend(get_engine())
+    else:
+        backend = InMemoryBackend()
+    return LoginRateLimiter(backend=backend,
+                            ip_limit=Limit(float(Envs.LOGIN_IP_BURST), float(Envs.LOGIN_IP_PER_MINUTE)),
+                            login_limit=Limit(float(Envs.LOGIN_USER_BURST), float(Envs.LOGIN_USER_PER_MINUTE)),
+                            max_concurrent=int(Envs.LOGIN_MAX_CONCURRENT))
+
+
+async def login_rate_limit(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+                           limiter: Annotated[LoginRateLimiter, Depends(get_login_limiter)]) -> LoginRateLimiter:
+    """Creates a rate limited login dependency, rejecting the attempt before any database or bcrypt work.
+
+    Args:
+        request (Request): incoming request
+        form_data (Annotated[OAuth2PasswordRequestForm, Depends): login form
+        limiter (Annotated[LoginRateLimiter, Depends): depended on get_login_limiter
+
+    Raises:
+        HTTPException: 429 when the client IP or the login runs out of attempts
+
+    Returns:
+        LoginRateLimiter: the limiter, to admit the password verification
+    """
+    client_ip = request.client.host if request.client else "unknown"
+    if limiter.backend.blocking:
+        await run_in_threadpool(limiter.check, client_ip, form_data.username)
+    else:
+        limiter.check(client_ip, form_data.username)
+    return limiter
@@ -0,0 +1,233 @@
+"""Live ride feed: ride changes pushed to the subscribed clients as Server-Sent Events.
+
+The crud ride mutations publish an event (create, reserve, update, archive, delete) after their commit.
+The event is encoded once and put into the buffer of every subscriber of its route, of its start
+or destination city and of all rides. Buffers are bounded: the buffer of a subscriber falling behind
+is dropped for a lagged event, after which the client should refetch the rides, so a slow client
+never holds up the publishers nor the memory.
+
+Subscribers are kept per worker. On PostgreSQL the feed is shared: the mutations send their events with NOTIFY
+in their transaction (notify) and the listener of every worker (app.cache.InvalidationListener) delivers them
+to its subscribers (receive), so a client sees the changes made through any worker. While the listener is
+disconnected events are missed, the subscribers get a lagged event. Other databases serve a single worker,
+which publishes its changes to its subscribers directly (publish).
+"""
+import asyncio
+import json
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator
+from sqlalchemy import Text, cast, func, literal, select
+from sqlalchemy.orm import Session
+from .config import Envs
+from .metrics import metrics
+from . import models, schemas
+
+
+KEEPALIVE = b": keepalive\n\n"
+CHANNEL = "ride_feed"
+
+
+def encode(event: str, data: dict) -> bytes:
+    """Encodes a Server-Sent Event
+
+    Args:
+        event (str): event type
+        data (dict): event data, serialized as JSON
+
+    Returns:
+        bytes: the event frame
+    """
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'), default=datetime.isoformat)}\n\n".encode("utf-8")
+
+
+LAGGED = encode("lagged", {"message": "events were dropped, refetch the rides"})
+
+
+class Subscriber:
+    """Feed subscription of a client: its route filter and the buffer of the encoded events
+    """
+    def __init__(self, start_city: str | None, destination_city: str | None, buffer_size: int):
+        self.key = (start_city, destination_city)
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=buffer_size)
+
+
+class RideFeed:
+    """Publish/subscribe of the ride changes to the subscribers of this worker
+    """
+    def __init__(self, buffer_size: int | None = None, heartbeat: float | None = None):
+        """
+        Args:
+            buffer_size (int | None, optional): events buffered per subscriber. Defaults to FEED_BUFFER_SIZE.
+            heartbeat (float | None, optional): seconds of silence before a keepalive comment. Defaults to FEED_HEARTBEAT_SECONDS.
+        """
+        self._buffer_size = buffer_size
+        self._heartbeat = heartbeat
+        self.subscribers: defaultdict[tuple[str | None, str | None], set[Subscriber]] = defaultdict(set)
+        self.count = 0
+        # set by the app on PostgreSQL, while the listener delivers the events of all the workers
+        self.shared = False
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+
+    @property
+    def buffer_size(self) -> int:
+        return self._buffer_size if self._buffer_size is not None else int(Envs.FEED_BUFFER_SIZE)
+
+
+    @property
+    def heartbeat(self) -> float:
+        return self._heartbeat if self._heartbeat is not None else float(Envs.FEED_HEARTBEAT_SECONDS)
+
+
+    @property
+    def active(self) -> bool:
+        return self.count > 0
+
+
+    @property
+    def publishing(self) -> bool:
+        """Whether publish() delivers anything: the feed isn't shared and this worker has subscribers
+        """
+        return self.active and not self.shared
+
+
+    def subscribe(self, start_city: str | None = None, destination_city: str | None = None) -> Subscriber:
+        """Subscribes to the changes of the rides of a route, from or to a city, or of all rides.
+        Runs in the event loop of the worker.
+
+        Args:
+            start_city (str | None, optional): start city. Defaults to None (any).
+            destination_city (str | None, optional): destination city. Defaults to None (any).
+
+        Returns:
+            Subscriber
+        """
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(start_city, destination_city, self.buffer_size)
+        self.subscribers[subscriber.key].add(subscriber)
+        self.count += 1
+        metrics.set("feed.subscribers", self.count)
+        return subscriber
+
+
+    def unsubscribe(self, subscriber: Subscriber):
+        """Ends a subscription
+
+        Args:
+            subscriber (Subscriber): subscription
+        """
+        subscribers = self.subscribers.get(subscriber.key)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self.subscribers[subscriber.key]
+        self.count -= 1
+        metrics.set("feed.subscribers", self.count)
+
+
+    def notify(self, db: Session, event: str, condition, fields: tuple[str, ...] | None = None):
+        """Sends a change of the matching rides to the feeds of all the workers, in the transaction of the change,
+        delivered on its commit. Does nothing unless the feed is shared
+
+        Args:
+            db (Session): database session, before the commit
+            event (str): event type
+            condition: SQL condition on the rides, e.g. models.Ride.id == ride_id
+            fields (tuple[str, ...] | None, optional): ride fields sent. Defaults to None, the schemas.Ride fields.
+        """
+        if not self.shared:
+            return
+        columns = [models.Ride.__table__.c[field] for field in (fields or schemas.Ride.model_fields)]
+        ride = func.json_build_object(*(part for column in columns for part in (cast(literal(column.key), Text), column)))
+        payload = func.json_build_object(cast(literal("event"), Text), cast(literal(event), Text),
+                                         cast(literal("ride"), Text), ride)
+        db.execute(select(func.pg_notify(CHANNEL, cast(payload, Text))).where(condition))
+
+
+    def receive(self, payload: str):
+        """Publishes an event sent by notify, in the event loop of the listener
+
+        Args:
+            payload (str): notification payload
+        """
+        message = json.loads(payload)
+        self._publish(message["event"], message["ride"])
+
+
+    def publish(self, event: str, ride: dict):
+        """Publishes a ride change to its subscribers, unless the feed is shared and the change is sent by notify.
+        Safe to call from any thread, the event is delivered in the event loop of the subscribers.
+
+        Args:
+            event (str): event type
+            ride (dict): ride fields, at least start_city and destination_city
+        """
+        if not self.shared:
+            self._publish(event, ride)
+
+
+    def _publish(self, event: str, ride: dict):
+        if not self.active:
+            return
+        frame = encode(event, ride)
+        start_city, destination_city = ride["start_city"], ride["destination_city"]
+        keys = {(start_city, destination_city), (start_city, None), (None, destination_city), (None, None)}
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._deliver(frame, keys)
+        elif self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._deliver, frame, keys)
+
+
+    def _deliver(self, frame: bytes, keys: set[tuple[str | None, str | None]]):
+        for key in keys:
+            for subscriber in self.subscribers.get(key, ()):
+                try:
+                    subscriber.queue.put_nowait(frame)
+                except asyncio.QueueFull:
+                    self._lag(subscriber)
+        metrics.inc("feed.events")
+
+
+    def _lag(self, subscriber: Subscriber):
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(LAGGED)
+        metrics.inc("feed.lagged")
+
+
+    def lagged(self):
+        """Tells every subscriber that events were missed, e.g. while the listener was disconnected.
+        Runs in the event loop of the worker
+        """
+        for subscribers in self.subscribers.values():
+            for subscriber in subscribers:
+                self._lag(subscriber)
+
+
+    async def stream(self, subscriber: Subscriber) -> AsyncIterator[bytes]:
+        """Streams the events of a subscription, with keepalive comments in the silence, until the client disconnects
+
+        Args:
+            subscriber (Subscriber): subscription, ended along with the stream
+
+        Yields:
+            bytes: event frames
+        """
+        try:
+            yield encode("subscribed", {"start_city": subscriber.key[0], "destination_city": subscriber.key[1]})
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE
+        finally:
+            self.unsubscribe(subscriber)
+
+
+ride_feed = RideFeed()
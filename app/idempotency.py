@@ -0,0 +1,326 @@
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from starlette.responses import Response
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+from . import models
+from .metrics import metrics
+from .utils import Envs
+
+
+class StoredResponse:
+    """Compact copy of a finished response kept for replaying duplicates
+    """
+    __slots__ = ("fingerprint", "status_code", "body", "expires_at")
+
+    def __init__(self, fingerprint: str, status_code: int, body: bytes, expires_at: datetime):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.body = body
+        self.expires_at = expires_at
+
+
+    def to_response(self) -> Response:
+        """Rebuilds the stored response, marked as a replay
+
+        Returns:
+            Response
+        """
+        return Response(content=self.body, status_code=self.status_code, media_type="application/json",
+                        headers={"Idempotent-Replayed": "true"})
+
+
+class IdempotencyGuard:
+    """Handle given to the endpoint for a single idempotent request.
+    Holds the replayed response for duplicates or saves the response of the first request
+    """
+    def __init__(self, digest: str | None, fingerprint: str, replay: Response | None = None, claimed_at: datetime | None = None):
+        self.digest = digest
+        self.fingerprint = fingerprint
+        self.replay = replay
+        self.claimed_at = claimed_at
+        self.saved: StoredResponse | None = None
+
+
+    def save(self, response: Response) -> Response:
+        """Marks the response to be stored for replays. Only successful responses are stored,
+        so a retry after an error does the work again.
+
+        Args:
+            response (Response): response of the first request
+
+        Returns:
+            Response: the same response
+        """
+        if self.digest is not None and response.status_code < 400:
+            self.saved = StoredResponse(self.fingerprint, response.status_code, bytes(response.body),
+                                        datetime.utcnow() + IdempotencyStore.ttl())
+        return response
+
+
+class IdempotencyStore:
+    """Idempotency keys store: the idempotency_keys table, fronted by an in-memory LRU hot cache.
+
+    Concurrent duplicates inside a worker wait on a per-key lock, duplicates in other workers
+    wait for the claim row inserted by the first request to be completed, polling less and less often.
+    Duplicates wait up to IDEMPOTENCY_WAIT_SECONDS. A claim is a lease of IDEMPOTENCY_LEASE_SECONDS, renewed while its request
+    is in progress however long it takes: if the request never completes (its worker died), a later request takes
+    the key over once the lease expires. Completed keys are kept for IDEMPOTENCY_KEY_TTL_HOURS.
+    """
+    def __init__(self, cache_size: int = 10_000, poll_interval: float = 0.05, max_poll_interval: float = 1.0):
+        self.cache_size = cache_size
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._cache: OrderedDict[str, StoredResponse] = OrderedDict()
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+
+    @staticmethod
+    def ttl() -> timedelta:
+        """Gets how long the responses are kept for replays
+
+        Returns:
+            timedelta
+        """
+        return timedelta(hours=int(Envs.IDEMPOTENCY_KEY_TTL_HOURS or 24))
+
+
+    @staticmethod
+    def lease() -> timedelta:
+        """Gets how long a key is held by a request in progress before another request can take it over
+
+        Returns:
+            timedelta
+        """
+        return timedelta(seconds=float(Envs.IDEMPOTENCY_LEASE_SECONDS or 60))
+
+
+    @staticmethod
+    def digest(scope: str, key: str) -> str:
+        """Gets a fixed size digest of the key, bound to the endpoint and the caller
+
+        Args:
+            scope (str): endpoint and caller identity
+            key (str): Idempotency-Key header value
+
+        Returns:
+            str: sha256 hex digest
+        """
+        return hashlib.sha256(f"{scope}\n{key}".encode()).hexdigest()
+
+
+    def _cached(self, digest: str) -> StoredResponse | None:
+        stored = self._cache.get(digest)
+        if stored is None:
+            return None
+        if stored.expires_at <= datetime.utcnow():
+            del self._cache[digest]
+            return None
+        self._cache.move_to_end(digest)
+        return stored
+
+
+    def _remember(self, digest: str, stored: StoredResponse):
+        self._cache[digest] = stored
+        self._cache.move_to_end(digest)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+    def _replay(self, stored: StoredResponse, fingerprint: str) -> Response:
+        if stored.fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key has already been used with a different request."
+            )
+        return stored.to_response()
+
+
+    def _claim(self, db: Session, digest: str, fingerprint: str) -> tuple[datetime | None, StoredResponse | None]:
+        """Inserts the in-progress claim row, taking over an expired one, or reads the row stored under the key
+        by an earlier request. Blocking, runs in the threadpool.
+
+        Returns:
+            tuple[datetime | None, StoredResponse | None]: when the claim was taken (None if it wasn't) and the stored row,
+            with status code 0 while the earlier request is in progress
+        """
+        # Core statements, an expired row loaded in the session can't clash with the new claim
+        table = models.IdempotencyKey.__table__
+        now = datetime.utcnow()
+        db.execute(delete(table).where(table.c.key == digest, table.c.expires_at <= now))
+        try:
+            db.execute(insert(table).values(key=digest, fingerprint=fingerprint, created_at=now, expires_at=now + self.lease()))
+            db.commit()
+            return now, None
+        except IntegrityError:
+            db.rollback()
+        row = db.execute(select(table.c.fingerprint, table.c.status_code, table.c.body, table.c.expires_at)
+                         .where(table.c.key == digest)).first()
+        if row is None:
+            return None, None
+        body = row.body.encode() if row.body is not None else b""
+        return None, StoredResponse(row.fingerprint, row.status_code or 0, body, row.expires_at)
+
+
+    async def _claim_or_wait(self, db: Session, digest: str, fingerprint: str) -> tuple[datetime | None, StoredResponse | None]:
+        """Claims the key, waiting while a request in another worker holds it, with a growing polling interval.
+
+        Returns:
+            tuple[datetime | None, StoredResponse | None]: when the claim was taken, or the stored response
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + float(Envs.IDEMPOTENCY_WAIT_SECONDS or 30)
+        interval = self.poll_interval
+        while True:
+            claimed_at, stored = await run_in_threadpool(self._claim, db, digest, fingerprint)
+            if claimed_at is not None:
+                return claimed_at, None
+            if stored is not None:
+                if stored.status_code:
+                    return None, stored
+                if stored.fingerprint != fingerprint:
+                    self._replay(stored, fingerprint)
+            if loop.time() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still being processed."
+                )
+            await asyncio.sleep(min(interval, max(deadline - loop.time(), 0)))
+            interval = min(interval * 2, self.max_poll_interval)
+
+
+    @asynccontextmanager
+    async def guard(self, db: Session, scope: str, key: str | None, fingerprint: str = "") -> AsyncIterator[IdempotencyGuard]:
+        """Runs a mutating request at most once per idempotency key.
+
+        The guard's replay is set when the request has been done before: the endpoint should return it
+        straight away. Otherwise the endpoint does its work and passes its response through guard.save().
+        Without a key the guard does nothing.
+
+        Args:
+            db (Session): database session
+            scope (str): endpoint and caller identity, e.g. "POST /rides/1/reserve user=3"
+            key (str | None): Idempotency-Key header value
+            fingerprint (str, optional): request payload summary, a key can't be reused for another payload. Defaults to "".
+
+        Yields:
+            IdempotencyGuard
+        """
+        if key is None:
+            yield IdempotencyGuard(None, fingerprint)
+            return
+        digest = self.digest(scope, key)
+        stored = self._cached(digest)
+        if stored is not None:
+            yield IdempotencyGuard(None, fingerprint, self._replay(stored, fingerprint))
+            return
+
+        lock, waiting = self._locks.get(digest, (asyncio.Lock(), 0))
+        self._locks[digest] = (lock, waiting + 1)
+        try:
+            async with lock:
+                claimed_at, stored = None, self._cached(digest)
+                if stored is None:
+                    claimed_at, stored = await self._claim_or_wait(db, digest, fingerprint)
+                if stored is not None:
+                    self._remember(digest, stored)
+                    yield IdempotencyGuard(None, fingerprint, self._replay(stored, fingerprint))
+                    return
+                guard = IdempotencyGuard(digest, fingerprint, claimed_at=claimed_at)
+                renewal = asyncio.create_task(self._keep_claim(db.get_bind(), guard))
+                try:
+                    yield guard
+                finally:
+                    renewal.cancel()
+                    await run_in_threadpool(self._complete, db, guard)
+        finally:
+            lock, waiting = self._locks[digest]
+            if waiting == 1:
+                del self._locks[digest]
+            else:
+                self._locks[digest] = (lock, waiting - 1)
+
+
+    def _renew(self, bind, guard: IdempotencyGuard) -> bool:
+        """Extends the lease of a claim still held by its request. Blocking, runs in the threadpool,
+        in a session of its own as the session of the request is in use
+
+        Returns:
+            bool: False if the claim was completed or taken over
+        """
+        table = models.IdempotencyKey.__table__
+        with Session(bind=bind) as session:
+            renewed = session.execute(update(table).where(table.c.key == guard.digest, table.c.created_at == guard.claimed_at,
+                                                          table.c.status_code.is_(None))
+                                      .values(expires_at=datetime.utcnow() + self.lease())).rowcount
+            session.commit()
+        return renewed > 0
+
+
+    async def _keep_claim(self, bind, guard: IdempotencyGuard):
+        """Renews the lease of a claim every third of the lease, until cancelled by the completion of the request
+        """
+        interval = self.lease().total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await run_in_threadpool(self._renew, bind, guard):
+                    return
+            except SQLAlchemyError:
+                metrics.inc("idempotency.lease_renewal_errors")
+
+
+    def _complete(self, db: Session, guard: IdempotencyGuard):
+        """Stores the saved response under the claimed key for the full TTL, or releases the claim if there is none.
+        A claim taken over by another request after its lease expired is left alone
+        """
+        db.rollback()
+        query = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == guard.digest,
+                                                       models.IdempotencyKey.created_at == guard.claimed_at)
+        if guard.saved is None:
+            query.delete(synchronize_session=False)
+        elif query.update({models.IdempotencyKey.status_code: guard.saved.status_code,
+                            models.IdempotencyKey.body: guard.saved.body.decode(),
+                            models.IdempotencyKey.expires_at: guard.saved.expires_at}, synchronize_session=False):
+            self._remember(guard.digest, guard.saved)
+        db.commit()
+
+
+    def purge_expired(self, db: Session) -> int:
+        """Removes expired keys from the database and the hot cache
+
+        Args:
+            db (Session): database session
+
+        Returns:
+            int: number of removed database rows
+        """
+        now = datetime.utcnow()
+        for digest in [digest for digest, stored in self._cache.items() if stored.expires_at <= now]:
+            del self._cache[digest]
+        removed = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.expires_at <= now).delete(synchronize_session=False)
+        db.commit()
+        return removed
+
+
+def request_fingerprint(payload: dict) -> str:
+    """Gets a short digest of the request payload
+
+    Args:
+        payload (dict): request payload
+
+    Returns:
+        str: sha256 hex digest
+    """
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import sessionmaker
+from . import analytics, changes, crud
+from .idempotency import idempotency_store
+
+
+logger = logging.getLogger(__name__)
+
+
+class RideExpiryJob:
+    """In-process job archivising the rides which have already departed.
+
+    Every worker runs the job, but only the one holding the PostgreSQL advisory lock does the work;
+    the others keep trying to take the lock over, so the job survives its leader going down.
+    Rides are archivised in small batches, each in its own short transaction, with a pause in between
+    so the job never holds row locks for long. Expired idempotency keys are purged, the pending
+    route analytics deltas folded and the ride change log compacted on the way.
+    """
+    ADVISORY_LOCK_KEY = 0x72696465
+
+
+    def __init__(self, session_factory: sessionmaker, interval: float = 60, batch_size: int = 500, pause: float = 0.1,
+                 change_log_retention: timedelta = timedelta(days=7)):
+        """
+        Args:
+            session_factory (sessionmaker): database session maker
+            interval (float, optional): seconds between the runs. Defaults to 60.
+            batch_size (int, optional): maximum number of rides archivised per transaction. Defaults to 500.
+            pause (float, optional): seconds between the batches. Defaults to 0.1.
+            change_log_retention (timedelta, optional): how long the ride change log entries are kept for. Defaults to 7 days.
+        """
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.change_log_retention = change_log_retention
+        self._lock_connection: Connection | None = None
+        self._task: asyncio.Task | None = None
+
+
+    def _try_lead(self) -> bool:
+        """Takes the session level advisory lock on a connection kept for as long as the lock is held,
+        checking on every run that the lock is still held.
+        Databases without advisory locks serve a single process, which is always the leader.
+
+        Returns:
+            bool: whether this worker is the leader
+        """
+        if self._lock_connection is not None:
+            if self._holds_lock():
+                return True
+            logger.warning("ride expiry job lost its advisory lock, trying to take it again")
+            self._resign()
+        bind = self.session_factory.kw["bind"]
+        if bind.dialect.name != "postgresql":
+            return True
+        # autocommit, so the connection never idles in a transaction (and in idle_in_transaction_session_timeout)
+        connection = bind.connect().execution_options(isolation_level="AUTOCOMMIT")
+        if connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.ADVISORY_LOCK_KEY}).scalar():
+            self._lock_connection = connection
+            return True
+        connection.close()
+        return False
+
+
+    def _holds_lock(self) -> bool:
+        """Checks that the lock connection is still alive and holds the advisory lock,
+        which is gone along with a killed connection or a restarted server
+
+        Returns:
+            bool
+        """
+        try:
+            return bool(self._lock_connection.execute(
+                text("SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid() "
+                     "AND objid = :key AND granted)"), {"key": self.ADVISORY_LOCK_KEY}).scalar())
+        except DBAPIError:
+            return False
+
+
+    def _resign(self):
+        """Releases the advisory lock by closing its connection
+        """
+        if self._lock_connection is not None:
+            self._lock_connection.invalidate()
+            self._lock_connection = None
+
+
+    def _archivise_batch(self) -> int:
+        with self.session_factory() as db:
+            return crud.archivise_expired_rides(db, now=datetime.utcnow(), batch_size=self.batch_size)
+
+
+    def _purge_idempotency_keys(self) -> int:
+        with self.session_factory() as db:
+            return idempotency_store.purge_expired(db)
+
+
+    def _fold_analytics(self) -> int:
+        with self.session_factory() as db:
+            return analytics.fold(db)
+
+
+    def _compact_changes(self) -> int:
+        with self.session_factory() as db:
+            return changes.compact(db, now=datetime.utcnow(), retention=self.change_log_retention)
+
+
+    async def run_once(self) -> int:
+        """Archivises all expired rides batch by batch, if this worker is the leader.
+        Database work runs in a thread, so the event loop keeps serving requests.
+
+        Returns:
+            int: number of archivised rides
+        """
+        if not await asyncio.to_thread(self._try_lead):
+            return 0
+        total = 0
+        while True:
+            archivised = await asyncio.to_thread(self._archivise_batch)
+            total += archivised
+            if archivised < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        await asyncio.to_thread(self._purge_idempotency_keys)
+        await asyncio.to_thread(self._fold_analytics)
+        await asyncio.to_thread(self._compact_changes)
+        if total:
+            logger.info("archivised %d expired rides", total)
+        return total
+
+
+    async def run(self):
+        """Runs the job every interval until cancelled
+        """
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("ride expiry job failed")
+                self._resign()
+            await asyncio.sleep(self.interval)
+
+
+    def start(self):
+        """Starts the job in the background
+        """
+        self._task = asyncio.create_task(self.run(), name="ride-expiry-job")
+
+
+    async def stop(self):
+        """Cancels the job and gives the leadership away
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self._resign)
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stall:
+    """Event loop blocked for longer than the threshold, captured while it was still blocked
+    """
+    at: datetime
+    blocked_ms: float
+    route: str | None
+    location: str
+    stack: list[str] = field(default_factory=list)
+
+
+class LoopLagMonitor:
+    """Event loop lag watchdog.
+
+    A task on the loop wakes up every interval and records how late it was (the scheduling delay).
+    A watchdog thread checks that the task keeps waking up; once the loop has been blocked for longer
+    than the threshold, it captures the stack of the loop thread, so the blocking call is caught in the act,
+    and tags it with the route of the request being handled (see LoopLagMiddleware).
+    Stalls are logged, counted in the metrics per blocking location and kept for GET /ops/loop-lag.
+    """
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1, stack_depth: int = 15, history: int = 50,
+                 packages: tuple[str, ...] = (os.path.join(Path(__file__).parent, ""),)):
+        """
+        Args:
+            interval (float, optional): seconds between the loop task wake-ups. Defaults to 0.1.
+            threshold (float, optional): seconds the loop must be blocked for to capture a stall. Defaults to 0.1.
+            stack_depth (int, optional): innermost frames kept per stall. Defaults to 15.
+            history (int, optional): number of the most recent stalls kept. Defaults to 50.
+            packages (tuple[str, ...], optional): directories of the code blamed for a stall, the innermost frame
+                within them is the stall location. Defaults to the app package.
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+        self.packages = packages
+        self.stalls: deque[Stall] = deque(maxlen=history)
+        self._requests: dict[asyncio.Task, dict] = {}
+        self._heartbeat = time.monotonic()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+
+    async def _tick(self):
+        """Measures the scheduling delay of the loop until cancelled
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = max(0.0, now - self._heartbeat - self.interval) * 1000
+            self._heartbeat = now
+            metrics.set("loop.lag.ms", round(lag_ms, 3))
+            if lag_ms > metrics.get("loop.lag.max_ms"):
+                metrics.set("loop.lag.max_ms", round(lag_ms, 3))
+
+
+    def _watch(self):
+        """Watchdog thread loop, captures every stall once
+        """
+        captured = None
+        while not self._stopped.wait(min(self.interval, self.threshold) / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked > self.threshold and heartbeat != captured:
+                captured = heartbeat
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self.capture(frame, blocked)
+
+
+    def _location(self, frame: FrameType) -> str:
+        """Finds the innermost frame within the watched packages, or the innermost frame at all
+
+        Args:
+            frame (FrameType): innermost frame of the loop thread
+
+        Returns:
+            str: module:function
+        """
+        innermost = frame
+        while frame is not None:
+            if frame.f_code.co_filename.startswith(self.packages) and frame.f_code.co_filename != __file__:
+                break
+            frame = frame.f_back
+        frame = frame or innermost
+        # co_qualname is new in Python 3.11
+        return f"{frame.f_globals.get('__name__', '?')}:{getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)}"
+
+
+    def _route(self) -> str | None:
+        """Gets the route of the request the loop is busy with
+
+        Returns:
+            str | None: method and route path, None if the loop isn't handling a request
+        """
+        task = asyncio.current_task(self._loop)
+        scope = self._requests.get(task)
+        if scope is None:
+            return None
+        endpoint = scope.get("endpoint")
+        for route in getattr(scope.get("app"), "routes", []):
+            if endpoint is not None and getattr(route, "endpoint", None) is endpoint:
+                return f"{scope['method']} {route.path}"
+        return f"{scope.get('method')} {scope.get('path')}"
+
+
+    def capture(self, frame: FrameType, blocked: float) -> Stall:
+        """Records a stall of the loop
+
+        Args:
+            frame (FrameType): innermost frame of the blocked loop thread
+            blocked (float): seconds the loop has been blocked for so far
+
+        Returns:
+            Stall
+        """
+        stall = Stall(
+            at=datetime.utcnow(),
+            blocked_ms=round(blocked * 1000, 3),
+            route=self._route(),
+            location=self._location(frame),
+            stack=traceback.format_stack(frame)[-self.stack_depth:],
+        )
+        self.stalls.append(stall)
+        metrics.inc("loop.lag.stalls")
+        metrics.inc(f"loop.blocked.{stall.location}")
+        logger.warning("event loop blocked for at least %.0f ms by %s (%s)\n%s", stall.blocked_ms, stall.location,
+                       stall.route or "no request", "".join(stall.stack))
+        return stall
+
+
+    def start(self):
+        """Starts the loop task and the watchdog thread, called from within the running loop
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stopped.clear()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._tick(), name="loop-lag-monitor")
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+
+
+    async def stop(self):
+        """Stops the loop task and the watchdog thread
+        """
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+
+class LoopLagMiddleware:
+    """ASGI middleware telling the monitor which request each task is handling, so stalls are tagged with routes.
+    The scope is looked up only when a stall is captured, the route matched by then is reported.
+    """
+    def __init__(self, app, monitor: LoopLagMonitor):
+        self.app = app
+        self.monitor = monitor
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        task = asyncio.current_task()
+        self.monitor._requests[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor._requests.pop(task, None)
+
+
+loop_lag_monitor = LoopLagMonitor()
@@ -1,22 +1,70 @@
+from contextlib import asynccontextmanager
 from datetime import timedelta
 from typing import Annotated
 from starlette.responses import JSONResponse
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Form, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from . import models, schemas, crud
+from . import schemas, crud
 from .utils import Tags, description
-from .database import engine
-from .dependencies import get_db
+from .database import get_engine, get_session_local
+from .cache import InvalidationListener, invalidator
+from .feed import ride_feed
+from .dependencies import get_db, login_rate_limit
+from .ratelimit import LoginRateLimiter
 from .utils import SecurityUtils, Envs
-from .routers import users, rides, users_adm, rides_adm
+from .routers import users, rides, users_adm, rides_adm, ops_adm, analytics_adm
+from .jobs import RideExpiryJob
+from .looplag import LoopLagMiddleware, loop_lag_monitor
+from .profiling import ProfilerMiddleware
+from .tracing import TracedRoute, TracingMiddleware, tracer
 
 
-models.Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts the background jobs and the event loop lag monitor with the app and stops them on shutdown.
+    Setting RIDE_EXPIRY_INTERVAL_SECONDS to 0 disables the ride expiry job,
+    setting LOOP_LAG_INTERVAL_SECONDS to 0 disables the monitor. On PostgreSQL the listener of the cache invalidations
+    and of the ride feed events of all the workers runs, other databases are invalidated and fed by this worker only.
+    The traces still queued for TRACE_FILE are written on shutdown.
+
+    Args:
+        app (FastAPI): the app
+    """
+    interval = float(Envs.RIDE_EXPIRY_INTERVAL_SECONDS)
+    expiry_job = None
+    if interval > 0:
+        expiry_job = RideExpiryJob(get_session_local(), interval=interval, batch_size=int(Envs.RIDE_EXPIRY_BATCH_SIZE),
+                                   change_log_retention=timedelta(hours=float(Envs.CHANGE_LOG_RETENTION_HOURS)))
+        expiry_job.start()
+    lag_interval = float(Envs.LOOP_LAG_INTERVAL_SECONDS)
+    if lag_interval > 0:
+        loop_lag_monitor.interval = lag_interval
+        loop_lag_monitor.threshold = float(Envs.LOOP_LAG_THRESHOLD_SECONDS)
+        loop_lag_monitor.start()
+    listener = None
+    engine = get_engine()
+    if engine.dialect.name == "postgresql":
+        listener = InvalidationListener(engine)
+        listener.start()
+        ride_feed.shared = True
+    else:
+        invalidator.coherent = True
+    yield
+    if listener is not None:
+        ride_feed.shared = False
+        await listener.stop()
+    if lag_interval > 0:
+        await loop_lag_monitor.stop()
+    if expiry_job is not None:
+        await expiry_job.stop()
+    await run_in_threadpool(tracer.flush)
 
 
 app = FastAPI(    
+    lifespan = lifespan,
     title = "Transport Management App",
     description = description,
     version = "alpha",
@@ -25,12 +73,15 @@ app = FastAPI(
         "url": "https://github.com/kamwro/transport-app",
     }
 )
+app.router.route_class = TracedRoute
 
 
 app.include_router(users.router)
 app.include_router(rides.router)
 app.include_router(users_adm.router)
 app.include_router(rides_adm.router)
+app.include_router(ops_adm.router)
+app.include_router(analytics_adm.router)
 
 
 origins = [
@@ -48,6 +99,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(LoopLagMiddleware, monitor=loop_lag_monitor)
 
 
 def authenticate_user(username: str, password: str, db: Session = Depends(get_db)) -> schemas.User | bool:
@@ -63,7 +117,7 @@ def authenticate_user(username: str, password: str, db: Session = Depends(get_db
     """
     user = crud.get_user_by_login(db, username)
     if user == None:
-        return False
+        return SecurityUtils.dummy_verify(password)
     if not SecurityUtils.verify_password(password, user.hashed_password):
         return False
     return user
@@ -79,15 +133,19 @@ async def welcome_to_the_app() -> JSONResponse:
 @app.post("/token", response_model=schemas.Token, summary = "Token login",
            tags = [Tags.acc_login])
 async def login_for_access_token(
-    form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    limiter: Annotated[LoginRateLimiter, Depends(login_rate_limit)]
 , db: Session = Depends(get_db)):
     """
     - Log in using Authorize button in the top right corner of swagger UI. 
     - User authentication uses OAuth2 password request form to get an access token.
+    - Attempts are rate limited per client IP and per login, exceeding the limits returns 429 with Retry-After header.
 
-    Returns access token.
+    Returns access token and refresh token. Use the refresh token at POST /token/refresh to get a new access token
+    without sending the password again.
     """
-    user = authenticate_user(form_data.username, form_data.password, db)
+    with limiter.admission():
+        user = await run_in_threadpool(authenticate_user, form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -98,4 +156,30 @@ async def login_for_access_token(
     access_token = SecurityUtils.create_access_token(
         data={"sub": user.login}, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    refresh_token = crud.create_refresh_token(db, user_id=user.id,
+                                              expires_delta=timedelta(days=int(Envs.REFRESH_TOKEN_EXPIRE_DAYS)))
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+@app.post("/token/refresh", response_model=schemas.Token, summary = "Token refresh",
+           tags = [Tags.acc_login])
+async def refresh_access_token(refresh_token: Annotated[str, Form()], db: Session = Depends(get_db)):
+    """
+    - Exchanges a **refresh_token** (str) got at login for a new access token, without checking the password again.
+    - The refresh token can be used only once and is rotated: a new one is returned along with the access token.
+    - Using a refresh token for the second time revokes all tokens issued since the login.
+
+    Returns access token and refresh token.
+    """
+    rotated = crud.rotate_refresh_token(db, refresh_token, expires_delta=timedelta(days=int(Envs.REFRESH_TOKEN_EXPIRE_DAYS)))
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    login, new_refresh_token = rotated
+    access_token = SecurityUtils.create_access_token(
+        data={"sub": login}, expires_delta=timedelta(minutes=int(Envs.ACCESS_TOKEN_EXPIRE_MINUTES))
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": new_refresh_token}
\ No newline at end of file
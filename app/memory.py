@@ -0,0 +1,254 @@
+"""Memory allocations tracing of a running worker, based on tracemalloc.
+
+Tracing is started and stopped on demand, so no restart with special tooling is needed.
+Snapshots are kept in the worker that took them, the top allocation sites of a snapshot
+and the difference between two snapshots are grouped by module (app.crud), package (sqlalchemy)
+or line. The command drives the GET/POST /ops/memory endpoints of a running app.
+With several workers every request may reach a different one, the responses name the worker (pid).
+
+Usage:
+    python -m app.memory --token $TOKEN start --frames 1
+    python -m app.memory --token $TOKEN snapshot --group-by package
+    python -m app.memory --token $TOKEN diff 1 2 --group-by module
+    python -m app.memory --token $TOKEN stop
+"""
+import argparse
+import os
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from functools import lru_cache
+from .metrics import metrics
+from .utils import MemoryGroup
+
+
+# allocations of the tracing itself and of the import machinery
+IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+@lru_cache(maxsize=None)
+def module_of(filename: str) -> str:
+    """Finds the name of the loaded module of a source file
+
+    Args:
+        filename (str): source file path
+
+    Returns:
+        str: module name, the file path if no loaded module comes from it
+    """
+    for name, module in list(sys.modules.items()):
+        if getattr(module, "__file__", None) == filename:
+            return name
+    return filename
+
+
+def group_of(frame: tracemalloc.Frame, group_by: MemoryGroup) -> str:
+    """Names the group of an allocation site
+
+    Args:
+        frame (tracemalloc.Frame): allocation site
+        group_by (MemoryGroup): grouping
+
+    Returns:
+        str: module (app.crud, sqlalchemy.orm.loading), package (app.crud, sqlalchemy) or module:line
+    """
+    module = module_of(frame.filename)
+    if group_by == MemoryGroup.line:
+        return f"{module}:{frame.lineno}"
+    if group_by == MemoryGroup.package and not module.startswith(("app.", os.sep)):
+        return module.split(".")[0]
+    return module
+
+
+class MemoryTracker:
+    """Snapshots of the memory traced by tracemalloc in this worker, the oldest are dropped over the limit
+    """
+    def __init__(self, max_snapshots: int = 10):
+        """
+        Args:
+            max_snapshots (int, optional): number of the snapshots kept. Defaults to 10.
+        """
+        self.max_snapshots = max_snapshots
+        self.snapshots: OrderedDict[int, tuple[datetime, tracemalloc.Snapshot]] = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+
+    def start(self, frames: int = 1) -> bool:
+        """Starts tracing the allocations. Tracing slows the worker down and takes memory, more with more frames.
+
+        Args:
+            frames (int, optional): frames stored per allocation. Defaults to 1, the allocation site only.
+
+        Returns:
+            bool: False if tracing had already been started
+        """
+        if self.tracing:
+            return False
+        tracemalloc.start(frames)
+        return True
+
+
+    def stop(self):
+        """Stops tracing and drops the snapshots
+        """
+        tracemalloc.stop()
+        with self._lock:
+            self.snapshots.clear()
+        module_of.cache_clear()
+
+
+    def take(self) -> int:
+        """Takes a snapshot of the traced memory
+
+        Raises:
+            RuntimeError: if tracing isn't started
+
+        Returns:
+            int: snapshot id
+        """
+        if not self.tracing:
+            raise RuntimeError("memory tracing is not started")
+        snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED)
+        metrics.set("memory.traced_kib", round(tracemalloc.get_traced_memory()[0] / 1024, 1))
+        with self._lock:
+            snapshot_id = self._next_id
+            self._next_id += 1
+            self.snapshots[snapshot_id] = (datetime.utcnow(), snapshot)
+            while len(self.snapshots) > self.max_snapshots:
+                self.snapshots.popitem(last=False)
+        return snapshot_id
+
+
+    def get(self, snapshot_id: int) -> tracemalloc.Snapshot:
+        """Gets a snapshot
+
+        Args:
+            snapshot_id (int): snapshot id
+
+        Raises:
+            KeyError: if there's no such snapshot in this worker
+
+        Returns:
+            tracemalloc.Snapshot
+        """
+        with self._lock:
+            return self.snapshots[snapshot_id][1]
+
+
+    def top(self, snapshot_id: int, group_by: MemoryGroup = MemoryGroup.package, limit: int = 20) -> list[dict]:
+        """Gets the groups of allocation sites holding the most memory
+
+        Args:
+            snapshot_id (int): snapshot id
+            group_by (MemoryGroup, optional): grouping. Defaults to MemoryGroup.package.
+            limit (int, optional): number of groups. Defaults to 20.
+
+        Returns:
+            list[dict]: group, size in KiB and number of memory blocks, the largest first
+        """
+        sizes, counts = defaultdict(int), defaultdict(int)
+        for stat in self.get(snapshot_id).statistics("lineno"):
+            group = group_of(stat.traceback[0], group_by)
+            sizes[group] += stat.size
+            counts[group] += stat.count
+        groups = sorted(sizes, key=sizes.get, reverse=True)[:limit]
+        return [{"group": group, "size_kib": round(sizes[group] / 1024, 1), "count": counts[group]} for group in groups]
+
+
+    def diff(self, base_id: int, current_id: int, group_by: MemoryGroup = MemoryGroup.package,
+             limit: int = 20) -> list[dict]:
+        """Gets the groups of allocation sites which changed the most between two snapshots
+
+        Args:
+            base_id (int): id of the earlier snapshot
+            current_id (int): id of the later snapshot
+            group_by (MemoryGroup, optional): grouping. Defaults to MemoryGroup.package.
+            limit (int, optional): number of groups. Defaults to 20.
+
+        Returns:
+            list[dict]: group, size and its change in KiB, number of blocks and its change, the largest change first
+        """
+        sizes, size_diffs, counts, count_diffs = defaultdict(int), defaultdict(int), defaultdict(int), defaultdict(int)
+        for stat in self.get(current_id).compare_to(self.get(base_id), "lineno"):
+            group = group_of(stat.traceback[0], group_by)
+            sizes[group] += stat.size
+            size_diffs[group] += stat.size_diff
+            counts[group] += stat.count
+            count_diffs[group] += stat.count_diff
+        groups = sorted(size_diffs, key=lambda group: abs(size_diffs[group]), reverse=True)[:limit]
+        return [{"group": group, "size_kib": round(sizes[group] / 1024, 1), "size_diff_kib": round(size_diffs[group] / 1024, 1),
+                 "count": counts[group], "count_diff": count_diffs[group]} for group in groups]
+
+
+memory_tracker = MemoryTracker()
+
+
+def _print_table(rows: list[dict]):
+    if not rows:
+        print("no allocations")
+        return
+    columns = list(rows[0])
+    widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(widths[column]) for column in columns))
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    from .config import Envs
+
+    parser = argparse.ArgumentParser(prog="python -m app.memory", description="Trace the memory allocations of a running app.")
+    parser.add_argument("--url", default=f"http://localhost:{Envs.PORT}", help="app base URL")
+    parser.add_argument("--token", required=True, help="access token of an admin")
+    commands = parser.add_subparsers(dest="command", required=True)
+    start = commands.add_parser("start", help="start tracing")
+    start.add_argument("--frames", type=int, default=1, help="frames stored per allocation")
+    commands.add_parser("stop", help="stop tracing and drop the snapshots")
+    snapshot = commands.add_parser("snapshot", help="take a snapshot and show the top allocation sites")
+    diff = commands.add_parser("diff", help="show the change between two snapshots")
+    diff.add_argument("base", type=int)
+    diff.add_argument("current", type=int, nargs="?", help="defaults to a new snapshot")
+    for command in (snapshot, diff):
+        command.add_argument("--group-by", choices=[group.value for group in MemoryGroup], default=MemoryGroup.package.value)
+        command.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    import httpx
+    with httpx.Client(base_url=args.url, headers={"Authorization": f"Bearer {args.token}"}, timeout=60) as client:
+        if args.command == "start":
+            response = client.post("/ops/memory/start", params={"frames": args.frames})
+        elif args.command == "stop":
+            response = client.post("/ops/memory/stop")
+        elif args.command == "snapshot":
+            response = client.post("/ops/memory/snapshots", params={"group_by": args.group_by, "limit": args.limit})
+        else:
+            params = {"base": args.base, "group_by": args.group_by, "limit": args.limit}
+            if args.current is not None:
+                params["current"] = args.current
+            response = client.get("/ops/memory/diff", params=params)
+    body = response.json()
+    if response.status_code != 200:
+        sys.exit(f"{response.status_code}: {body.get('detail')}")
+    rows = body.pop("top", body.pop("diff", None))
+    print(", ".join(f"{key} {value}" for key, value in body.items()))
+    if rows is not None:
+        _print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
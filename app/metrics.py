@@ -0,0 +1,59 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """Process-wide registry of named counters and gauges, exposed at GET /ops/metrics
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = defaultdict(float)
+        self._gauges: dict[str, float] = {}
+
+
+    def inc(self, name: str, value: float = 1):
+        """Increments a counter
+
+        Args:
+            name (str): counter name
+            value (float, optional): increment. Defaults to 1.
+        """
+        with self._lock:
+            self._counters[name] += value
+
+
+    def set(self, name: str, value: float):
+        """Sets a gauge
+
+        Args:
+            name (str): gauge name
+            value (float): current value
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+
+    def get(self, name: str) -> float:
+        """Gets a counter or a gauge value
+
+        Args:
+            name (str): counter or gauge name
+
+        Returns:
+            float: 0 if it wasn't recorded yet
+        """
+        with self._lock:
+            return self._gauges.get(name, self._counters.get(name, 0))
+
+
+    def snapshot(self) -> dict:
+        """Gets all the values recorded so far
+
+        Returns:
+            dict: counters and gauges
+        """
+        with self._lock:
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges)}
+
+
+metrics = Metrics()
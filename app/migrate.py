@@ -0,0 +1,131 @@
+"""Explicit schema management, run once per deployment instead of on every app import.
+
+Creates the missing tables, adds the columns, indexes and (on PostgreSQL) foreign keys introduced
+after a table was created and backfills them, so an existing database is brought up to date with the models.
+On PostgreSQL it also creates the table of the shared login rate limit buckets.
+Every step is idempotent, running the command again does nothing.
+
+Usage:
+    python -m app.migrate
+    python -m app.migrate --partition-rides
+"""
+import argparse
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import AddConstraint, Column, CreateIndex
+from . import models
+from .ratelimit import PostgresBackend
+
+
+# rows written before the column existed, filled in after it is added
+BACKFILLS = {
+    ("rides", "seats"): "UPDATE rides SET seats = 1 WHERE seats IS NULL",
+    ("rides", "seats_available"): "UPDATE rides SET seats_available = CASE WHEN is_active THEN 1 ELSE 0 END "
+                                  "WHERE seats_available IS NULL",
+}
+
+# foreign keys declared after their table was created, with the statement clearing the references they would reject
+FOREIGN_KEYS = {
+    ("rides", "user_id_taken"): "UPDATE rides SET user_id_taken = NULL WHERE user_id_taken NOT IN (SELECT id FROM users)",
+}
+
+
+def _add_column_statement(connection: Connection, table_name: str, column: Column) -> str:
+    """Compiles ALTER TABLE ... ADD COLUMN for the dialect of the connection
+
+    Args:
+        connection (Connection): database connection
+        table_name (str): table name
+        column (Column): model column
+
+    Returns:
+        str: the statement
+    """
+    column_type = column.type.compile(dialect=connection.dialect)
+    return f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}"
+
+
+def upgrade(connection: Connection) -> list[str]:
+    """Creates the missing tables, columns, indexes and foreign keys of the models
+
+    Args:
+        connection (Connection): database connection, within a transaction
+
+    Returns:
+        list[str]: applied changes, empty if the schema was up to date
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            table.create(connection)
+            changes.append(f"created table {table.name}")
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            connection.execute(text(_add_column_statement(connection, table.name, column)))
+            changes.append(f"added column {table.name}.{column.name}")
+            backfill = BACKFILLS.get((table.name, column.name))
+            if backfill is not None:
+                connection.execute(text(backfill))
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                # partitioned tables don't list their indexes, IF NOT EXISTS keeps the step idempotent
+                statement = str(CreateIndex(index).compile(dialect=connection.dialect))
+                connection.execute(text(statement.replace("INDEX", "INDEX IF NOT EXISTS", 1)))
+                changes.append(f"created index {index.name}")
+        if connection.dialect.name != "postgresql":
+            # SQLite can't add constraints to an existing table
+            continue
+        existing_foreign_keys = {tuple(foreign_key["constrained_columns"]) for foreign_key in inspector.get_foreign_keys(table.name)}
+        for constraint in table.foreign_key_constraints:
+            columns = tuple(constraint.column_keys)
+            cleanup = FOREIGN_KEYS.get((table.name, *columns))
+            if cleanup is not None and columns not in existing_foreign_keys:
+                connection.execute(text(cleanup))
+                connection.execute(AddConstraint(constraint))
+                changes.append(f"added foreign key {table.name}.{', '.join(columns)}")
+    if connection.dialect.name == "postgresql" and PostgresBackend.TABLE not in existing_tables:
+        # the shared login rate limit buckets, unlogged so not a model of the schema
+        connection.execute(text(PostgresBackend.CREATE_TABLE))
+        changes.append(f"created table {PostgresBackend.TABLE}")
+    return changes
+
+
+def migrate(engine: Engine, partition_rides: bool = False) -> list[str]:
+    """Brings the database schema up to date with the models
+
+    Args:
+        engine (Engine): database engine
+        partition_rides (bool, optional): also partition the rides table, see app.partitions. Defaults to False.
+
+    Returns:
+        list[str]: applied changes
+    """
+    with engine.begin() as connection:
+        changes = upgrade(connection)
+    if partition_rides:
+        from . import partitions
+        if partitions.migrate(engine):
+            changes.append("partitioned table rides")
+    return changes
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.migrate", description="Create or upgrade the database schema.")
+    parser.add_argument("--partition-rides", action="store_true", help="also partition the rides table (PostgreSQL only)")
+    args = parser.parse_args(argv)
+
+    from .database import get_engine
+    changes = migrate(get_engine(), partition_rides=args.partition_rides)
+    print("\n".join(changes) or "schema up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, Float, String, DateTime
+from datetime import datetime
+from sqlalchemy import BigInteger, Boolean, Column, Integer, Float, String, Text, Date, DateTime, Index, ForeignKey
+from sqlalchemy.orm import relationship
 from .database import Base
 
 
@@ -17,6 +19,13 @@ class User(Base):
     is_admin = Column(Boolean)
     activation_code = Column(String)
 
+    __table_args__ = (
+        # the admin user listing: keyset pagination on id within the status filters, login prefix searches
+        Index("ix_users_active_id", "is_active", "id"),
+        Index("ix_users_admin_id", "is_admin", "id"),
+        Index("ix_users_login_prefix", "login", postgresql_ops={"login": "text_pattern_ops"}),
+    )
+
 
 class Ride(Base):
     """Sqlalchemy model of Ride table based on the database sqlalchemic declarative_base()
@@ -31,4 +40,130 @@ class Ride(Base):
     price = Column(Float)
     departure_date = Column(DateTime)
     is_active = Column(Boolean)
-    user_id_taken = Column(Integer)
\ No newline at end of file
+    user_id_taken = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    seats = Column(Integer, default=1)
+    seats_available = Column(Integer, default=1)
+
+    taken_by = relationship("User")
+
+    __table_args__ = (
+        # partial indexes covering the active ride searches: equality on the cities, range scan on the departure date
+        Index("ix_rides_route_departure", "start_city", "destination_city", "departure_date",
+              postgresql_where=is_active == True, sqlite_where=is_active == True),
+        Index("ix_rides_destination_departure", "destination_city", "departure_date",
+              postgresql_where=is_active == True, sqlite_where=is_active == True),
+        Index("ix_rides_departure", "departure_date",
+              postgresql_where=is_active == True, sqlite_where=is_active == True),
+        # single-seat rides taken by an user, also backing the SET NULL of the foreign key when an user is removed
+        Index("ix_rides_user_id_taken_departure", "user_id_taken", "departure_date"),
+    )
+
+
+class Booking(Base):
+    """Sqlalchemy model of Booking table based on the database sqlalchemic declarative_base().
+    Every reservation of one or more seats on a ride is stored as a single booking
+    """    
+    __tablename__ = "bookings"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    # no foreign key: the partitioned rides table (app.partitions) has no unique id to reference,
+    # crud removes the bookings along with their ride
+    ride_id = Column(Integer, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    seats = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    ride = relationship("Ride", primaryjoin="foreign(Booking.ride_id) == Ride.id")
+
+    __table_args__ = (
+        # booking history of an user, newest first, keyset paginated on id
+        Index("ix_bookings_user_id_id", "user_id", "id"),
+    )
+
+
+class IdempotencyKey(Base):
+    """Sqlalchemy model of IdempotencyKey table based on the database sqlalchemic declarative_base().
+    Stores the response of a mutating request under the digest of its Idempotency-Key header.
+    Status code stays empty while the first request is in progress
+    """    
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(64), primary_key=True)
+    fingerprint = Column(String(64))
+    status_code = Column(Integer)
+    body = Column(Text)
+    created_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
+
+
+class RefreshToken(Base):
+    """Sqlalchemy model of RefreshToken table based on the database sqlalchemic declarative_base().
+    Only a sha256 hash of the opaque token is stored. Tokens rotated from a single login share a family,
+    so that a reused token revokes the whole chain
+    """    
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    token_hash = Column(String(64), unique=True)
+    family = Column(String(32), index=True)
+    expires_at = Column(DateTime)
+    revoked_at = Column(DateTime)
+
+
+class RouteDailyStats(Base):
+    """Sqlalchemy model of RouteDailyStats table based on the database sqlalchemic declarative_base().
+    Ride and booking totals per route and departure day, folded from the route stats deltas by app.analytics
+    """    
+    __tablename__ = "route_daily_stats"
+
+    start_city = Column(String, primary_key=True)
+    destination_city = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    rides = Column(Integer, default=0)
+    seats = Column(Integer, default=0)
+    bookings = Column(Integer, default=0)
+    seats_booked = Column(Integer, default=0)
+    revenue = Column(Float, default=0)
+
+    __table_args__ = (
+        Index("ix_route_daily_stats_day", "day"),
+    )
+
+
+class RouteStatsDelta(Base):
+    """Sqlalchemy model of RouteStatsDelta table based on the database sqlalchemic declarative_base().
+    Every ride and booking change appends its effect on the route daily stats here, in its own transaction,
+    so concurrent bookings never wait on each other's stats row. Deltas are folded into RouteDailyStats periodically
+    """    
+    __tablename__ = "route_stats_deltas"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    start_city = Column(String)
+    destination_city = Column(String)
+    day = Column(Date)
+    rides = Column(Integer, default=0)
+    seats = Column(Integer, default=0)
+    bookings = Column(Integer, default=0)
+    seats_booked = Column(Integer, default=0)
+    revenue = Column(Float, default=0)
+
+
+class RideChange(Base):
+    """Sqlalchemy model of RideChange table based on the database sqlalchemic declarative_base().
+    Log of the ride inserts, updates and deletes read by the syncing clients after their cursor (the sequence),
+    compacted by app.changes. No foreign key, the entries of the deleted rides stay
+    """    
+    __tablename__ = "ride_changes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sequence = Column(BigInteger, nullable=False)
+    ride_id = Column(Integer)
+    operation = Column(String(16), nullable=False)
+    changed_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_ride_changes_sequence_id", "sequence", "id"),
+        Index("ix_ride_changes_ride_id_sequence", "ride_id", "sequence"),
+        Index("ix_ride_changes_changed_at", "changed_at"),
+    )
@@ -0,0 +1,238 @@
+"""Partitioned storage of the rides table (PostgreSQL only).
+
+The rides table is list-partitioned by is_active:
+
+- rides_active holds the bookable rides, so the searches (all filtering on is_active) only ever touch it,
+- rides_archive holds the archivised rides and is range-partitioned by departure_date into monthly
+  partitions (rides_archive_YYYY_MM) plus rides_archive_default for rides outside of them.
+
+Archivising a ride moves its row from rides_active into the archive partition of its month.
+Old archive partitions can be detached or dropped without touching the rest of the table.
+
+Usage:
+    python -m app.partitions migrate --months-back 24 --months-ahead 12
+    python -m app.partitions ensure --months-ahead 12
+    python -m app.partitions detach --before 2022-01
+    python -m app.partitions drop --before 2022-01
+"""
+import argparse
+from datetime import date
+from sqlalchemy import text, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import AddConstraint, CreateIndex
+from . import models
+
+
+def month_start(day: date, months: int = 0) -> date:
+    """Gets the first day of the month shifted by given number of months
+
+    Args:
+        day (date): any day of the month
+        months (int, optional): months to shift by, may be negative. Defaults to 0.
+
+    Returns:
+        date
+    """
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def archive_partition_name(month: date) -> str:
+    """Gets the name of the archive partition holding given month
+
+    Args:
+        month (date): any day of the month
+
+    Returns:
+        str: partition name, e.g. rides_archive_2023_09
+    """
+    return f"rides_archive_{month.year:04d}_{month.month:02d}"
+
+
+def migration_statements() -> list[str]:
+    """Gets the statements turning the plain rides table into the partitioned one, existing rows included.
+    Meant to run in a single transaction.
+
+    The primary key of a partitioned table has to contain the partitioning columns, so it becomes
+    (id, is_active, departure_date) and bookings.ride_id can't reference rides anymore: the models declare
+    no such foreign key, it is dropped from databases created before, and bookings are removed together
+    with their ride by crud. The foreign keys of the rides table itself are added back.
+
+    Returns:
+        list[str]: SQL statements
+    """
+    statements = [
+        "ALTER TABLE rides RENAME TO rides_legacy",
+        "ALTER TABLE bookings DROP CONSTRAINT IF EXISTS bookings_ride_id_fkey",
+        "CREATE TABLE rides (LIKE rides_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY LIST (is_active)",
+        "ALTER TABLE rides ALTER COLUMN is_active SET NOT NULL, ALTER COLUMN departure_date SET NOT NULL",
+        "CREATE TABLE rides_active PARTITION OF rides FOR VALUES IN (true)",
+        "CREATE TABLE rides_archive PARTITION OF rides FOR VALUES IN (false) PARTITION BY RANGE (departure_date)",
+        "CREATE TABLE rides_archive_default PARTITION OF rides_archive DEFAULT",
+        "INSERT INTO rides SELECT * FROM rides_legacy",
+        "ALTER SEQUENCE rides_id_seq OWNED BY NONE",
+        "DROP TABLE rides_legacy",
+        "ALTER SEQUENCE rides_id_seq OWNED BY rides.id",
+        "ALTER TABLE rides ADD CONSTRAINT rides_pkey PRIMARY KEY (id, is_active, departure_date)",
+    ]
+    for constraint in sorted(models.Ride.__table__.foreign_key_constraints, key=lambda constraint: constraint.column_keys):
+        statements.append(str(AddConstraint(constraint).compile(dialect=postgresql.dialect())))
+    for index in sorted(models.Ride.__table__.indexes, key=lambda index: index.name):
+        statements.append(str(CreateIndex(index).compile(dialect=postgresql.dialect())))
+    return statements
+
+
+def is_partitioned(connection: Connection) -> bool:
+    """Checks if the rides table is already partitioned
+
+    Args:
+        connection (Connection): database connection
+
+    Returns:
+        bool
+    """
+    return connection.execute(text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                                   "WHERE partrelid = to_regclass('rides'))")).scalar()
+
+
+def create_archive_partition(connection: Connection, month: date) -> bool:
+    """Creates the archive partition for given month unless it exists.
+    Rows of that month already stored in the default partition are moved into it before attaching.
+
+    Args:
+        connection (Connection): database connection, within a transaction
+        month (date): any day of the month
+
+    Returns:
+        bool: whether the partition was created
+    """
+    name = archive_partition_name(month)
+    if inspect(connection).has_table(name):
+        return False
+    start, end = month_start(month), month_start(month, 1)
+    bounds = {"start": start, "end": end}
+    connection.execute(text(f"CREATE TABLE {name} (LIKE rides_archive INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    connection.execute(text(f"WITH moved AS (DELETE FROM rides_archive_default WHERE departure_date >= :start "
+                            f"AND departure_date < :end RETURNING *) INSERT INTO {name} SELECT * FROM moved"), bounds)
+    connection.execute(text(f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds "
+                            f"CHECK (departure_date >= '{start}' AND departure_date < '{end}' AND NOT is_active)"))
+    connection.execute(text(f"ALTER TABLE rides_archive ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    connection.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds"))
+    return True
+
+
+def ensure_archive_partitions(connection: Connection, first_month: date, last_month: date) -> list[str]:
+    """Creates missing monthly archive partitions between two months (inclusive)
+
+    Args:
+        connection (Connection): database connection, within a transaction
+        first_month (date): any day of the first month
+        last_month (date): any day of the last month
+
+    Returns:
+        list[str]: names of the created partitions
+    """
+    created, month = [], month_start(first_month)
+    while month <= last_month:
+        if create_archive_partition(connection, month):
+            created.append(archive_partition_name(month))
+        month = month_start(month, 1)
+    return created
+
+
+def archive_partitions_before(connection: Connection, before: date) -> list[str]:
+    """Lists the attached monthly archive partitions holding only departures before given month
+
+    Args:
+        connection (Connection): database connection
+        before (date): any day of the first month to keep
+
+    Returns:
+        list[str]: partition names, oldest first
+    """
+    names = connection.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                                    "WHERE i.inhparent = 'rides_archive'::regclass AND c.relname LIKE 'rides_archive_____\\___'")).scalars()
+    cutoff = archive_partition_name(month_start(before))
+    return sorted(name for name in names if name < cutoff)
+
+
+def detach_archive_partitions(connection: Connection, before: date, drop: bool = False) -> list[str]:
+    """Detaches monthly archive partitions older than given month, dropping them if asked.
+    Detaching only touches the catalog, the rows stay in the detached table until it is dropped.
+
+    Args:
+        connection (Connection): database connection, within a transaction
+        before (date): any day of the first month to keep
+        drop (bool, optional): drop the detached partitions. Defaults to False.
+
+    Returns:
+        list[str]: names of the detached partitions
+    """
+    names = archive_partitions_before(connection, before)
+    for name in names:
+        connection.execute(text(f"ALTER TABLE rides_archive DETACH PARTITION {name}"))
+        if drop:
+            connection.execute(text(f"DROP TABLE {name}"))
+    return names
+
+
+def migrate(engine: Engine, months_back: int = 24, months_ahead: int = 12) -> bool:
+    """Turns the plain rides table into the partitioned one and creates the monthly archive partitions.
+    Does nothing if the table is already partitioned or the database is not PostgreSQL.
+
+    Args:
+        engine (Engine): database engine
+        months_back (int, optional): archive months to create before the current one. Defaults to 24.
+        months_ahead (int, optional): archive months to create after the current one. Defaults to 12.
+
+    Returns:
+        bool: whether the table was migrated
+    """
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            return False
+        for statement in migration_statements():
+            connection.execute(text(statement))
+        today = date.today()
+        ensure_archive_partitions(connection, month_start(today, -months_back), month_start(today, months_ahead))
+    return True
+
+
+def _month(value: str) -> date:
+    return date.fromisoformat(f"{value}-01")
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.partitions", description="Manage partitions of the rides table.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_command = commands.add_parser("migrate", help="partition the rides table, existing rows included")
+    migrate_command.add_argument("--months-back", type=int, default=24)
+    migrate_command.add_argument("--months-ahead", type=int, default=12)
+    ensure_command = commands.add_parser("ensure", help="create missing monthly archive partitions")
+    ensure_command.add_argument("--months-ahead", type=int, default=12)
+    for name in ("detach", "drop"):
+        command = commands.add_parser(name, help=f"{name} archive partitions older than given month")
+        command.add_argument("--before", type=_month, required=True, help="first month to keep, YYYY-MM")
+    args = parser.parse_args(argv)
+
+    from .database import get_engine
+    engine = get_engine()
+    if args.command == "migrate":
+        print("migrated" if migrate(engine, args.months_back, args.months_ahead) else "nothing to migrate")
+        return
+    with engine.begin() as connection:
+        if args.command == "ensure":
+            today = date.today()
+            names = ensure_archive_partitions(connection, month_start(today), month_start(today, args.months_ahead))
+        else:
+            names = detach_archive_partitions(connection, args.before, drop=args.command == "drop")
+    print("\n".join(names) or "no partitions affected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import asyncio
+import cProfile
+import marshal
+import sys
+import threading
+import time
+from collections import Counter
+from fastapi import HTTPException, Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from .dependencies import get_current_user, get_current_active_user, get_current_active_admin, get_db, oauth2_scheme
+from .metrics import metrics
+
+
+FORMATS = ("collapsed", "summary", "pstats")
+
+
+# innermost frame matching a prefix (module:qualname) decides where the time of a sample went
+CATEGORIES = {
+    "serialization": ("pydantic", "pydantic_core", "fastapi.encoders", "fastapi.routing:serialize_response",
+                      "starlette.responses:JSONResponse.render", "app.utils:RowsResponse", "sqlalchemy.engine.row:Row._asdict"),
+    "sql": ("sqlalchemy", "psycopg2", "sqlite3"),
+    "email": ("fastapi_mail", "aiosmtplib", "app.utils:EmailUtils"),
+    "security": ("passlib", "jose", "app.utils:SecurityUtils"),
+    "crud": ("app.crud",),
+    "router": ("app.routers", "app.main", "app.dependencies"),
+    "idle": ("selectors", "asyncio.base_events"),
+}
+
+
+def categorize(stack: tuple[str, ...]) -> str:
+    """Attributes a sampled stack to a category, by its innermost frame belonging to one
+
+    Args:
+        stack (tuple[str, ...]): frames as module:qualname, outermost first
+
+    Returns:
+        str: category name, "other" if no frame belongs to any
+    """
+    for label in reversed(stack):
+        for category, prefixes in CATEGORIES.items():
+            if label.startswith(prefixes):
+                return category
+    return "other"
+
+
+class StackSampler:
+    """Thread sampling the stack of another thread at a fixed interval, used as a context manager.
+    A sample needs the GIL, so while the sampled thread runs Python code the interval is in practice
+    no shorter than the interpreter switch interval (5 ms by default).
+    """
+    def __init__(self, thread_id: int, interval: float = 0.002):
+        """
+        Args:
+            thread_id (int): identifier of the sampled thread
+            interval (float, optional): seconds between the samples. Defaults to 0.002.
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter[tuple[str, ...]] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                # co_qualname is new in Python 3.11
+                name = getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+
+    def __enter__(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+    def collapsed(self) -> str:
+        """Formats the samples as collapsed stacks, the input of flamegraph.pl and speedscope
+
+        Returns:
+            str: one "frame;frame;frame count" line per distinct stack
+        """
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+
+    def summary(self, wall: float, top: int = 10) -> dict:
+        """Splits the wall time of the request between the categories and the hottest functions
+
+        Args:
+            wall (float): wall time of the request in seconds
+            top (int, optional): number of the hottest innermost functions. Defaults to 10.
+
+        Returns:
+            dict: number of samples, time per category and per innermost function in milliseconds
+        """
+        total = sum(self.samples.values())
+        per_category: Counter[str] = Counter()
+        per_function: Counter[str] = Counter()
+        for stack, count in self.samples.items():
+            per_category[categorize(stack)] += count
+            per_function[stack[-1]] += count
+        share = wall * 1000 / total if total else 0
+        return {
+            "samples": total,
+            "breakdown_ms": {category: round(count * share, 3) for category, count in per_category.most_common()},
+            "top_functions_ms": {function: round(count * share, 3) for function, count in per_function.most_common(top)},
+        }
+
+
+class ProfilerMiddleware:
+    """ASGI middleware running a request under a profiler when an admin asks for it with the X-Profile header
+    or the profile query parameter, set to one of:
+
+    - collapsed: sampled collapsed stacks (text), for flame graphs,
+    - summary: sampled time per category (router, crud, sql, serialization, email, security...) as JSON,
+    - pstats: deterministic cProfile statistics (binary), open with pstats.Stats or snakeviz.
+
+    The profile replaces the response, the original status code is sent in the X-Profile-Status header.
+    The profilers watch the event loop thread, so the requests handled concurrently by the worker are profiled too,
+    and only one request per worker is profiled at a time. Requests without the flag are passed straight through.
+    """
+    def __init__(self, app):
+        self.app = app
+        self._lock = asyncio.Lock()
+
+
+    @staticmethod
+    def requested_format(scope) -> str | None:
+        """Gets the profile format asked for by the request
+
+        Returns:
+            str | None: format, None if the request doesn't ask to be profiled
+        """
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return value.decode("latin-1") or "summary"
+        if b"profile=" in scope["query_string"]:
+            query_params = Request(scope).query_params
+            if "profile" in query_params:
+                return query_params["profile"] or "summary"
+        return None
+
+
+    @staticmethod
+    async def authorize(request: Request):
+        """Lets through active admins only, with the checks of the get_current_active_admin dependency
+
+        Args:
+            request (Request): the profiled request
+
+        Raises:
+            HTTPException: when the token is missing or invalid, or the user is not an active admin
+        """
+        token = await oauth2_scheme(request)
+        provider = request.app.dependency_overrides.get(get_db, get_db)
+        sessions = provider()
+        try:
+            user = await get_current_user(token=token, db=next(sessions))
+        finally:
+            sessions.close()
+        await get_current_active_admin(await get_current_active_user(user))
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        profile_format = self.requested_format(scope)
+        if profile_format is None:
+            return await self.app(scope, receive, send)
+
+        if profile_format not in FORMATS:
+            response = JSONResponse(status_code=400, content={"detail": f"profile must be one of: {', '.join(FORMATS)}"})
+            return await response(scope, receive, send)
+        try:
+            await self.authorize(Request(scope))
+        except HTTPException as exception:
+            response = JSONResponse(status_code=exception.status_code, content={"detail": exception.detail},
+                                    headers=exception.headers)
+            return await response(scope, receive, send)
+
+        status_code = None
+
+        async def discard(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        async with self._lock:
+            metrics.inc("profile.requests")
+            started = time.perf_counter()
+            if profile_format == "pstats":
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    await self.app(scope, receive, discard)
+                finally:
+                    profiler.disable()
+                wall = time.perf_counter() - started
+                profiler.create_stats()
+                response = Response(marshal.dumps(profiler.stats), media_type="application/octet-stream",
+                                    headers={"Content-Disposition": 'attachment; filename="request.pstats"'})
+            else:
+                with StackSampler(threading.get_ident()) as sampler:
+                    await self.app(scope, receive, discard)
+                wall = time.perf_counter() - started
+                if profile_format == "collapsed":
+                    response = PlainTextResponse(sampler.collapsed())
+                else:
+                    response = JSONResponse({"path": scope["path"], "status": status_code,
+                                             "wall_ms": round(wall * 1000, 3), **sampler.summary(wall)})
+            response.headers["X-Profile-Status"] = str(status_code)
+            response.headers["X-Profile-Wall-Ms"] = str(round(wall * 1000, 3))
+        await response(scope, receive, send)
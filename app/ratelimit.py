@@ -0,0 +1,184 @@
+import math
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+from fastapi import HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from .metrics import metrics
+
+
+class Limit:
+    """Token bucket parameters: up to capacity attempts at once, refilled at rate attempts per second
+    """
+    __slots__ = ("capacity", "rate")
+
+    def __init__(self, capacity: float, per_minute: float):
+        self.capacity = capacity
+        self.rate = per_minute / 60
+
+
+class RateLimitBackend(ABC):
+    """Storage of the token buckets
+    """
+    # whether take() does I/O, so it has to be called out of the event loop
+    blocking = False
+
+
+    @abstractmethod
+    def take(self, key: str, limit: Limit) -> float:
+        """Takes a token from the bucket stored under the key
+
+        Args:
+            key (str): bucket key
+            limit (Limit): bucket parameters
+
+        Returns:
+            float: 0 if the token was taken, otherwise seconds until one is available
+        """
+
+
+class InMemoryBackend(RateLimitBackend):
+    """Token buckets kept in the worker memory, least recently used first. Each worker limits on its own.
+    """
+    def __init__(self, max_buckets: int = 100_000):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        # key -> [tokens, last update, limit]
+        self._buckets: OrderedDict[str, list] = OrderedDict()
+
+
+    def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._evict(now)
+                bucket = self._buckets[key] = [limit.capacity, now, limit]
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / limit.rate
+
+
+    def _evict(self, now: float):
+        """Makes room for a new bucket: forgets the least recently used one, then the next ones as long as
+        they have refilled under their own limit, as they are equal to brand new ones. The buckets of the clients
+        still trying stay, however many new keys others send
+        """
+        self._buckets.popitem(last=False)
+        while self._buckets:
+            tokens, updated, limit = next(iter(self._buckets.values()))
+            if tokens + (now - updated) * limit.rate < limit.capacity:
+                break
+            self._buckets.popitem(last=False)
+
+
+class PostgresBackend(RateLimitBackend):
+    """Token buckets shared by all the workers, kept in an unlogged PostgreSQL table created by app.migrate.
+    A token is taken with a single upsert statement.
+    """
+    blocking = True
+
+    TABLE = "rate_limit_buckets"
+    CREATE_TABLE = ("CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (key text PRIMARY KEY, "
+                    "tokens double precision NOT NULL, allowed boolean NOT NULL, updated_at timestamptz NOT NULL)")
+
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+
+    def take(self, key: str, limit: Limit) -> float:
+        refilled = "LEAST(:capacity, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate)"
+        with self.engine.begin() as connection:
+            tokens, allowed = connection.execute(text(
+                "INSERT INTO rate_limit_buckets AS b (key, tokens, allowed, updated_at) "
+                "VALUES (:key, :capacity - 1, true, clock_timestamp()) "
+                f"ON CONFLICT (key) DO UPDATE SET tokens = CASE WHEN {refilled} >= 1 THEN {refilled} - 1 ELSE {refilled} END, "
+                f"allowed = {refilled} >= 1, updated_at = clock_timestamp() RETURNING tokens, allowed"),
+                {"key": key, "capacity": limit.capacity, "rate": limit.rate}).one()
+        return 0 if allowed else (1 - tokens) / limit.rate
+
+
+class LoginRateLimiter:
+    """Protects the login endpoint: token buckets per client IP and per login, checked before any database
+    or bcrypt work, and a cap on concurrent password verifications above which logins are shed.
+    """
+    def __init__(self, backend: RateLimitBackend | None = None, ip_limit: Limit | None = None,
+                 login_limit: Limit | None = None, max_concurrent: int | None = None):
+        """
+        Args:
+            backend (RateLimitBackend | None, optional): token buckets storage. Defaults to InMemoryBackend.
+            ip_limit (Limit | None, optional): limit per client IP, None disables it. Defaults to None.
+            login_limit (Limit | None, optional): limit per login, None disables it. Defaults to None.
+            max_concurrent (int | None, optional): concurrent verifications cap, None disables it. Defaults to None.
+        """
+        self.backend = backend or InMemoryBackend()
+        self.ip_limit = ip_limit
+        self.login_limit = login_limit
+        self.max_concurrent = max_concurrent
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+
+    def _reject(self, reason: str, retry_after: float):
+        metrics.inc(f"login.rejected.{reason}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts. Try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+    def check(self, client_ip: str, login: str):
+        """Takes a token from the client IP and from the login buckets
+
+        Args:
+            client_ip (str): client IP address
+            login (str): login being tried
+
+        Raises:
+            HTTPException: 429 if any of the buckets is empty
+        """
+        metrics.inc("login.attempts")
+        if self.ip_limit is not None:
+            retry_after = self.backend.take(f"ip:{client_ip}", self.ip_limit)
+            if retry_after:
+                self._reject("ip", retry_after)
+        if self.login_limit is not None:
+            retry_after = self.backend.take(f"login:{login.lower()}", self.login_limit)
+            if retry_after:
+                self._reject("login", retry_after)
+
+
+    @contextmanager
+    def admission(self) -> Iterator[None]:
+        """Admits a password verification unless the concurrent verifications cap is reached
+
+        Raises:
+            HTTPException: 503 when the verification is shed
+        """
+        with self._lock:
+            if self.max_concurrent is not None and self._in_flight >= self.max_concurrent:
+                metrics.inc("login.rejected.shed")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy. Try again later.",
+                    headers={"Retry-After": "1"}
+                )
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
@@ -0,0 +1,56 @@
+from datetime import date
+from fastapi import APIRouter, Depends, Query
+from typing import Annotated
+from sqlalchemy.orm import Session
+from ..utils import Tags, RowsResponse
+from ..dependencies import get_db, get_current_active_admin
+from ..tracing import TracedRoute
+from .. import analytics, schemas
+
+
+router = APIRouter(
+    prefix="/analytics",
+    route_class=TracedRoute,
+    dependencies=[Depends(get_db)],
+    responses={404: {"description": "Not found"}},
+)
+
+
+StartCity = Annotated[str | None, Query(description="start city")]
+DestinationCity = Annotated[str | None, Query(description="destination city")]
+DayFrom = Annotated[date | None, Query(alias="from", description="earliest departure day (inclusive)")]
+DayTo = Annotated[date | None, Query(alias="to", description="latest departure day (inclusive)")]
+Limit = Annotated[int, Query(gt=0, le=1000, description="number of rows")]
+
+
+@router.get("/routes", response_model=list[schemas.RouteStats], summary = "View the route analytics",
+            response_description = "Successfully read the route analytics.", tags = [Tags.adm_actions_analytics])
+async def view_route_stats(current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
+                           start_city: StartCity = None, destination_city: DestinationCity = None,
+                           day_from: DayFrom = None, day_to: DayTo = None, limit: Limit = 100,
+                           db: Session = Depends(get_db)) -> RowsResponse:
+    """
+    Views rides, offered seats, bookings, booked seats, revenue and booking rate (booked to offered seats) per route,
+    the routes with the highest revenue first.
+
+    Optionally narrowed to a **start_city**, a **destination_city** (str) and departures between **from** and **to** (date).
+    """
+    stats = analytics.route_stats(db=db, start_city=start_city, destination_city=destination_city,
+                                  day_from=day_from, day_to=day_to, limit=limit)
+    return RowsResponse(stats)
+
+
+@router.get("/routes/daily", response_model=list[schemas.RouteDailyStats], summary = "View the route analytics per day",
+            response_description = "Successfully read the route analytics per day.", tags = [Tags.adm_actions_analytics])
+async def view_route_daily_stats(current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
+                                 start_city: StartCity = None, destination_city: DestinationCity = None,
+                                 day_from: DayFrom = None, day_to: DayTo = None, limit: Limit = 100,
+                                 db: Session = Depends(get_db)) -> RowsResponse:
+    """
+    Views the route analytics per route and departure day, ordered by route and day.
+
+    Optionally narrowed to a **start_city**, a **destination_city** (str) and departures between **from** and **to** (date).
+    """
+    stats = analytics.route_stats(db=db, start_city=start_city, destination_city=destination_city,
+                                  day_from=day_from, day_to=day_to, daily=True, limit=limit)
+    return RowsResponse(stats)
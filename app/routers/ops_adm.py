@@ -0,0 +1,178 @@
+import os
+import tracemalloc
+from dataclasses import asdict
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from typing import Annotated
+from ..utils import Tags, MemoryGroup
+from ..dependencies import get_current_active_admin
+from ..metrics import metrics
+from ..looplag import loop_lag_monitor
+from ..memory import memory_tracker
+from ..tracing import TracedRoute, summarize, to_otlp, tracer
+from .. import schemas
+
+
+router = APIRouter(
+    prefix="/ops",
+    route_class=TracedRoute,
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/metrics", summary = "View the worker metrics",
+            response_description = "Successfully read the metrics.", tags = [Tags.adm_actions_ops])
+async def view_metrics(current_user: Annotated[schemas.User, Depends(get_current_active_admin)]) -> dict:
+    """
+    Views counters and gauges recorded by the worker handling the request, e.g. rejected login attempts
+    (**login.rejected.ip**, **login.rejected.login**, **login.rejected.shed**), the event loop lag
+    (**loop.lag.ms**, **loop.lag.max_ms**) and stalls per blocking location (**loop.blocked.<module>:<function>**).
+
+    Returns a dictionary with counters and gauges.
+    """
+    return metrics.snapshot()
+
+
+@router.get("/loop-lag", summary = "View the recent event loop stalls",
+            response_description = "Successfully read the stalls.", tags = [Tags.adm_actions_ops])
+async def view_loop_lag(current_user: Annotated[schemas.User, Depends(get_current_active_admin)]) -> dict:
+    """
+    Views the most recent stalls of the worker event loop: how long the loop had been blocked when it was caught,
+    the route of the request being handled, the blocking location and the stack of the blocking call.
+
+    Returns a dictionary with the monitor settings and the stalls, the latest last.
+    """
+    return {
+        "interval_s": loop_lag_monitor.interval,
+        "threshold_s": loop_lag_monitor.threshold,
+        "stalls": [asdict(stall) for stall in loop_lag_monitor.stalls],
+    }
+
+
+GroupBy = Annotated[MemoryGroup, Query(description="grouping of the allocation sites")]
+Limit = Annotated[int, Query(gt=0, le=500, description="number of groups")]
+
+
+def _tracing_status() -> dict:
+    current, peak = tracemalloc.get_traced_memory()
+    return {"worker": os.getpid(), "tracing": memory_tracker.tracing,
+            "traced_kib": round(current / 1024, 1), "peak_kib": round(peak / 1024, 1)}
+
+
+def _snapshot_not_found(snapshot_id: int) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                         detail=f"snapshot {snapshot_id} not found in worker {os.getpid()}")
+
+
+@router.post("/memory/start", summary = "Start tracing the memory allocations",
+             response_description = "Tracing started.", tags = [Tags.adm_actions_ops])
+async def start_memory_tracing(current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
+                               frames: Annotated[int, Query(gt=0, le=50)] = 1) -> dict:
+    """
+    Starts tracing the memory allocations of the worker handling the request, storing **frames** (int, defaults to 1)
+    frames per allocation. Tracing slows the worker down until it is stopped.
+
+    Returns a dictionary with the worker and its traced memory.
+    """
+    memory_tracker.start(frames)
+    return _tracing_status()
+
+
+@router.post("/memory/stop", summary = "Stop tracing the memory allocations",
+             response_description = "Tracing stopped.", tags = [Tags.adm_actions_ops])
+async def stop_memory_tracing(current_user: Annotated[schemas.User, Depends(get_current_active_admin)]) -> dict:
+    """
+    Stops tracing the memory allocations of the worker handling the request and drops its snapshots.
+
+    Returns a dictionary with the worker.
+    """
+    memory_tracker.stop()
+    return _tracing_status()
+
+
+@router.post("/memory/snapshots", summary = "Take a memory snapshot",
+             response_description = "Snapshot taken.", tags = [Tags.adm_actions_ops])
+async def take_memory_snapshot(current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
+                               group_by: GroupBy = MemoryGroup.package, limit: Limit = 20) -> dict:
+    """
+    Takes a snapshot of the memory traced in the worker handling the request.
+
+    Returns a dictionary with the snapshot **id** and the **top** allocation sites grouped by **group_by**
+    (module, package or line), or raises a HTTPException if tracing isn't started.
+    """
+    # snapshots and their statistics walk every traced block, out of the event loop
+    try:
+        snapshot_id = await run_in_threadpool(memory_tracker.take)
+    except RuntimeError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    top = await run_in_threadpool(memory_tracker.top, snapshot_id, group_by, limit)
+    return {"id": snapshot_id, **_tracing_status(), "top": top}
+
+
+@router.get("/memory/snapshots/{snapshot_id}", summary = "View the top allocation sites of a memory snapshot",
+            response_description = "Successfully read the snapshot.", tags = [Tags.adm_actions_ops])
+async def view_memory_snapshot(snapshot_id: int, current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
+                               group_by: GroupBy = MemoryGroup.package, limit: Limit = 20) -> dict:
+    """
+    Views the allocation sites holding the most memory in the snapshot **snapshot_id** (int), grouped by **group_by**.
+
+    Returns a dictionary with the **top** allocation sites or raises a HTTPException if there's no such snapshot in the worker.
+    """
+    try:
+        top = await run_in_threadpool(memory_tracker.top, snapshot_id, group_by, limit)
+    except KeyError:
+        raise _snapshot_not_found(snapshot_id)
+    return {"id": snapshot_id, **_tracing_status(), "top": top}
+
+
+@router.get("/memory/diff", summary = "Compare two memory snapshots",
+            response_description = "Successfully compared the snapshots.", tags = [Tags.adm_actions_ops])
+async def compare_memory_snapshots(current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
+                                   base: int, current: int | None = None,
+                                   group_by: GroupBy = MemoryGroup.package, limit: Limit = 20) -> dict:
+    """
+    Compares the snapshot **base** (int) with the later snapshot **current** (int, defaults to a new snapshot).
+
+    Returns a dictionary with the allocation sites which changed the most (**diff**), grouped by **group_by**,
+    or raises a HTTPException if there's no such snapshot in the worker or tracing isn't started.
+    """
+    if current is None:
+        try:
+            current = await run_in_threadpool(memory_tracker.take)
+        except RuntimeError as error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    try:
+        diff = await run_in_threadpool(memory_tracker.diff, base, current, group_by, limit)
+    except KeyError as error:
+        raise _snapshot_not_found(error.args[0])
+    return {"base": base, "current": current, **_tracing_status(), "diff": diff}
+
+
+@router.get("/traces", summary = "View the recent request traces",
+            response_description = "Successfully read the traces.", tags = [Tags.adm_actions_ops])
+async def view_traces(current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
+                      limit: Annotated[int, Query(gt=0, le=200)] = 20) -> dict:
+    """
+    Views the **limit** (int, defaults to 20) most recent traces kept by the worker handling the request, the latest first,
+    as an OpenTelemetry (OTLP JSON) export request.
+
+    Returns a dictionary with the resourceSpans and a **summary** per trace: time spent on SQL statements, emails and the rest.
+    """
+    traces = tracer.recent(limit)
+    return {"summary": {spans[0].trace_id: summarize(spans) for spans in traces},
+            **to_otlp([span for spans in traces for span in spans])}
+
+
+@router.get("/traces/{trace_id}", summary = "View a request trace",
+            response_description = "Successfully read the trace.", tags = [Tags.adm_actions_ops])
+async def view_trace(trace_id: str, current_user: Annotated[schemas.User, Depends(get_current_active_admin)]) -> dict:
+    """
+    Views the trace **trace_id** (str, sent in the X-Trace-Id response header) as an OpenTelemetry (OTLP JSON) export request.
+
+    Returns a dictionary with the resourceSpans and the **summary**: time spent on SQL statements, emails and the rest,
+    or raises a HTTPException if the worker doesn't keep such trace.
+    """
+    spans = tracer.get(trace_id)
+    if spans is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"trace {trace_id} not found in worker {os.getpid()}")
+    return {"summary": summarize(spans), **to_otlp(spans)}
@@ -1,72 +1,160 @@
-from starlette.responses import JSONResponse
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from starlette.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
 from typing import Annotated
 from sqlalchemy.orm import Session
-from ..utils import Tags, EmailUtils
+from ..utils import Tags, EmailUtils, PageResponse, RideOrder, RowsResponse
 from ..dependencies import get_db, get_current_active_user
-from .. import crud, schemas
+from ..idempotency import idempotency_store
+from ..feed import ride_feed
+from ..tracing import TracedRoute
+from .. import changes, crud, schemas
 
 
 router = APIRouter(
     prefix="/rides",
+    route_class=TracedRoute,
     dependencies=[Depends(get_db)],
     responses={404: {"description": "Not found"}},
 )
 
 
+DepartureFrom = Annotated[datetime | None, Query(alias="from", description="earliest departure date (inclusive)")]
+DepartureTo = Annotated[datetime | None, Query(alias="to", description="latest departure date (inclusive)")]
+Order = Annotated[RideOrder, Query(description="ordering of the results, prefix with - for descending")]
+
+
 @router.post("/{ride_id}/reserve", summary= "Book an available ride", tags = [Tags.rides])
 async def reserve_ride(ride_id: int, current_user: Annotated[schemas.User, Depends(get_current_active_user)],
+                        seats: Annotated[int, Query(gt=0, description="number of seats to book")] = 1,
+                        idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
                         db: Session = Depends(get_db)) -> JSONResponse:
-    """Reserves a ride providing **ride_id** (int) - user can get it, viewing rides at the GET /rides/ endpoints.
+    """Reserves **seats** (int, defaults to 1) on a ride providing **ride_id** (int) - user can get it, viewing rides at the GET /rides/ endpoints.
 
-    After the booking process, the ride will be archivised and have id of current user bound to it.
+    After the booking process, a single-seat ride will have id of current user bound to it, a shared ride keeps its bookings only, and the ride will be archivised once all of its seats are taken.
     In addition, the user will have all the ride details mailed to him.
 
-    Returns JSONResponse with the success confirmation message or raises HTTPException if there's no such ride.
+    Send an **Idempotency-Key** header to retry safely: a repeated request with the same key replays the first response
+    instead of booking again.
+
+    Returns JSONResponse with the success confirmation message or raises HTTPException if there's no such ride or not enough seats left.
     """
-    ride = crud.get_ride_by_ID(db=db, ride_id=ride_id)
-    if ride is None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Can't find any ride with id = {ride_id}."
-        )
-    if ride.is_active == False:
-        raise HTTPException(
-            status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-            detail="The ride is no longer active."
-        )
-    crud.archivise_ride(db=db, ride_id=ride_id, user_id_taken=current_user.id)
-    await EmailUtils.send_booking_confirmation_email(user=current_user, ride=ride)
-    return JSONResponse(status_code=200, content={"message": f"The ride was booked successfully and a detailed email has been sent to {current_user.login}"})
+    async with idempotency_store.guard(db, scope=f"POST /rides/{ride_id}/reserve user={current_user.id}",
+                                       key=idempotency_key, fingerprint=str(seats)) as guard:
+        if guard.replay is not None:
+            return guard.replay
+        ride = crud.get_ride_by_ID(db=db, ride_id=ride_id)
+        if ride is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Can't find any ride with id = {ride_id}."
+            )
+        if ride.is_active == False:
+            raise HTTPException(
+                status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+                detail="The ride is no longer active."
+            )
+        booking = crud.reserve_ride(db=db, ride_id=ride_id, user_id=current_user.id, seats=seats)
+        if booking is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Not enough seats available."
+            )
+        await EmailUtils.send_booking_confirmation_email(user=current_user, ride=ride, seats=seats)
+        return guard.save(JSONResponse(status_code=200, content={"message": f"The ride was booked successfully and a detailed email has been sent to {current_user.login}",
+                                                                 "booking_id": booking.id}))
     
 
 @router.get("/", response_model=list[schemas.Ride], summary = "Show available rides", tags = [Tags.rides])
 async def get_all_rides(current_user: Annotated[schemas.User, Depends(get_current_active_user)],
-                        db: Session = Depends(get_db)) -> list[schemas.Ride]:
+                        departure_from: DepartureFrom = None, departure_to: DepartureTo = None,
+                        order: Order = RideOrder.departure_asc, db: Session = Depends(get_db)) -> RowsResponse:
     """Gets list of all active rides.
+
+    Optionally narrowed to departures between **from** and **to** (datetime) and sorted by **order**.
+    """
+    rides = crud.get_all_rides(db=db, departure_from=departure_from, departure_to=departure_to, order=order)
+    return RowsResponse(rides)
+
+
+@router.get("/feed", response_class=StreamingResponse, summary = "Subscribe to the ride changes", tags = [Tags.rides])
+async def subscribe_rides(current_user: Annotated[schemas.User, Depends(get_current_active_user)],
+                          start_city: Annotated[str | None, Query(description="start city")] = None,
+                          destination_city: Annotated[str | None, Query(description="destination city")] = None,
+                          db: Session = Depends(get_db)) -> StreamingResponse:
+    """Streams the changes of the rides as Server-Sent Events, instead of polling the ride lists.
+
+    Optionally narrowed to the rides from a **start_city** and/or to a **destination_city** (str).
+    Events are **create**, **reserve**, **update** (seats given back) and **archive** with the ride, and **delete**
+    with the ride id and cities, made through any worker.
+    A **lagged** event means that some events were dropped for a slow client, which should refetch the rides then.
     """
-    return crud.get_all_rides(db=db)
+    # the stream may last for hours, it mustn't hold a pooled connection
+    db.close()
+    subscriber = ride_feed.subscribe(start_city=start_city, destination_city=destination_city)
+    return StreamingResponse(ride_feed.stream(subscriber), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/changes", response_model=schemas.RideChanges, summary = "Sync the ride changes after a cursor", tags = [Tags.rides])
+async def get_ride_changes(current_user: Annotated[schemas.User, Depends(get_current_active_user)],
+                           since: Annotated[int | None, Query(ge=0, description="cursor of the previous page")] = None,
+                           limit: Annotated[int, Query(gt=0, le=1000, description="number of changes")] = 500,
+                           db: Session = Depends(get_db)) -> PageResponse:
+    """Gets the rides inserted, updated or deleted after the cursor **since** (int), for the clients mirroring the rides.
+
+    Without **since** returns the current cursor only: take it, fetch the rides, then keep asking for the changes
+    after the cursor of the last page while **has_more** is true. Inserted and updated rides come with their current row
+    (inactive ones should be dropped from the mirror), deleted ones with their id. Changes already seen may come again.
+
+    Raises HTTPException with status 410 if the changes after the cursor are no longer kept, the client should fetch
+    the rides again then.
+    """
+    if since is None:
+        return PageResponse({"cursor": changes.current_cursor(db), "has_more": False, "changes": []})
+    page = changes.changes_since(db=db, since=since, limit=limit)
+    if page is None:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="The changes after this cursor are no longer kept, fetch the rides again."
+        )
+    return PageResponse(page)
 
 
 @router.get("/{start_city}/", response_model=list[schemas.Ride], summary = "Show available rides from specific city", tags = [Tags.rides])
 async def get_all_rides_by_starting_city(start_city: str, current_user: Annotated[schemas.User, Depends(get_current_active_user)],
-                        db: Session = Depends(get_db)) -> list[schemas.Ride]:
+                        departure_from: DepartureFrom = None, departure_to: DepartureTo = None,
+                        order: Order = RideOrder.departure_asc, db: Session = Depends(get_db)) -> RowsResponse:
     """Gets list of all active rides from **start_city** (str).
+
+    Optionally narrowed to departures between **from** and **to** (datetime) and sorted by **order**.
     """
-    return crud.get_rides_by_start_city(db=db, start_city=start_city)
+    rides = crud.get_rides_by_start_city(db=db, start_city=start_city, departure_from=departure_from,
+                                         departure_to=departure_to, order=order)
+    return RowsResponse(rides)
 
 
 @router.get("/all/{destination_city}", response_model=list[schemas.Ride], summary = "Show available rides to specific city", tags = [Tags.rides])
 async def get_all_rides_by_destination_city(destination_city: str, current_user: Annotated[schemas.User, Depends(get_current_active_user)],
-                        db: Session = Depends(get_db)) -> list[schemas.Ride]:
+                        departure_from: DepartureFrom = None, departure_to: DepartureTo = None,
+                        order: Order = RideOrder.departure_asc, db: Session = Depends(get_db)) -> RowsResponse:
     """Gets list of all active rides to **destination_city** (str).
+
+    Optionally narrowed to departures between **from** and **to** (datetime) and sorted by **order**.
     """
-    return crud.get_rides_by_destination_city(db=db, destination_city=destination_city)
+    rides = crud.get_rides_by_destination_city(db=db, destination_city=destination_city, departure_from=departure_from,
+                                                departure_to=departure_to, order=order)
+    return RowsResponse(rides)
 
 
 @router.get("/{start_city}/{destination_city}", response_model=list[schemas.Ride], summary = "Show all available rides from one city to another", tags = [Tags.rides])
 async def get_all_rides_from_one_city_to_another(start_city: str, destination_city: str, current_user: Annotated[schemas.User, Depends(get_current_active_user)],
-                        db: Session = Depends(get_db)) -> list[schemas.Ride]:
+                        departure_from: DepartureFrom = None, departure_to: DepartureTo = None,
+                        order: Order = RideOrder.departure_asc, db: Session = Depends(get_db)) -> RowsResponse:
     """Gets list of all active rides from **start_city** (str) to **destination_city** (str).
+
+    Optionally narrowed to departures between **from** and **to** (datetime) and sorted by **order**.
     """
-    return crud.get_rides_by_cities(db=db, start_city=start_city, destination_city=destination_city)
\ No newline at end of file
+    rides = crud.get_rides_by_cities(db=db, start_city=start_city, destination_city=destination_city,
+                                     departure_from=departure_from, departure_to=departure_to, order=order)
+    return RowsResponse(rides)
\ No newline at end of file
@@ -4,11 +4,13 @@ from typing import Annotated
 from sqlalchemy.orm import Session
 from ..utils import Tags
 from ..dependencies import get_db, get_current_active_admin
+from ..tracing import TracedRoute
 from .. import crud, schemas
 
 
 router = APIRouter(
     prefix="/rides",
+    route_class=TracedRoute,
     dependencies=[Depends(get_db)],
     responses={404: {"description": "Not found"}},
 )
@@ -38,7 +40,7 @@ async def archivise_ride(ride_id: int, current_user: Annotated[schemas.User, Dep
     ride = crud.get_ride_by_ID(db=db, ride_id=ride_id)
     if ride is not None:
         if ride.is_active == True:
-            return crud.archivise_ride(db=db, ride_id=ride_id, user_id_taken=-1)
+            return crud.archivise_ride(db=db, ride_id=ride_id)
         else:
             raise HTTPException(
             status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
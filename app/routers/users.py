@@ -1,16 +1,18 @@
 import re
 from starlette.responses import JSONResponse
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
 from typing import Annotated
 from sqlalchemy.orm import Session
-from ..utils import Tags, EmailUtils
+from ..utils import Tags, EmailUtils, RowsResponse
 from ..dependencies import get_db, get_current_user, get_current_active_user
+from ..idempotency import idempotency_store, request_fingerprint
+from ..tracing import TracedRoute
 from .. import crud, schemas
 
 
 router = APIRouter(
     prefix="/users",
+    route_class=TracedRoute,
     dependencies=[Depends(get_db)],
     responses={404: {"description": "Not found"}},
 )
@@ -19,7 +21,8 @@ router = APIRouter(
 @router.post("/", response_model=schemas.User, summary= "Create an user account",
           response_description = "Succesfully created an user account.",
           tags = [Tags.acc_create])
-async def create_user(user: schemas.CreateUser, db: Session = Depends(get_db)) -> JSONResponse:
+async def create_user(user: schemas.CreateUser, idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
+                      db: Session = Depends(get_db)) -> JSONResponse:
     """
     Creates an user account, providing information:
 
@@ -38,6 +41,9 @@ async def create_user(user: schemas.CreateUser, db: Session = Depends(get_db)) -
 
     **Users with the admin status are active by default and thus do not have to activate their account.**
 
+    Send an **Idempotency-Key** header to retry safely: a repeated request with the same key replays the first response
+    instead of creating the account again. Keys are scoped by the login, signups of other logins never collide.
+
     Returns JSONResponse with user data and confirmation about sending an activation email.
     """
 
@@ -48,23 +54,26 @@ async def create_user(user: schemas.CreateUser, db: Session = Depends(get_db)) -
             status_code=status.HTTP_405_METHOD_NOT_ALLOWED, 
             detail="Login is not a valid email address."
         )
-    db_user = crud.get_user_by_login(db=db, user_login=user.login)
-    if db_user:
-        raise HTTPException(
-            status_code=status.HTTP_405_METHOD_NOT_ALLOWED, 
-            detail="Email already registered"
-            )
-    crud.create_user(db=db, user=user)
-    new_user = crud.get_user_by_login(db=db, user_login=user.login)
-
-    user_data = user.model_dump()
-    user_data = {info:user_data[info] for info in user_data if info!='hashed_password'}
-    
-    if new_user.is_admin == False:
-        await EmailUtils.send_activation_link(user=new_user)
-        return JSONResponse(status_code=200, content={"user data: ": [user_data], "message": f"activation link has been sent to {new_user.login}"})
-    else:
-        return JSONResponse(status_code=200, content={"user data: ": [user_data], "message": "user is a superuser. Automatic account activation."})
+    # signups have no caller identity yet, keys are scoped by the login being registered
+    async with idempotency_store.guard(db, scope=f"POST /users/ login={user.login}", key=idempotency_key,
+                                       fingerprint=request_fingerprint(user.model_dump(exclude={"hashed_password"}))) as guard:
+        if guard.replay is not None:
+            return guard.replay
+        new_user = crud.create_user(db=db, user=user)
+        if new_user is None:
+            raise HTTPException(
+                status_code=status.HTTP_405_METHOD_NOT_ALLOWED, 
+                detail="Email already registered"
+                )
+
+        user_data = user.model_dump()
+        user_data = {info:user_data[info] for info in user_data if info!='hashed_password'}
+        
+        if new_user.is_admin == False:
+            await EmailUtils.send_activation_link(user=new_user)
+            return guard.save(JSONResponse(status_code=200, content={"user data: ": [user_data], "message": f"activation link has been sent to {new_user.login}"}))
+        else:
+            return guard.save(JSONResponse(status_code=200, content={"user data: ": [user_data], "message": "user is a superuser. Automatic account activation."}))
 
 
 @router.get("/me/", response_model = schemas.User, summary = "Read my info",
@@ -79,6 +88,22 @@ async def read_my_info(
     return current_user
 
 
+@router.get("/me/rides", response_model = list[schemas.BookedRide], summary = "Read my booked rides",
+            response_description = "Successfully read a page of my bookings.", tags = [Tags.my_acc])
+async def read_my_rides(current_user: Annotated[schemas.User, Depends(get_current_active_user)],
+                        before: Annotated[int | None, Query(gt=0, description="booking id of the last booking of the previous page")] = None,
+                        limit: Annotated[int, Query(gt=0, le=200, description="number of bookings")] = 50,
+                        db: Session = Depends(get_db)) -> RowsResponse:
+    """
+    Returns your bookings along with the booked rides, newest first: booking id, number of booked seats, booking date
+    and the ride details.
+
+    Pages hold up to **limit** (int, defaults to 50) bookings. To get the next page, pass the booking id of the last booking
+    of the current one as **before** (int); a page shorter than the limit is the last one.
+    """
+    return RowsResponse(crud.get_booked_rides(db=db, user_id=current_user.id, before=before, limit=limit))
+
+
 @router.get("/me/send-activation-code", summary = "Resend activation code",
            response_description = "Successfully send activation email.", tags = [Tags.my_acc])
 async def send_activation_code(current_user: Annotated[schemas.User, Depends(get_current_user)]) -> JSONResponse:
@@ -113,22 +138,27 @@ db: Session = Depends(get_db)) -> JSONResponse:
 
     After using this endpoint, the user should be now active.
 
-    Returns JSONResponse with the success confirmation message.
+    Returns JSONResponse with the success confirmation message or raises a HTTPException if there's no such user,
+    user is already active or the activation code is incorrect.
     """
-    user_login = crud.get_user_by_ID(db=db, user_id=user_id).login
-    if crud.get_user_by_login(db=db,user_login=user_login).is_active == True:
-        raise HTTPException(
-            status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-            detail="User already active",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    elif crud.get_user_by_login(db=db,user_login=user_login).activation_code != activation_code:
+    if not crud.activate_user_with_code(db=db, user_id=user_id, activation_code=activation_code):
+        user = crud.get_user_by_ID(db=db, user_id=user_id)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+                detail=f"There's no user with id = {user_id}"
+            )
+        elif user.is_active == True:
+            raise HTTPException(
+                status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+                detail="User already active",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect activation code.",
             headers={"WWW-Authenticate": "Bearer"}
         )
-    crud.activate_user(db=db, user_login=user_login)
     return JSONResponse(status_code = 200, content={"message": "your account has been activated."})
 
 
@@ -144,10 +174,10 @@ db: Session = Depends(get_db)) -> JSONResponse:
     Returns JSONResponse with the success confirmation message.
     """
     if current_user.is_admin:
-        crud.remove_user(db=db, user_login=current_user.login)
+        crud.remove_user(db=db, user_id=current_user.id)
         return JSONResponse(status_code=200, content={"message": "Your account has been deleted."})
     else:
         username = current_user.login
         await EmailUtils.send_self_deletion_email(user=current_user)
-        crud.remove_user(db=db, user_login=current_user.login)
+        crud.remove_user(db=db, user_id=current_user.id)
         return JSONResponse(status_code=200, content={"message": f"Your account has been deleted. An email has been sent to the {username}."})
\ No newline at end of file
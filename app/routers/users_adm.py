@@ -1,19 +1,57 @@
 from starlette.responses import JSONResponse
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from typing import Annotated
 from sqlalchemy.orm import Session
-from ..utils import Tags, EmailUtils
+from ..utils import Tags, EmailUtils, RowsResponse
 from ..dependencies import get_db, get_current_active_admin
+from ..tracing import TracedRoute
 from .. import crud, schemas
 
 
 router = APIRouter(
     prefix="/users",
+    route_class=TracedRoute,
     dependencies=[Depends(get_db)],
     responses={404: {"description": "Not found"}},
 )
 
 
+def _not_updated(db: Session, username: str, detail: str) -> HTTPException:
+    """Builds the error of an update which matched no user, looking the user up only on that failure path
+
+    Args:
+        db (Session): database session
+        username (str): user login
+        detail (str): error detail if the user exists but is already in the requested state
+
+    Returns:
+        HTTPException
+    """
+    if crud.get_user_by_login(db=db, user_login=username) is None:
+        detail = f"There's no user with email = {username}"
+    return HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail=detail)
+
+
+@router.get("/", response_model = list[schemas.User], summary = "List users",
+            response_description = "Successfully read a page of users.", tags = [Tags.adm_actions_users])
+async def list_users(current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
+                     after: Annotated[int, Query(ge=0, description="id of the last user of the previous page")] = 0,
+                     limit: Annotated[int, Query(gt=0, le=500, description="number of users")] = 50,
+                     is_active: Annotated[bool | None, Query(description="active status")] = None,
+                     is_admin: Annotated[bool | None, Query(description="admin status")] = None,
+                     login_prefix: Annotated[str | None, Query(max_length=255, description="beginning of the login")] = None,
+                     db: Session = Depends(get_db)) -> RowsResponse:
+    """
+    Lists users ordered by id, optionally filtered by **is_active** (bool), **is_admin** (bool) and **login_prefix** (str).
+    Hashed passwords and verification codes won't be showed.
+
+    Pages hold up to **limit** (int, defaults to 50) users. To get the next page, pass the id of the last user
+    of the current one as **after** (int); a page shorter than the limit is the last one.
+    """
+    users = crud.get_users(db=db, after=after, limit=limit, is_active=is_active, is_admin=is_admin, login_prefix=login_prefix)
+    return RowsResponse(users)
+
+
 @router.get("/{username}", response_model = schemas.User, summary = "View an user info",
             response_description = "Successfully read an user info.", tags = [Tags.adm_actions_users])
 async def view_user_info(username: str, current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
@@ -43,24 +81,14 @@ async def grant_adm(username: str, current_user: Annotated[schemas.User, Depends
 
     Returns an User object or raises a HTTPException if user is already an admin or there's no such user.
     """
-    user = crud.get_user_by_login(db=db, user_login=username)
-    if user is not None:
-        if user.is_admin:
-            raise HTTPException(
-            status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-            detail="User already an admin"
-            )
-        else:
-            return crud.grant_admin_status(db=db, user_login=username)
-    else:
-        raise HTTPException(
-        status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-        detail=f"There's no user with email = {username}"
-        )
+    user = crud.grant_admin_status(db=db, user_login=username)
+    if user is None:
+        raise _not_updated(db=db, username=username, detail="User already an admin")
+    return user
 
 
 @router.patch("/{username}/remove-adm", response_model = schemas.User, summary = "Remove the admin status from an user",
-              response_description = "Successfully taken the admin status from an user.",  tags = [Tags.adm_actions_users])
+              response_description = "Successfully taken the admin status from an user.", tags = [Tags.adm_actions_users])
 async def remove_adm(username: str, current_user: Annotated[schemas.User, Depends(get_current_active_admin)],
                       db: Session = Depends(get_db)) -> schemas.User:
     """
@@ -68,14 +96,10 @@ async def remove_adm(username: str, current_user: Annotated[schemas.User, Depend
 
     Returns an User object or raises a HTTPException if user is already not an admin or there's no such user. 
     """
-    user = crud.get_user_by_login(db=db, user_login=username)
-    if user is not None:
-        return crud.remove_admin_status(db=db, user_login=username)
-    else:
-        raise HTTPException(
-        status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-        detail=f"There's no user with email = {username}"
-        )
+    user = crud.remove_admin_status(db=db, user_login=username)
+    if user is None:
+        raise _not_updated(db=db, username=username, detail="User not an admin")
+    return user
 
 
 @router.patch("/{username}/activate", response_model = schemas.User, summary = "Activate an user",
@@ -88,20 +112,10 @@ async def activate_user(username: str, current_user: Annotated[schemas.User, Dep
 
     Returns an User object or raises a HTTPException if user is already active or there's no such user.
     """
-    user = crud.get_user_by_login(db=db, user_login=username)
-    if user is not None:
-        if user.is_active:
-            raise HTTPException(
-            status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-            detail="User already active"
-            )
-        else:
-            return crud.activate_user(db=db, user_login=username)
-    else:
-        raise HTTPException(
-        status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-        detail=f"There's no user with email = {username}"
-        )
+    user = crud.activate_user(db=db, user_login=username)
+    if user is None:
+        raise _not_updated(db=db, username=username, detail="User already active")
+    return user
 
 
 @router.patch("/{username}/deactivate", response_model = schemas.User, summary = "Deactivate an user",
@@ -113,20 +127,10 @@ async def deactivate_user(username: str, current_user: Annotated[schemas.User, D
 
     Returns an User object or raises a HTTPException if user is already inactive or there's no such user.
     """
-    user = crud.get_user_by_login(db=db, user_login=username)
-    if user is not None:
-        if user.is_active == False:
-            raise HTTPException(
-            status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-            detail="User already inactive"
-            )
-        else:
-            return crud.deactivate_user(db=db, user_login=username)
-    else:
-        raise HTTPException(
-        status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-        detail=f"There's no user with email = {username}"
-        )
+    user = crud.deactivate_user(db=db, user_login=username)
+    if user is None:
+        raise _not_updated(db=db, username=username, detail="User already inactive")
+    return user
 
 
 @router.delete("/{username}/delete", summary = "Delete an user",
@@ -143,7 +147,7 @@ async def delete_user(username: str, current_user: Annotated[schemas.User, Depen
     user = crud.get_user_by_login(db=db, user_login=username)
     if user is not None:
         await EmailUtils.send_deletion_email(user=user)
-        crud.remove_user(db=db, user_login=username)
+        crud.remove_user(db=db, user_id=user.id)
         return JSONResponse(status_code = 200, content={"message": f"user has been deleted. An email has been sent to the {username}."})
     else:
         raise HTTPException(
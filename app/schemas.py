@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from datetime import datetime
+from pydantic import BaseModel, EmailStr, Field
+from datetime import date, datetime
 
 
 class UserBase(BaseModel):
@@ -46,20 +46,20 @@ class User(UserBase):
         """https://docs.pydantic.dev/latest/usage/models/#orm-mode-aka-arbitrary-class-instances
         """        
         from_attributes=True
-        orm_mode = True
 
 
 class RideBase(BaseModel):
     """Ride base schema based on pydantic BaseModel
 
     Args:
-        BaseModel (str | float | datetime)
+        BaseModel (str | float | datetime | int)
     """    
     start_city: str
     destination_city: str
     distance: float
     km_fee: float
     departure_date: datetime
+    seats: int = Field(default=1, gt=0)
 
 
 class RideCreate(RideBase):
@@ -69,7 +69,8 @@ class RideCreate(RideBase):
 
 
 class Ride(RideBase):
-    """Schema for default ride info: autoincremented id, calculated price, active status and id of user who took the ride (or will take)
+    """Schema for default ride info: autoincremented id, calculated price, active status, seats left
+    and id of the last user who took the ride (or will take)
 
     Args:
         RideBase (int | float | bool | None)
@@ -78,12 +79,91 @@ class Ride(RideBase):
     price: float
     is_active: bool = True
     user_id_taken: int | None = None
+    seats_available: int = 1
 
     class Config:
         """https://docs.pydantic.dev/latest/usage/models/#orm-mode-aka-arbitrary-class-instances
         """        
         from_attributes=True
-        orm_mode = True
+
+
+class Booking(BaseModel):
+    """Schema for a reservation of seats on a ride
+
+    Args:
+        BaseModel (int | datetime)
+    """    
+    id: int
+    ride_id: int
+    user_id: int
+    seats: int
+    created_at: datetime
+
+    class Config:
+        """https://docs.pydantic.dev/latest/usage/models/#orm-mode-aka-arbitrary-class-instances
+        """        
+        from_attributes=True
+
+
+class BookedRide(Ride):
+    """Schema for a booking of an user along with the booked ride
+
+    Args:
+        Ride (int | datetime): booking id, number of booked seats and the booking date
+    """    
+    booking_id: int
+    seats_booked: int
+    booked_at: datetime
+
+
+class RideChange(BaseModel):
+    """Schema for a change of a ride in the ride change log: insert, update or delete,
+    along with the current ride (None once deleted)
+
+    Args:
+        BaseModel (str | int | Ride | None)
+    """    
+    operation: str
+    ride_id: int
+    ride: Ride | None = None
+
+
+class RideChanges(BaseModel):
+    """Schema for a page of the ride change log: the cursor to ask for the next page with,
+    whether more changes are waiting and the changes after the previous cursor
+
+    Args:
+        BaseModel (int | bool | list[RideChange])
+    """    
+    cursor: int
+    has_more: bool = False
+    changes: list[RideChange] = []
+
+
+class RouteStats(BaseModel):
+    """Schema for the analytics of a route: rides, offered and booked seats, bookings, revenue
+    and the share of the offered seats which were booked
+
+    Args:
+        BaseModel (str | int | float | None)
+    """    
+    start_city: str
+    destination_city: str
+    rides: int
+    seats: int
+    bookings: int
+    seats_booked: int
+    revenue: float
+    booking_rate: float | None = None
+
+
+class RouteDailyStats(RouteStats):
+    """Schema for the analytics of a route on a departure day
+
+    Args:
+        RouteStats (date)
+    """    
+    day: date
 
 
 class Token(BaseModel):
@@ -94,11 +174,12 @@ class Token(BaseModel):
     """    
     access_token: str
     token_type: str
+    refresh_token: str | None = None
 
     class Config:
         """https://docs.pydantic.dev/latest/usage/models/#orm-mode-aka-arbitrary-class-instances
         """        
-        orm_mode = True
+        from_attributes=True
 
 
 class TokenData(BaseModel):
@@ -112,7 +193,7 @@ class TokenData(BaseModel):
     class Config:
         """https://docs.pydantic.dev/latest/usage/models/#orm-mode-aka-arbitrary-class-instances
         """        
-        orm_mode = True
+        from_attributes=True
 
 
 class EmailSchema(BaseModel):
@@ -0,0 +1,316 @@
+"""Synthetic data seeding, for benchmarks and capacity tests.
+
+Generates users and rides between cities of a weighted city graph: rides are drawn per route with
+a gravity model (population of one city times the other, divided by the distance), departures are
+spread over the given days around now, a share of the rides is booked and departed rides are archived.
+
+Rows are generated in batches and bulk inserted, with COPY on PostgreSQL. All the users share one
+password, hashed once. Logins are user<id>@example.com. The schema is brought up to date first.
+The bulk inserts bypass the route analytics and the ride change log, so the analytics are rebuilt
+and the change log is compacted afterwards, making the clients syncing rides refetch them.
+
+Usage:
+    python -m app.seed --users 5000 --rides 1000000
+    python -m app.seed --rides 200000 --cities-file cities.csv --routes-per-city 8 --days-back 60 --booked-ratio 0.3
+    python -m app.seed --truncate --database-url sqlite:///bench.db
+"""
+import argparse
+import csv
+import io
+import math
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+
+DEFAULT_PASSWORD = "seeded123"
+
+
+@dataclass
+class City:
+    """City of the graph, population in thousands
+    """
+    name: str
+    population: float
+    latitude: float
+    longitude: float
+
+
+@dataclass
+class Route:
+    """Directed edge of the city graph
+    """
+    start_city: str
+    destination_city: str
+    distance: float
+    weight: float
+
+
+CITIES = [
+    City("warszawa", 1861, 52.23, 21.01), City("krakow", 804, 50.06, 19.94), City("wroclaw", 674, 51.11, 17.03),
+    City("lodz", 658, 51.76, 19.46), City("poznan", 541, 52.41, 16.93), City("gdansk", 486, 54.35, 18.65),
+    City("szczecin", 391, 53.43, 14.55), City("bydgoszcz", 330, 53.12, 18.01), City("lublin", 334, 51.25, 22.57),
+    City("bialystok", 294, 53.13, 23.16), City("katowice", 285, 50.26, 19.02), City("gdynia", 243, 54.52, 18.53),
+    City("czestochowa", 209, 50.81, 19.12), City("radom", 202, 51.40, 21.15), City("rzeszow", 197, 50.04, 22.00),
+    City("torun", 196, 53.01, 18.60), City("sosnowiec", 193, 50.29, 19.10), City("kielce", 186, 50.87, 20.63),
+    City("gliwice", 175, 50.29, 18.67), City("olsztyn", 170, 53.78, 20.48), City("zabrze", 157, 50.32, 18.79),
+    City("bielsko-biala", 168, 49.82, 19.04), City("bytom", 162, 50.35, 18.92), City("zielona-gora", 139, 51.94, 15.51),
+    City("rybnik", 136, 50.10, 18.55), City("ruda-slaska", 135, 50.26, 18.86), City("opole", 127, 50.68, 17.93),
+    City("tychy", 126, 50.12, 19.00), City("gorzow", 121, 52.73, 15.24), City("elblag", 117, 54.16, 19.40),
+]
+
+
+def load_cities(path: Path) -> list[City]:
+    """Reads the cities from a CSV file with name, population, latitude and longitude columns
+
+    Args:
+        path (Path): CSV file with a header row
+
+    Returns:
+        list[City]
+    """
+    with open(path, newline="") as file:
+        return [City(row["name"], float(row["population"]), float(row["latitude"]), float(row["longitude"]))
+                for row in csv.DictReader(file)]
+
+
+def road_distance(start: City, destination: City) -> float:
+    """Estimates the road distance between two cities as 1.25 of the great-circle distance
+
+    Returns:
+        float: distance in kilometers
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (start.latitude, start.longitude, destination.latitude, destination.longitude))
+    haversine = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return round(1.25 * 2 * 6371 * math.asin(math.sqrt(haversine)), 1)
+
+
+def build_routes(cities: list[City], routes_per_city: int | None = None) -> list[Route]:
+    """Builds the city graph: each city connected to its routes_per_city most popular destinations
+    by the gravity model, or to every other city
+
+    Args:
+        cities (list[City]): cities of the graph
+        routes_per_city (int | None, optional): outgoing routes per city. Defaults to all.
+
+    Returns:
+        list[Route]
+    """
+    routes = []
+    for start in cities:
+        outgoing = []
+        for destination in cities:
+            if destination is start:
+                continue
+            distance = max(road_distance(start, destination), 1.0)
+            outgoing.append(Route(start.name, destination.name, distance, start.population * destination.population / distance))
+        outgoing.sort(key=lambda route: route.weight, reverse=True)
+        routes.extend(outgoing[:routes_per_city])
+    return routes
+
+
+class BulkWriter:
+    """Inserts rows of tuples in bulk: COPY on PostgreSQL, executemany of the DB-API driver elsewhere
+    """
+    def __init__(self, connection: Connection):
+        self.connection = connection
+        self.postgres = connection.dialect.name == "postgresql"
+
+
+    def write(self, table: str, columns: tuple[str, ...], rows: list[tuple]):
+        """Inserts the rows
+
+        Args:
+            table (str): table name
+            columns (tuple[str, ...]): column names, in the order of the row values
+            rows (list[tuple]): rows to insert
+        """
+        if not rows:
+            return
+        if self.postgres:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(["t" if value is True else "f" if value is False else value for value in row])
+            buffer.seek(0)
+            cursor = self.connection.connection.cursor()
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            return
+        if self.connection.dialect.name == "sqlite":
+            # the format SQLAlchemy stores and compares SQLite datetimes in
+            rows = [tuple(value.strftime("%Y-%m-%d %H:%M:%S.%f") if isinstance(value, datetime) else value for value in row)
+                    for row in rows]
+        placeholder = "?" if self.connection.dialect.paramstyle == "qmark" else "%s"
+        self.connection.exec_driver_sql(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([placeholder] * len(columns))})", rows)
+
+
+    def reset_sequence(self, table: str):
+        """Moves the id sequence past the explicitly inserted ids (PostgreSQL only)
+
+        Args:
+            table (str): table name
+        """
+        if self.postgres:
+            self.connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                         f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"))
+
+
+USER_COLUMNS = ("id", "login", "hashed_password", "first_name", "last_name", "address", "is_active", "is_admin", "activation_code")
+RIDE_COLUMNS = ("id", "start_city", "destination_city", "distance", "km_fee", "price", "departure_date",
+                "is_active", "user_id_taken", "seats", "seats_available")
+BOOKING_COLUMNS = ("id", "ride_id", "user_id", "seats", "created_at")
+
+
+def _next_id(connection: Connection, table: str) -> int:
+    return connection.execute(text(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")).scalar()
+
+
+def seed(engine: Engine, users: int = 1000, rides: int = 100_000, cities: list[City] | None = None,
+         routes_per_city: int | None = None, days_back: float = 30, days_ahead: float = 90, booked_ratio: float = 0.2,
+         max_seats: int = 8, batch_size: int = 50_000, password: str = DEFAULT_PASSWORD, random_seed: int = 0) -> dict:
+    """Generates and inserts the users, rides and bookings. Rides are booked by the seeded users,
+    or by the existing ones when no users are seeded.
+
+    Args:
+        engine (Engine): database engine
+        users (int, optional): number of users. Defaults to 1000.
+        rides (int, optional): number of rides. Defaults to 100_000.
+        cities (list[City] | None, optional): cities of the graph. Defaults to CITIES.
+        routes_per_city (int | None, optional): outgoing routes per city. Defaults to all.
+        days_back (float, optional): earliest departure, days before now. Defaults to 30.
+        days_ahead (float, optional): latest departure, days after now. Defaults to 90.
+        booked_ratio (float, optional): share of the rides with a booking. Defaults to 0.2.
+        max_seats (int, optional): maximum seats of a ride. Defaults to 8.
+        batch_size (int, optional): rows per insert. Defaults to 50_000.
+        password (str, optional): password of all the users. Defaults to DEFAULT_PASSWORD.
+        random_seed (int, optional): random numbers generator seed. Defaults to 0.
+
+    Returns:
+        dict: numbers of inserted users, rides and bookings, and the seconds it took
+    """
+    from sqlalchemy.orm import Session
+    from . import analytics, changes
+    from .utils import SecurityUtils
+
+    started = time.perf_counter()
+    rng = random.Random(random_seed)
+    routes = build_routes(cities or CITIES, routes_per_city)
+    cum_weights = []
+    total = 0.0
+    for route in routes:
+        total += route.weight
+        cum_weights.append(total)
+    now = datetime.utcnow().replace(microsecond=0)
+    earliest = now - timedelta(days=days_back)
+    span = int((days_ahead + days_back) * 24 * 60)
+    inserted_bookings = 0
+    with engine.begin() as connection:
+        writer = BulkWriter(connection)
+        first_user = _next_id(connection, "users")
+        if users:
+            hashed_password = SecurityUtils.get_password_hash(password)
+            for start in range(first_user, first_user + users, batch_size):
+                writer.write("users", USER_COLUMNS, [
+                    (user_id, f"user{user_id}@example.com", hashed_password, "Seeded", f"User{user_id}",
+                     rng.choice(routes).start_city, True, False, None)
+                    for user_id in range(start, min(first_user + users, start + batch_size))])
+            writer.reset_sequence("users")
+            user_ids = range(first_user, first_user + users)
+        else:
+            user_ids = [row[0] for row in connection.execute(text("SELECT id FROM users"))]
+        booked_ratio = booked_ratio if user_ids else 0
+
+        ride_id = _next_id(connection, "rides")
+        booking_id = _next_id(connection, "bookings")
+        last_ride = ride_id + rides
+        while ride_id < last_ride:
+            count = min(batch_size, last_ride - ride_id)
+            ride_rows, booking_rows = [], []
+            for route in rng.choices(routes, cum_weights=cum_weights, k=count):
+                departure = earliest + timedelta(minutes=rng.randrange(span))
+                km_fee = round(rng.uniform(0.2, 1.5), 2)
+                seats = rng.randint(1, max_seats)
+                seats_available, user_id_taken = seats, None
+                if rng.random() < booked_ratio:
+                    booker = rng.choice(user_ids)
+                    booked = rng.randint(1, seats)
+                    seats_available -= booked
+                    user_id_taken = booker if seats == 1 else None
+                    booking_rows.append((booking_id, ride_id, booker, booked, departure - timedelta(days=1)))
+                    booking_id += 1
+                ride_rows.append((ride_id, route.start_city, route.destination_city, route.distance, km_fee,
+                                  round(route.distance * km_fee, 2), departure, departure > now and seats_available > 0,
+                                  user_id_taken, seats, seats_available))
+                ride_id += 1
+            writer.write("rides", RIDE_COLUMNS, ride_rows)
+            writer.write("bookings", BOOKING_COLUMNS, booking_rows)
+            inserted_bookings += len(booking_rows)
+        writer.reset_sequence("rides")
+        writer.reset_sequence("bookings")
+    with Session(engine) as db:
+        changes.clear(db, datetime.utcnow())
+        db.commit()
+        analytics.rebuild(db)
+    return {"users": users, "rides": rides, "bookings": inserted_bookings,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def truncate(engine: Engine):
+    """Removes all the users, rides, bookings and refresh tokens along with the data derived from them:
+    route analytics, idempotency keys and the ride change log, compacted so the clients syncing rides refetch them
+
+    Args:
+        engine (Engine): database engine
+    """
+    from sqlalchemy.orm import Session
+    from . import changes
+
+    with Session(engine) as db:
+        for table in ("bookings", "refresh_tokens", "rides", "users", "route_daily_stats", "route_stats_deltas",
+                      "idempotency_keys"):
+            db.execute(text(f"DELETE FROM {table}"))
+        changes.clear(db, datetime.utcnow())
+        db.commit()
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.seed", description="Seed the database with synthetic data.")
+    parser.add_argument("--database-url", help="database to seed, defaults to DATABASE_URL")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rides", type=int, default=100_000)
+    parser.add_argument("--cities-file", type=Path, help="CSV with name, population, latitude and longitude columns")
+    parser.add_argument("--routes-per-city", type=int, help="outgoing routes per city, defaults to all the other cities")
+    parser.add_argument("--days-back", type=float, default=30, help="earliest departure, days before now")
+    parser.add_argument("--days-ahead", type=float, default=90, help="latest departure, days after now")
+    parser.add_argument("--booked-ratio", type=float, default=0.2, help="share of the rides with a booking")
+    parser.add_argument("--max-seats", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="password of all the seeded users")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--truncate", action="store_true", help="remove the existing users and rides first")
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import create_engine
+    from .database import get_engine
+    from .migrate import migrate
+    engine = create_engine(args.database_url) if args.database_url else get_engine()
+    migrate(engine)
+    if args.truncate:
+        truncate(engine)
+    summary = seed(engine, users=args.users, rides=args.rides,
+                   cities=load_cities(args.cities_file) if args.cities_file else None,
+                   routes_per_city=args.routes_per_city, days_back=args.days_back, days_ahead=args.days_ahead,
+                   booked_ratio=args.booked_ratio, max_seats=args.max_seats, batch_size=args.batch_size,
+                   password=args.password, random_seed=args.random_seed)
+    print(", ".join(f"{key}: {value}" for key, value in summary.items()))
+
+
+if __name__ == "__main__":
+    main()
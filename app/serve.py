@@ -0,0 +1,135 @@
+"""Production server launcher.
+
+Runs the app on uvicorn with one worker per available core (WEB_CONCURRENCY overrides it),
+uvloop and httptools when they are installed, and the database connection pool of every worker
+sized so that all the workers together, along with their background connections, stay within DB_MAX_CONNECTIONS.
+The app is imported once before the workers start, so a broken app fails the launch right away.
+
+Usage:
+    python -m app.serve
+    python -m app.serve --workers 4 --port 8008
+"""
+import argparse
+import importlib
+import importlib.util
+import logging
+import os
+from dataclasses import dataclass
+from .config import Envs
+
+
+logger = logging.getLogger(__name__)
+
+
+APP = "app.main:app"
+
+# connections every worker opens outside of its pool: the cache invalidation listener
+LISTENER_CONNECTIONS_PER_WORKER = 1
+# connection the leader of the ride expiry job holds for its advisory lock
+LEADER_CONNECTIONS = 1
+
+
+@dataclass
+class ServerPlan:
+    """Uvicorn and connection pool settings worked out for the host
+    """
+    workers: int
+    loop: str
+    http: str
+    pool_size: int
+    max_overflow: int
+
+
+def available_cores() -> int:
+    """Gets the number of cores the process may run on, which respects CPU affinity set by the container
+
+    Returns:
+        int: number of cores
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def pool_per_worker(workers: int, max_connections: int) -> tuple[int, int]:
+    """Splits the database connections budget between the workers, once the listener connection of every worker
+    and the lock connection of the job leader are set aside. Half of the share of a worker is kept open in the pool,
+    the other half is opened only under load.
+
+    Args:
+        workers (int): number of workers
+        max_connections (int): connections all the workers may open together
+
+    Returns:
+        tuple[int, int]: pool size and max overflow of a single worker
+    """
+    available = max_connections - workers * LISTENER_CONNECTIONS_PER_WORKER - LEADER_CONNECTIONS
+    share = max(1, available // workers)
+    pool_size = max(1, share // 2)
+    return pool_size, share - pool_size
+
+
+def plan(workers: int | None = None, max_connections: int | None = None) -> ServerPlan:
+    """Works out the server settings
+
+    Args:
+        workers (int | None, optional): number of workers. Defaults to WEB_CONCURRENCY or available cores.
+        max_connections (int | None, optional): database connections budget. Defaults to DB_MAX_CONNECTIONS.
+
+    Returns:
+        ServerPlan
+    """
+    workers = workers or Envs.WEB_CONCURRENCY or available_cores()
+    max_connections = max_connections or int(Envs.DB_MAX_CONNECTIONS)
+    # every worker needs a pooled connection besides its listener
+    max_workers = max(1, (max_connections - LEADER_CONNECTIONS) // (1 + LISTENER_CONNECTIONS_PER_WORKER))
+    if workers > max_workers:
+        logger.warning("%s workers exceed %s database connections, using %s workers", workers, max_connections, max_workers)
+        workers = max_workers
+    pool_size, max_overflow = pool_per_worker(workers, max_connections)
+    return ServerPlan(
+        workers=workers,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+    )
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.serve", description="Run the app in production.")
+    parser.add_argument("--workers", type=int, help="number of worker processes, defaults to WEB_CONCURRENCY or available cores")
+    parser.add_argument("--host", default=Envs.HOST)
+    parser.add_argument("--port", type=int, default=Envs.PORT)
+    args = parser.parse_args(argv)
+
+    server = plan(args.workers)
+    # workers are new processes reading the settings from the environment
+    os.environ["DB_POOL_SIZE"] = str(server.pool_size)
+    os.environ["DB_MAX_OVERFLOW"] = str(server.max_overflow)
+    Envs.DB_POOL_SIZE = server.pool_size
+    Envs.DB_MAX_OVERFLOW = server.max_overflow
+
+    module_name, app_name = APP.split(":")
+    app = getattr(importlib.import_module(module_name), app_name)
+
+    import uvicorn
+    print(f"starting {server.workers} workers ({server.loop}, {server.http}), "
+          f"database pool {server.pool_size}+{server.max_overflow} per worker")
+    uvicorn.run(
+        app if server.workers == 1 else APP,
+        host=args.host,
+        port=args.port,
+        workers=server.workers,
+        loop=server.loop,
+        http=server.http,
+        backlog=int(Envs.BACKLOG),
+        timeout_keep_alive=int(Envs.KEEP_ALIVE_SECONDS),
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+import inspect
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from functools import wraps
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .config import Envs
+from .metrics import metrics
+
+
+class SpanKind(IntEnum):
+    """Span kinds, numbered as in OpenTelemetry (OTLP)
+    """
+    internal = 1
+    server = 2
+    client = 3
+
+
+@dataclass
+class Span:
+    """Timed operation of a trace. The spans of a trace share the list they are collected in.
+    """
+    trace_id: str
+    span_id: str
+    parent_span_id: str | None
+    name: str
+    kind: SpanKind
+    start_ns: int
+    trace: list = field(repr=False, compare=False)
+    end_ns: int | None = None
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+
+
+    def to_otlp(self) -> dict:
+        """Converts the span to the OTLP JSON format
+
+        Returns:
+            dict: span of an OTLP ExportTraceServiceRequest
+        """
+        otlp = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": int(self.kind),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+        if self.parent_span_id:
+            otlp["parentSpanId"] = self.parent_span_id
+        return otlp
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Span | None:
+    """Gets the span the code runs in
+
+    Returns:
+        Span | None: None outside of a sampled request
+    """
+    return _current.get()
+
+
+def start_span(name: str, kind: SpanKind = SpanKind.internal, attributes: dict | None = None) -> Span | None:
+    """Starts a child of the current span, without making it current
+
+    Args:
+        name (str): span name
+        kind (SpanKind, optional): span kind. Defaults to SpanKind.internal.
+        attributes (dict | None, optional): span attributes. Defaults to None.
+
+    Returns:
+        Span | None: None outside of a sampled request
+    """
+    parent = _current.get()
+    if parent is None:
+        return None
+    child = Span(parent.trace_id, os.urandom(8).hex(), parent.span_id, name, kind, time.time_ns(), parent.trace,
+                 attributes=attributes or {})
+    parent.trace.append(child)
+    return child
+
+
+def end_span(span: Span, error: BaseException | None = None):
+    """Ends a span
+
+    Args:
+        span (Span): the span
+        error (BaseException | None, optional): exception which ended the span. Defaults to None.
+    """
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+
+
+@contextmanager
+def span(name: str, kind: SpanKind = SpanKind.internal, attributes: dict | None = None):
+    """Runs the block in a child span of the current span, does nothing outside of a sampled request
+
+    Args:
+        name (str): span name
+        kind (SpanKind, optional): span kind. Defaults to SpanKind.internal.
+        attributes (dict | None, optional): span attributes. Defaults to None.
+
+    Yields:
+        Span | None
+    """
+    child = start_span(name, kind, attributes)
+    if child is None:
+        yield None
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as error:
+        end_span(child, error)
+        raise
+    else:
+        end_span(child)
+    finally:
+        _current.reset(token)
+
+
+def traced(function=None, *, kind: SpanKind = SpanKind.internal):
+    """Decorator running every call of a function in a span named after the function, e.g. app.crud.reserve_ride
+
+    Args:
+        function (Callable): sync or async function
+        kind (SpanKind, optional): span kind. Defaults to SpanKind.internal.
+    """
+    if function is None:
+        return lambda function: traced(function, kind=kind)
+    name = f"{function.__module__}.{function.__qualname__}"
+
+    if inspect.iscoroutinefunction(function):
+        @wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return await function(*args, **kwargs)
+            with span(name, kind):
+                return await function(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return function(*args, **kwargs)
+        with span(name, kind):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+class Tracer:
+    """Exporter of the finished traces: an in-memory ring buffer of the most recent traces (GET /ops/traces)
+    and, when TRACE_FILE is set, a JSON lines file with an OTLP ExportTraceServiceRequest per trace,
+    the format of the OpenTelemetry Collector file exporter and receiver.
+    The file is written by a background thread, so a request never waits for the disk; the traces it can't keep up with
+    are dropped and counted in the tracing.dropped_traces metric.
+    """
+    def __init__(self, buffer_size: int | None = None, path: str | None = None, max_pending: int = 1000):
+        """
+        Args:
+            buffer_size (int | None, optional): number of traces kept in memory. Defaults to TRACE_BUFFER_SIZE.
+            path (str | None, optional): JSON lines file the traces are appended to. Defaults to TRACE_FILE.
+            max_pending (int, optional): number of traces waiting for the file writer. Defaults to 1000.
+        """
+        self._buffer_size = buffer_size
+        self._path = path
+        self.traces: OrderedDict[str, list[Span]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending: queue.Queue[tuple[str, list[Span]]] = queue.Queue(maxsize=max_pending)
+        self._writer: threading.Thread | None = None
+
+
+    @property
+    def buffer_size(self) -> int:
+        return self._buffer_size if self._buffer_size is not None else int(Envs.TRACE_BUFFER_SIZE)
+
+
+    @property
+    def path(self) -> str | None:
+        return self._path if self._path is not None else Envs.TRACE_FILE
+
+
+    def export(self, spans: list[Span]):
+        """Keeps a finished trace and queues it for the file writer
+
+        Args:
+            spans (list[Span]): spans of the trace
+        """
+        path = self.path
+        with self._lock:
+            self.traces[spans[0].trace_id] = spans
+            while len(self.traces) > self.buffer_size:
+                self.traces.popitem(last=False)
+            if path and self._writer is None:
+                self._writer = threading.Thread(target=self._write, name="trace-writer", daemon=True)
+                self._writer.start()
+        if path:
+            try:
+                self._pending.put_nowait((path, spans))
+            except queue.Full:
+                metrics.inc("tracing.dropped_traces")
+
+
+    def _write(self):
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            lines: dict[str, list[str]] = {}
+            for path, spans in batch:
+                lines.setdefault(path, []).append(json.dumps(to_otlp(spans), separators=(",", ":")) + "\n")
+            for path, path_lines in lines.items():
+                try:
+                    with open(path, "a") as file:
+                        file.write("".join(path_lines))
+                except OSError:
+                    metrics.inc("tracing.dropped_traces", len(path_lines))
+            for _ in batch:
+                self._pending.task_done()
+
+
+    def flush(self):
+        """Waits until the queued traces are written to the file
+        """
+        self._pending.join()
+
+
+    def get(self, trace_id: str) -> list[Span] | None:
+        """Gets a trace
+
+        Args:
+            trace_id (str): trace id
+
+        Returns:
+            list[Span] | None: spans, None if the trace isn't in the buffer
+        """
+        with self._lock:
+            return self.traces.get(trace_id)
+
+
+    def recent(self, limit: int) -> list[list[Span]]:
+        """Gets the most recent traces
+
+        Args:
+            limit (int): number of traces
+
+        Returns:
+            list[list[Span]]: traces, the latest first
+        """
+        with self._lock:
+            return list(reversed(self.traces.values()))[:limit]
+
+
+tracer = Tracer()
+
+
+def to_otlp(spans: list[Span]) -> dict:
+    """Converts spans to an OTLP ExportTraceServiceRequest in JSON
+
+    Args:
+        spans (list[Span]): spans of one or more traces
+
+    Returns:
+        dict: request with the resourceSpans
+    """
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "transport-app"}},
+                                    {"key": "process.pid", "value": {"intValue": str(os.getpid())}}]},
+        "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": [span.to_otlp() for span in spans]}],
+    }]}
+
+
+def summarize(spans: list[Span]) -> dict:
+    """Splits the time of a trace between the database round-trips, sending emails and the rest
+
+    Args:
+        spans (list[Span]): spans of the trace, the request span first
+
+    Returns:
+        dict: durations in milliseconds and the number of SQL statements
+    """
+    def duration(span: Span) -> float:
+        return ((span.end_ns or span.start_ns) - span.start_ns) / 1e6
+
+    sql = [span for span in spans if "db.system" in span.attributes]
+    email = [span for span in spans if span.name.startswith("app.utils.EmailUtils.")]
+    total = duration(spans[0])
+    sql_ms = sum(map(duration, sql))
+    email_ms = sum(map(duration, email))
+    return {
+        "name": spans[0].name,
+        "total_ms": round(total, 3),
+        "sql_ms": round(sql_ms, 3),
+        "sql_statements": len(sql),
+        "email_ms": round(email_ms, 3),
+        "other_ms": round(max(0.0, total - sql_ms - email_ms), 3),
+    }
+
+
+TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+\"?(\w+)", re.IGNORECASE)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_sql_span(connection, cursor, statement, parameters, context, executemany):
+    if _current.get() is None:
+        return
+    operation = statement.lstrip().split(" ", 1)[0].upper()
+    table = TABLE.search(statement)
+    sql_span = start_span(f"{operation} {table.group(1)}" if table else operation, SpanKind.client, {
+        "db.system": connection.dialect.name,
+        "db.operation": operation,
+        "db.statement": statement[:2000],
+    })
+    connection.info.setdefault("trace_spans", []).append(sql_span)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_sql_span(connection, cursor, statement, parameters, context, executemany):
+    spans = connection.info.get("trace_spans")
+    if spans:
+        end_span(spans.pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _fail_sql_span(context):
+    spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+    if spans:
+        end_span(spans.pop(), context.original_exception)
+
+
+class TracedRoute(APIRoute):
+    """Route running its handler (dependencies, endpoint and serialization) in a span named after the endpoint,
+    e.g. app.routers.rides.reserve_ride, and naming the request span after the route
+    """
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        name = f"{self.endpoint.__module__}.{self.endpoint.__name__}"
+
+        async def traced_handler(request):
+            request_span = _current.get()
+            if request_span is None:
+                return await handler(request)
+            request_span.name = f"{request.method} {self.path}"
+            request_span.attributes["http.route"] = self.path
+            with span(name):
+                return await handler(request)
+        return traced_handler
+
+
+def _parse_traceparent(value: str) -> tuple[str, str, bool] | None:
+    """Parses a W3C traceparent header
+
+    Returns:
+        tuple[str, str, bool] | None: trace id, parent span id and the sampled flag, None if malformed
+    """
+    match = re.fullmatch(r"00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})", value.strip())
+    if match is None or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class TracingMiddleware:
+    """ASGI middleware starting a trace per sampled request, or continuing the trace of a W3C traceparent header.
+    The request span is the root of the spans of the route handler, crud functions, SQL statements and emails.
+    The trace id is sent in the X-Trace-Id response header. TRACE_SAMPLE_RATIO sets the share of the sampled requests,
+    0 turns tracing off. The sampled flag of traceparent comes from the client, so it can only turn sampling off,
+    unless TRACE_TRUST_PARENT is set for a proxy setting the header.
+    """
+    def __init__(self, app, exporter: Tracer = tracer, sample_ratio: float | None = None, trust_parent: bool | None = None):
+        self.app = app
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.trust_parent = trust_parent
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if self.sample_ratio is None:
+            self.sample_ratio = float(Envs.TRACE_SAMPLE_RATIO)
+        if self.trust_parent is None:
+            self.trust_parent = bool(Envs.TRACE_TRUST_PARENT)
+        parent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parent = _parse_traceparent(value.decode("latin-1"))
+                break
+        sampled = self.sample_ratio > 0 and random.random() < self.sample_ratio
+        if parent is not None:
+            trace_id, parent_span_id, parent_sampled = parent
+            sampled = parent_sampled if self.trust_parent else parent_sampled and sampled
+        else:
+            trace_id, parent_span_id = os.urandom(16).hex(), None
+        if not sampled:
+            return await self.app(scope, receive, send)
+
+        trace = []
+        root = Span(trace_id, os.urandom(8).hex(), parent_span_id, scope["method"], SpanKind.server, time.time_ns(), trace,
+                    attributes={"http.method": scope["method"], "http.target": scope["path"]})
+        trace.append(root)
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-trace-id", trace_id.encode())]
+            await send(message)
+
+        token = _current.set(root)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as error:
+            end_span(root, error)
+            raise
+        else:
+            end_span(root)
+        finally:
+            _current.reset(token)
+            self.exporter.export(trace)
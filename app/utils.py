@@ -1,37 +1,23 @@
-import os
 import re
-from dotenv import load_dotenv
+import json
+import hashlib
+import secrets
 from enum import Enum
 from datetime import datetime, timedelta
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
+from functools import lru_cache
 from passlib.context import CryptContext
+from starlette.responses import JSONResponse
 from jose import jwt
+from .config import Envs
 from .schemas import EmailSchema, User, Ride
-
-
-load_dotenv("./.env")
-
-
-class Envs:
-   """Environmental variables
-   """ 
-   MAIL_USERNAME=os.getenv('MAIL_USERNAME')
-   MAIL_PASSWORD=os.getenv('MAIL_PASSWORD')
-   MAIL_FROM=os.getenv('MAIL_FROM')
-   MAIL_PORT=os.getenv('MAIL_PORT')
-   MAIL_SERVER=os.getenv('MAIL_SERVER')
-
-   TEST_MAIL=os.getenv('TEST_MAIL')
-
-   SECRET_KEY=os.getenv('SECRET_KEY')
-   ALGORITHM=os.getenv('ALGORITHM')
-   ACCESS_TOKEN_EXPIRE_MINUTES=os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES')
+from .tracing import traced, SpanKind
 
 
 class SecurityUtils():
     """Security utils static functions and pwd_context for cryptograhics
     """    
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    _dummy_hash: str | None = None
 
 
     @staticmethod
@@ -48,6 +34,23 @@ class SecurityUtils():
         return SecurityUtils.pwd_context.verify(plain_password, hashed_password)
 
 
+    @staticmethod
+    def dummy_verify(plain_password: str) -> bool:
+        """Verifies a password against a throwaway hash, so that logins of non-existent users
+        take as long as the ones of existing users
+
+        Args:
+            plain_password (str): plain password
+
+        Returns:
+            bool: always False
+        """
+        if SecurityUtils._dummy_hash is None:
+            SecurityUtils._dummy_hash = SecurityUtils.pwd_context.hash("dummy password")
+        SecurityUtils.pwd_context.verify(plain_password, SecurityUtils._dummy_hash)
+        return False
+
+
     @staticmethod
     def get_password_hash(password: str) -> str:
         """Gets a password hash
@@ -82,21 +85,78 @@ class SecurityUtils():
         return encoded_jwt
 
 
+    @staticmethod
+    def create_refresh_token() -> str:
+        """Gets a new opaque refresh token
+
+        Returns:
+            str: refresh token
+        """
+        return secrets.token_urlsafe(32)
+
+
+    @staticmethod
+    def hash_refresh_token(token: str) -> str:
+        """Gets the hash under which a refresh token is stored.
+        Refresh tokens are long and random, so a plain sha256 is enough and bcrypt is not needed
+
+        Args:
+            token (str): refresh token
+
+        Returns:
+            str: sha256 hex digest
+        """
+        return hashlib.sha256(token.encode()).hexdigest()
+
+
 class EmailUtils():
     """Class container for email utils, like methods sending emails
     """    
 
-    conf = ConnectionConfig(
-        MAIL_USERNAME=Envs.MAIL_USERNAME,
-        MAIL_PASSWORD=Envs.MAIL_PASSWORD,
-        MAIL_FROM=Envs.MAIL_FROM,
-        MAIL_PORT=Envs.MAIL_PORT,
-        MAIL_SERVER=Envs.MAIL_SERVER,
-        MAIL_STARTTLS=True,
-        MAIL_SSL_TLS=False,
-        USE_CREDENTIALS = True,
-        VALIDATE_CERTS = True
-    )
+    @staticmethod
+    @lru_cache
+    def mail():
+        """Creates the mail client on first use, so that importing the app doesn't load the mail
+        library nor validate the mail settings
+
+        Returns:
+            FastMail: mail client
+        """
+        from fastapi_mail import FastMail, ConnectionConfig
+        conf = ConnectionConfig(
+            MAIL_USERNAME=Envs.MAIL_USERNAME,
+            MAIL_PASSWORD=Envs.MAIL_PASSWORD,
+            MAIL_FROM=Envs.MAIL_FROM,
+            MAIL_PORT=Envs.MAIL_PORT,
+            MAIL_SERVER=Envs.MAIL_SERVER,
+            MAIL_STARTTLS=True,
+            MAIL_SSL_TLS=False,
+            USE_CREDENTIALS = True,
+            VALIDATE_CERTS = True,
+            SUPPRESS_SEND = Envs.MAIL_SUPPRESS_SEND
+        )
+        return FastMail(conf)
+
+
+    @staticmethod
+    @traced(kind=SpanKind.client)
+    async def send(subject: str, user: User, template: str):
+        """Sends an html email to the user
+
+        Args:
+            subject (str): email subject
+            user (User): recipient
+            template (str): html body
+        """
+        from fastapi_mail import MessageSchema, MessageType
+        email = EmailSchema(email=[user.login])
+        message = MessageSchema(
+            subject=subject,
+            recipients=email.model_dump().get("email"),
+            body=template,
+            subtype=MessageType.html
+            )
+        await EmailUtils.mail().send_message(message)
     
 
     @staticmethod
@@ -131,16 +191,7 @@ class EmailUtils():
                 </body>
                 </html>
                 """
-        email = EmailSchema(email=[user.login])
-        message = MessageSchema(
-                subject="Activate your account",
-                recipients=email.model_dump().get("email"),
-                body=template,
-                subtype=MessageType.html
-                )
-        
-        fm = FastMail(EmailUtils.conf)
-        await fm.send_message(message)
+        await EmailUtils.send("Activate your account", user, template)
     
 
     @staticmethod
@@ -163,20 +214,17 @@ class EmailUtils():
             </body>
             </html>
             """
-        
-        email = EmailSchema(email=[user.login])
-        message = MessageSchema(
-            subject="Your account has been deleted",
-            recipients=email.model_dump().get("email"),
-            body=template,
-            subtype=MessageType.html
-            )
-        
-        fm = FastMail(EmailUtils.conf)
-        await fm.send_message(message)
+        await EmailUtils.send("Your account has been deleted", user, template)
 
     @staticmethod
-    async def send_booking_confirmation_email(user: User, ride: Ride):
+    async def send_booking_confirmation_email(user: User, ride: Ride, seats: int = 1):
+        """Sends the booked ride details to the user email
+
+        Args:
+            user (User): user
+            ride (Ride): booked ride
+            seats (int, optional): number of booked seats. Defaults to 1.
+        """      
         template = """
         <html>
         <body>
@@ -189,7 +237,8 @@ class EmailUtils():
         <strong> To: </strong> """+ride.destination_city+""" <br>
         <strong> Distance (km): </strong> """+str(ride.distance)+""" <br>
         <strong> Fee per km: </strong> """+str(ride.km_fee)+""" <br>
-        <strong> Total price: </strong> """+str(ride.price)+""" <br>
+        <strong> Seats: </strong> """+str(seats)+""" <br>
+        <strong> Total price: </strong> """+str(round(ride.price * seats, 2))+""" <br>
         <strong> Departure date: </strong> """+ride.departure_date.strftime('%y-%m-%d %H:%M')+""" <br>
         <br>
         <p> Thank you for using our services. </p>
@@ -198,15 +247,7 @@ class EmailUtils():
         </body>
         </html>
         """
-        email = EmailSchema(email=[user.login])
-        message = MessageSchema(
-            subject=f"Your ride from {ride.start_city} to {ride.destination_city}",
-            recipients=email.model_dump().get("email"),
-            body=template,
-            subtype=MessageType.html
-            )
-        fm = FastMail(EmailUtils.conf)
-        await fm.send_message(message)
+        await EmailUtils.send(f"Your ride from {ride.start_city} to {ride.destination_city}", user, template)
 
 
     @staticmethod
@@ -229,17 +270,32 @@ class EmailUtils():
             </body>
             </html>
             """
-        
-        email = EmailSchema(email=[user.login])
-        message = MessageSchema(
-            subject="Your account has been deleted",
-            recipients=email.model_dump().get("email"),
-            body=template,
-            subtype=MessageType.html
-            )
-    
-        fm = FastMail(EmailUtils.conf)
-        await fm.send_message(message)
+        await EmailUtils.send("Your account has been deleted", user, template)
+
+
+class RowsResponse(JSONResponse):
+    """JSON response rendered straight from database rows, e.g. the list queries of crud.
+    The column types already match the response schema, so the rows skip the pydantic validation
+    of the response_model, which documents the response only.
+
+    Args:
+        JSONResponse (list[Row]): rows, serialized as a list of objects keyed by column name
+    """    
+    def render(self, content) -> bytes:
+        return json.dumps([row._asdict() for row in content], ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":"), default=lambda value: value.isoformat()).encode("utf-8")
+
+
+class PageResponse(JSONResponse):
+    """JSON response rendered from a page built by crud out of database rows, skipping the pydantic validation
+    of the response_model like RowsResponse.
+
+    Args:
+        JSONResponse (dict): the page, dates serialized in ISO format
+    """    
+    def render(self, content) -> bytes:
+        return json.dumps(content, ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":"), default=lambda value: value.isoformat()).encode("utf-8")
 
 
 class Tags(Enum):
@@ -254,6 +310,31 @@ class Tags(Enum):
     rides = "rides"
     adm_actions_rides = "admin actions - rides"
     adm_actions_users = "admin actions - users"
+    adm_actions_ops = "admin actions - ops"
+    adm_actions_analytics = "admin actions - analytics"
+
+
+class RideOrder(str, Enum):
+    """Available orderings of the ride search results
+
+    Args:
+        Enum (str): ordering
+    """    
+    departure_asc = "departure_date"
+    departure_desc = "-departure_date"
+    price_asc = "price"
+    price_desc = "-price"
+
+
+class MemoryGroup(str, Enum):
+    """Groupings of the traced memory allocation sites
+
+    Args:
+        Enum (str): grouping
+    """    
+    module = "module"
+    package = "package"
+    line = "line"
 
 
 description = """
@@ -0,0 +1,124 @@
+"""Memory and CPU cost of the ride list serialization: ORM instances validated by the response model,
+against the plain rows of crud.RIDE_ROW_COLUMNS rendered by RowsResponse.
+
+Every size is seeded into a fresh in-memory SQLite database (see app.seed), then each path
+queries all the active rides and renders the JSON body. Reports CPU time, peak traced memory
+and the number of objects kept in the session identity map.
+
+Usage:
+    python -m benchmarks.rows
+    python -m benchmarks.rows --rows 10000 100000 --repeat 5
+"""
+import argparse
+import gc
+import statistics
+import time
+import tracemalloc
+from typing import Callable
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.seed import seed
+
+
+def orm_body(db: Session) -> tuple[list, bytes]:
+    """Renders the rides the way the list endpoints used to: ORM instances validated by the response model
+    """
+    from pydantic import TypeAdapter
+    from app import models, schemas
+
+    rides = db.query(models.Ride).filter(models.Ride.is_active == True).all()
+    adapter = TypeAdapter(list[schemas.Ride])
+    return rides, adapter.dump_json(adapter.validate_python(rides, from_attributes=True))
+
+
+def rows_body(db: Session) -> tuple[list, bytes]:
+    """Renders the rides as the list endpoints do: plain rows straight into the JSON body
+    """
+    from app import crud, models
+    from app.utils import RowsResponse
+
+    rides = db.query(*crud.RIDE_ROW_COLUMNS).filter(models.Ride.is_active == True).all()
+    return rides, RowsResponse(rides).body
+
+
+PATHS = {"orm": orm_body, "rows": rows_body}
+
+
+def measure(session_factory: sessionmaker, render: Callable[[Session], tuple[list, bytes]], repeat: int) -> dict:
+    """Runs a rendering path in a new session and measures it
+
+    Args:
+        session_factory (sessionmaker): sessions of the seeded database
+        render (Callable[[Session], tuple[list, bytes]]): rendering path, returns the loaded rides and the body
+        repeat (int): number of timed runs, the median CPU time is reported
+
+    Returns:
+        dict: CPU seconds, peak traced memory in MiB, identity map size and response size in bytes
+    """
+    cpu_times = []
+    for _ in range(repeat):
+        gc.collect()
+        with session_factory() as db:
+            started = time.process_time()
+            _, body = render(db)
+            cpu_times.append(time.process_time() - started)
+    gc.collect()
+    with session_factory() as db:
+        tracemalloc.start()
+        try:
+            rides, _ = render(db)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # the identity map holds weak references, it's counted while the rides are alive
+        identity_map = len(db.identity_map)
+        del rides
+    return {
+        "cpu_s": round(statistics.median(cpu_times), 4),
+        "peak_mib": round(peak / 2**20, 2),
+        "identity_map": identity_map,
+        "bytes": len(body),
+    }
+
+
+def compare(rows: int, repeat: int = 3, random_seed: int = 0) -> dict[str, dict]:
+    """Seeds the given number of active rides and measures both rendering paths
+
+    Args:
+        rows (int): number of rides
+        repeat (int, optional): number of timed runs per path. Defaults to 3.
+        random_seed (int, optional): random numbers generator seed. Defaults to 0.
+
+    Returns:
+        dict[str, dict]: measurements per path
+    """
+    from app import models
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    try:
+        models.Base.metadata.create_all(engine)
+        # no bookings and no past departures, all the rides are listed
+        seed(engine, users=10, rides=rows, days_back=0, booked_ratio=0, random_seed=random_seed)
+        session_factory = sessionmaker(bind=engine)
+        return {name: measure(session_factory, render, repeat) for name, render in PATHS.items()}
+    finally:
+        engine.dispose()
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.rows", description="Compare ORM and row serialization of ride lists.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per path")
+    args = parser.parse_args(argv)
+
+    print(f"{'rows':>8} {'path':>5} {'cpu s':>8} {'peak MiB':>9} {'identity map':>13}")
+    for rows in args.rows:
+        for name, result in compare(rows, args.repeat).items():
+            print(f"{rows:>8} {name:>5} {result['cpu_s']:>8} {result['peak_mib']:>9} {result['identity_map']:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""Endpoint load benchmark.
+
+Seeds a database with synthetic users and rides (see app.seed),
+then drives the app in-process with concurrent requests per endpoint and reports latency
+percentiles and throughput. Results are saved as JSON and can be compared with a previous run.
+
+The database is recreated before seeding, never point --database-url at a database you need.
+
+Usage:
+    python -m benchmarks.run --users 1000 --rides 100000 --requests 2000 --concurrency 32
+    python -m benchmarks.run --database-url postgresql://myuser:secret@db:5432/bench_db
+    python -m benchmarks.run --reuse --baseline benchmarks/results/previous.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable
+from app.seed import CITIES, DEFAULT_PASSWORD, seed as seed_data
+
+
+RESULTS_DIR = Path(__file__).parent / "results"
+ENDPOINTS = ["GET /rides/", "GET /rides/{start_city}/", "GET /rides/all/{destination_city}",
+             "GET /rides/{start_city}/{destination_city}", "POST /token", "POST /rides/{ride_id}/reserve"]
+
+
+def _prepare_environment():
+    """Fills in the settings the app needs and turns off sending emails, before the settings are loaded
+    """
+    os.environ["MAIL_SUPPRESS_SEND"] = "1"
+    os.environ["RIDE_EXPIRY_INTERVAL_SECONDS"] = "0"
+    for name, value in {"MAIL_USERNAME": "benchmark", "MAIL_PASSWORD": "benchmark", "MAIL_FROM": "benchmark@example.com",
+                        "MAIL_PORT": "587", "MAIL_SERVER": "localhost", "SECRET_KEY": "benchmark", "ALGORITHM": "HS256"}.items():
+        os.environ.setdefault(name, value)
+
+
+def seed(engine, users: int, rides: int, random_seed: int) -> dict:
+    """Recreates the schema and seeds the synthetic users (logins user1@example.com and on) and rides
+
+    Args:
+        engine (Engine): database engine
+        users (int): number of users
+        rides (int): number of rides
+        random_seed (int): random numbers generator seed
+
+    Returns:
+        dict: seeded data summary
+    """
+    from app import models
+
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    return seed_data(engine, users=users, rides=rides, random_seed=random_seed)
+
+
+def request_makers(users: int, rides: int) -> dict[str, Callable[[random.Random], tuple]]:
+    """Builds the request generators of the benchmarked endpoints
+
+    Args:
+        users (int): number of seeded users
+        rides (int): number of seeded rides
+
+    Returns:
+        dict[str, Callable]: endpoint name to a function returning method, url, request kwargs and index of the user token
+    """
+    names = [city.name for city in CITIES]
+    weights = [city.population for city in CITIES]
+
+    def city(rng: random.Random) -> str:
+        return rng.choices(names, weights)[0]
+
+    return {
+        "GET /rides/": lambda rng: ("GET", "/rides/", {}, rng.randrange(users)),
+        "GET /rides/{start_city}/": lambda rng: ("GET", f"/rides/{city(rng)}/", {}, rng.randrange(users)),
+        "GET /rides/all/{destination_city}": lambda rng: ("GET", f"/rides/all/{city(rng)}", {}, rng.randrange(users)),
+        "GET /rides/{start_city}/{destination_city}": lambda rng: (
+            "GET", f"/rides/{city(rng)}/{city(rng)}", {}, rng.randrange(users)),
+        "POST /token": lambda rng: ("POST", "/token", {"data": {
+            "username": f"user{rng.randint(1, users)}@example.com", "password": DEFAULT_PASSWORD}}, None),
+        "POST /rides/{ride_id}/reserve": lambda rng: (
+            "POST", f"/rides/{rng.randint(1, rides)}/reserve", {}, rng.randrange(users)),
+    }
+
+
+def summarize(latencies: list[float], statuses: dict[int, int], elapsed: float) -> dict:
+    """Computes latency percentiles and throughput of an endpoint
+
+    Args:
+        latencies (list[float]): request latencies in seconds
+        statuses (dict[int, int]): number of responses per status code
+        elapsed (float): wall time of the endpoint run in seconds
+
+    Returns:
+        dict: requests, throughput (requests per second), latency percentiles in milliseconds and statuses
+    """
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+async def drive(client, make_request: Callable, tokens: list[str], requests: int, concurrency: int,
+                rng: random.Random) -> dict:
+    """Sends the requests of a single endpoint from concurrent virtual clients
+
+    Args:
+        client (httpx.AsyncClient): client bound to the app
+        make_request (Callable): request generator
+        tokens (list[str]): access tokens of the users
+        requests (int): number of requests to send
+        concurrency (int): number of concurrent virtual clients
+        rng (random.Random): random numbers generator
+
+    Returns:
+        dict: endpoint summary
+    """
+    planned = [make_request(rng) for _ in range(requests)]
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+
+    async def virtual_client():
+        while planned:
+            method, url, kwargs, user = planned.pop()
+            headers = {"Authorization": f"Bearer {tokens[user]}"} if user is not None else {}
+            started = time.perf_counter()
+            response = await client.request(method, url, headers=headers, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_client() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+async def run(database_url: str, users: int, rides: int, requests: int, concurrency: int,
+              endpoints: list[str] | None = None, reuse: bool = False, random_seed: int = 0) -> dict:
+    """Seeds the database and benchmarks the endpoints one after another
+
+    Args:
+        database_url (str): benchmark database URL
+        users (int): number of users to seed
+        rides (int): number of rides to seed
+        requests (int): number of requests per endpoint
+        concurrency (int): number of concurrent virtual clients
+        endpoints (list[str] | None, optional): endpoints to benchmark. Defaults to all of them.
+        reuse (bool, optional): skip seeding and use the data of a previous run. Defaults to False.
+        random_seed (int, optional): seed of the data and request generators. Defaults to 0.
+
+    Returns:
+        dict: run metadata and results per endpoint
+    """
+    _prepare_environment()
+    import httpx
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app import dependencies
+    from app.main import app
+    from app.ratelimit import LoginRateLimiter
+    from app.utils import SecurityUtils
+
+    rng = random.Random(random_seed)
+    # FastAPI opens the sessions in its threadpool
+    connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
+    engine = create_engine(database_url, connect_args=connect_args)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    seed_started = time.perf_counter()
+    if not reuse:
+        seed(engine, users, rides, random_seed)
+    seed_seconds = time.perf_counter() - seed_started
+
+    def get_benchmark_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # every virtual client logs in as one of a few users, the production limits would reject most of the attempts
+    limiter = LoginRateLimiter()
+    previous_overrides = dict(app.dependency_overrides)
+    app.dependency_overrides[dependencies.get_db] = get_benchmark_db
+    app.dependency_overrides[dependencies.get_login_limiter] = lambda: limiter
+    tokens = [SecurityUtils.create_access_token({"sub": f"user{i}@example.com"}, timedelta(hours=1)) for i in range(1, users + 1)]
+    makers = request_makers(users, rides)
+    results = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+            for name in endpoints or ENDPOINTS:
+                results[name] = await drive(client, makers[name], tokens, requests, concurrency, rng)
+                print(f"{name:45} {results[name]['throughput_rps']:>10} rps  p50 {results[name]['p50_ms']:>9} ms  "
+                      f"p95 {results[name]['p95_ms']:>9} ms  p99 {results[name]['p99_ms']:>9} ms")
+    finally:
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(previous_overrides)
+        engine.dispose()
+    return {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "database": engine.dialect.name,
+            "users": users, "rides": rides, "requests": requests, "concurrency": concurrency,
+            "random_seed": random_seed, "seed_seconds": None if reuse else round(seed_seconds, 3),
+        },
+        "results": results,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict) -> str:
+    """Formats the change of throughput and latency percentiles against a previous run
+
+    Args:
+        current (dict): results of this run
+        baseline (dict): results of the previous run
+
+    Returns:
+        str: one line per endpoint benchmarked in both runs
+    """
+    lines = []
+    for name, result in current["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if previous[key]:
+                changes.append(f"{key} {(result[key] - previous[key]) / previous[key]:+.1%}")
+        lines.append(f"{name:45} " + "  ".join(changes))
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    """Command line entry point, see the module docs
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmark the app endpoints.")
+    parser.add_argument("--database-url", default="sqlite:///benchmarks/bench.db", help="database recreated for the benchmark")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rides", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--endpoint", action="append", choices=ENDPOINTS, help="endpoint to benchmark, repeatable")
+    parser.add_argument("--reuse", action="store_true", help="don't seed, use the data of the previous run")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="results file, defaults to benchmarks/results/<time>.json")
+    parser.add_argument("--baseline", type=Path, help="results file of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args.database_url, args.users, args.rides, args.requests, args.concurrency,
+                             args.endpoint, args.reuse, args.random_seed))
+    output = args.output or RESULTS_DIR / f"{datetime.utcnow():%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"results saved to {output}")
+    if args.baseline:
+        print(compare(report, json.loads(args.baseline.read_text())))
+
+
+if __name__ == "__main__":
+    main()
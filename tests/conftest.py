@@ -1,8 +1,263 @@
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
 import pytest
+
+
+# every pytest-xdist worker (and every run) gets its own database file, set before the settings are loaded
+TEST_DATABASE = Path(tempfile.gettempdir()) / f"transport_tests_{os.environ.get('PYTEST_XDIST_WORKER', 'main')}_{os.getpid()}.db"
+os.environ["TEST_DATABASE_URL"] = f"sqlite:///{TEST_DATABASE}"
+
+
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, func, insert, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
 from app.main import app
-from app import schemas
-from app.utils import Envs
+from app import models, schemas
+from app.dependencies import get_db, get_login_limiter
+from app.idempotency import idempotency_store
+from app.ratelimit import LoginRateLimiter
+from app.utils import Envs, SecurityUtils
+from app.database import Base, engine_tests
+
+
+# background jobs would work on the production database, tests drive the app on their own
+Envs.RIDE_EXPIRY_INTERVAL_SECONDS = 0
+Envs.LOOP_LAG_INTERVAL_SECONDS = 0
+# cached reads would outlive the rolled back test transactions, tests/test_cache.py enables the caches
+Envs.CACHE_TTL_SECONDS = 0
+# tests/test_tracing.py reads the traces of its requests
+Envs.TRACE_SAMPLE_RATIO = 1.0
+
+
+# tests log in before almost every request, login rate limits are tested separately
+unlimited_login_limiter = LoginRateLimiter()
+app.dependency_overrides[get_login_limiter] = lambda: unlimited_login_limiter
+
+
+Base.metadata.create_all(bind=engine_tests)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    engine_tests.dispose()
+    TEST_DATABASE.unlink(missing_ok=True)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: runs on the PostgreSQL database set by TEST_POSTGRES_URL, skipped without it")
+
+
+@pytest.fixture
+def postgres_engine() -> Engine:
+    """Test fixture yielding an engine on a throwaway schema of the PostgreSQL database set by TEST_POSTGRES_URL,
+    dropped at the test end. Skips the test if the variable is not set
+
+    Yields:
+        Engine
+    """
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = create_engine(url)
+    with admin.begin() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+    engine = create_engine(url, pool_size=70, connect_args={"options": f"-csearch_path={schema}"})
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        with admin.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        admin.dispose()
+
+
+def pytest_addoption(parser):
+    parser.addoption("--budget-time-factor", type=float, default=None,
+                     help="checks the wall time budgets multiplied by this factor, unchecked by default "
+                          "as they fail on loaded or parallel (pytest -n) runs")
+
+
+class QueryBudget:
+    """Counts the SQL statements run on the tests engine, to hold requests to statement and wall time budgets
+    """
+    def __init__(self, time_factor: float | None = None):
+        self.time_factor = time_factor
+        self.statements: list[str] = []
+        self._recording = False
+        event.listen(engine_tests, "before_cursor_execute", self._record)
+
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        # savepoints belong to the per-test transaction, not to the app
+        if self._recording and not statement.startswith(("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")):
+            self.statements.append(statement)
+
+
+    def close(self):
+        event.remove(engine_tests, "before_cursor_execute", self._record)
+
+
+    @contextmanager
+    def __call__(self, statements: int | None = None, seconds: float | None = None, label: str = "block"):
+        """Fails the test when the block runs more than the given number of statements or takes longer than seconds
+
+        Args:
+            statements (int | None, optional): statements budget. Defaults to None (not checked).
+            seconds (float | None, optional): wall time budget, multiplied by --budget-time-factor and only checked
+                with that option. Defaults to None.
+            label (str, optional): name of the block in the failure message. Defaults to "block".
+        """
+        self.statements = []
+        self._recording = True
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self._recording = False
+        elapsed = time.perf_counter() - started
+        if statements is not None:
+            assert len(self.statements) <= statements, (
+                f"{label} ran {len(self.statements)} SQL statements, budget is {statements}:\n" + "\n".join(self.statements))
+        if seconds is not None and self.time_factor is not None:
+            assert elapsed <= seconds * self.time_factor, f"{label} took {elapsed:.3f} s, budget is {seconds * self.time_factor:.3f} s"
+
+
+@pytest.fixture
+def query_budget(request):
+    """Test fixture yielding a context manager checking the SQL statements and wall time budgets of a block,
+    for example: with query_budget(statements=2, seconds=0.2): client.get(...)
+
+    Yields:
+        QueryBudget
+    """
+    budget = QueryBudget(request.config.getoption("--budget-time-factor"))
+    yield budget
+    budget.close()
+
+
+@pytest.fixture(autouse=True)
+def db() -> Session:
+    """Test fixture running every test in a transaction rolled back at its end, so that tests never see each other's data.
+    The app gets sessions joined to that transaction, their commits and rollbacks work on a SAVEPOINT.
+
+    Yields:
+        Session: session of the test transaction
+    """
+    connection = engine_tests.connect()
+    transaction = connection.begin()
+    sessions = sessionmaker(autocommit=False, autoflush=False, bind=connection)
+    savepoint = [connection.begin_nested()]
+
+    @event.listens_for(sessions, "after_transaction_end")
+    def restart_savepoint(session, ended):
+        if not savepoint[0].is_active:
+            savepoint[0] = connection.begin_nested()
+
+    def get_test_db():
+        session = sessions()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    previous_get_db = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = get_test_db
+    session = sessions()
+    yield session
+    session.close()
+    if previous_get_db is None:
+        app.dependency_overrides.pop(get_db, None)
+    else:
+        app.dependency_overrides[get_db] = previous_get_db
+    idempotency_store._cache.clear()
+    transaction.rollback()
+    connection.close()
+
+
+_password_hashes: dict[str, str] = {}
+
+
+def password_hash(password: str) -> str:
+    """Hashes the password once per test session, bcrypt is the slowest part of creating users
+    """
+    if password not in _password_hashes:
+        _password_hashes[password] = SecurityUtils.get_password_hash(password)
+    return _password_hashes[password]
+
+
+def _detached(db: Session, instances: list) -> list:
+    """Detaches the loaded instances, so later commits in the test don't expire them, and ends the transaction
+    of the test session, so it doesn't keep using the SAVEPOINT of the test transaction after a request ends it
+    """
+    for instance in instances:
+        db.expunge(instance)
+    db.commit()
+    return instances
+
+
+def _next_id(db: Session, model) -> int:
+    return (db.query(func.max(model.id)).scalar() or 0) + 1
+
+
+@pytest.fixture
+def user_factory(db):
+    """Test fixture returning a function inserting users in bulk, active with "admin123" password by default,
+    for example: user_factory(3, is_admin=True)
+
+    Returns:
+        Callable[..., list[models.User]]: inserts count users with given fields and returns them
+    """
+    def create(count: int = 1, password: str = "admin123", **fields) -> list[models.User]:
+        first_id = _next_id(db, models.User)
+        ids = list(range(first_id, first_id + count))
+        db.execute(insert(models.User), [{
+            "id": user_id, "login": f"user{user_id}@example.com", "hashed_password": password_hash(password),
+            "first_name": "Factory", "last_name": f"User{user_id}", "address": "Cyberworld",
+            "is_active": True, "is_admin": False, "activation_code": None, **fields} for user_id in ids])
+        db.commit()
+        return _detached(db, db.query(models.User).filter(models.User.id.in_(ids)).order_by(models.User.id).all())
+    return create
+
+
+@pytest.fixture
+def ride_factory(db):
+    """Test fixture returning a function inserting rides in bulk, active with one seat departing tomorrow by default,
+    for example: ride_factory(100, start_city="city_1")
+
+    Returns:
+        Callable[..., list[models.Ride]]: inserts count rides with given fields and returns them
+    """
+    def create(count: int = 1, **fields) -> list[models.Ride]:
+        first_id = _next_id(db, models.Ride)
+        ids = list(range(first_id, first_id + count))
+        ride = {"start_city": "city_1", "destination_city": "city_2", "distance": 1.0, "km_fee": 1.0,
+                "departure_date": datetime.utcnow() + timedelta(days=1), "is_active": True, "user_id_taken": None,
+                "seats": 1, "seats_available": fields.get("seats", 1), **fields}
+        ride.setdefault("price", ride["distance"] * ride["km_fee"])
+        db.execute(insert(models.Ride), [{**ride, "id": ride_id} for ride_id in ids])
+        db.commit()
+        return _detached(db, db.query(models.Ride).filter(models.Ride.id.in_(ids)).order_by(models.Ride.id).all())
+    return create
+
+
+@pytest.fixture
+def auth_headers():
+    """Test fixture returning a function building the authorization headers of a user without logging in
+
+    Returns:
+        Callable[[models.User | str], dict]: takes the user or the login
+    """
+    def headers(user: models.User | str) -> dict:
+        login = user if isinstance(user, str) else user.login
+        token = SecurityUtils.create_access_token(data={"sub": login}, expires_delta=timedelta(minutes=30))
+        return {"Authorization": f"Bearer {token}"}
+    return headers
 
 
 @pytest.fixture(scope="module")
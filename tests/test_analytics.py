@@ -0,0 +1,114 @@
+import pytest
+from app import analytics, models
+
+
+@pytest.fixture
+def admin(user_factory) -> models.User:
+    """Test fixture returning an active admin
+    """
+    return user_factory(is_admin=True)[0]
+
+
+@pytest.fixture
+def rides(client, admin, auth_headers) -> list[dict]:
+    """Test fixture creating three rides through the API: two from city_a to city_b on two days
+    and one from city_a to city_c, booked by an user
+
+    Returns:
+        list[dict]: the created rides
+    """
+    created = []
+    for destination_city, departure_date, seats in [("city_b", "2030-01-01 08:00", 4), ("city_b", "2030-01-02 08:00", 2),
+                                                    ("city_c", "2030-01-01 18:00", 3)]:
+        response = client.post("/rides/", headers=auth_headers(admin), json={
+            "start_city": "city_a", "destination_city": destination_city, "distance": 10,
+            "km_fee": 1.5, "departure_date": departure_date, "seats": seats})
+        created.append(response.json())
+    for ride, seats in [(created[0], 2), (created[0], 1), (created[2], 3)]:
+        response = client.post(f"/rides/{ride['id']}/reserve", params={"seats": seats}, headers=auth_headers(admin))
+        assert response.status_code == 200
+    return created
+
+
+def route_stats(client, admin, auth_headers, path: str = "/analytics/routes", **params) -> list[dict]:
+    response = client.get(path, params=params, headers=auth_headers(admin))
+    assert response.status_code == 200
+    return response.json()
+
+
+EXPECTED_ROUTES = [
+    {"start_city": "city_a", "destination_city": "city_b", "rides": 2, "seats": 6, "bookings": 2,
+     "seats_booked": 3, "revenue": 45.0, "booking_rate": 0.5},
+    {"start_city": "city_a", "destination_city": "city_c", "rides": 1, "seats": 3, "bookings": 1,
+     "seats_booked": 3, "revenue": 45.0, "booking_rate": 1.0},
+]
+
+
+def test_route_stats_not_an_admin(client, user_factory, auth_headers):
+    user, = user_factory()
+    response = client.get("/analytics/routes", headers=auth_headers(user))
+    assert response.status_code == 401
+
+
+def test_route_stats_pending_and_folded(client, admin, auth_headers, rides, db):
+    """Trying:
+        get("/analytics/routes") before and after the deltas are folded into the route daily stats
+
+    Expecting:
+        the same totals either way, no deltas left after the fold
+    """
+    assert route_stats(client, admin, auth_headers) == EXPECTED_ROUTES
+    assert analytics.fold(db) == 3
+    assert db.query(models.RouteStatsDelta).count() == 0
+    assert route_stats(client, admin, auth_headers) == EXPECTED_ROUTES
+
+
+def test_route_daily_stats(client, admin, auth_headers, rides, db):
+    analytics.fold(db)
+    daily = route_stats(client, admin, auth_headers, "/analytics/routes/daily", destination_city="city_b")
+    assert [(day["day"], day["rides"], day["seats_booked"], day["booking_rate"]) for day in daily] == [
+        ("2030-01-01", 1, 3, 0.75), ("2030-01-02", 1, 0, 0.0)]
+    stats = route_stats(client, admin, auth_headers, **{"from": "2030-01-02", "to": "2030-01-02"})
+    assert [(route["destination_city"], route["rides"]) for route in stats] == [("city_b", 1)]
+
+
+def test_route_stats_remove_ride(client, admin, auth_headers, rides, db):
+    """Trying:
+        delete("/rides/<ride id>/delete") of a booked ride, partly folded into the stats already
+
+    Expecting:
+        the ride, its seats and bookings taken out of the route stats, the route gone once it has no rides
+    """
+    analytics.fold(db)
+    response = client.delete(f"/rides/{rides[2]['id']}/delete", headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert route_stats(client, admin, auth_headers) == EXPECTED_ROUTES[:1]
+    analytics.fold(db)
+    assert route_stats(client, admin, auth_headers) == EXPECTED_ROUTES[:1]
+
+
+def test_rebuild_matches_incremental_stats(client, admin, auth_headers, rides, db):
+    incremental = route_stats(client, admin, auth_headers, "/analytics/routes/daily")
+    analytics.rebuild(db)
+    assert db.query(models.RouteStatsDelta).count() == 0
+    assert route_stats(client, admin, auth_headers, "/analytics/routes/daily") == incremental
+
+
+def test_route_stats_remove_user(client, admin, auth_headers, user_factory, rides, db):
+    """Trying:
+        delete("/users/<username>/delete") of an user with bookings on two rides, partly folded into the stats already
+
+    Expecting:
+        the bookings of the user taken out of the route stats, the same stats as a rebuild
+    """
+    user, = user_factory()
+    for ride, seats in [(rides[0], 1), (rides[1], 2)]:
+        response = client.post(f"/rides/{ride['id']}/reserve", params={"seats": seats}, headers=auth_headers(user))
+        assert response.status_code == 200
+    analytics.fold(db)
+    response = client.delete(f"/users/{user.login}/delete", headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert route_stats(client, admin, auth_headers) == EXPECTED_ROUTES
+    incremental = route_stats(client, admin, auth_headers, "/analytics/routes/daily")
+    analytics.rebuild(db)
+    assert route_stats(client, admin, auth_headers, "/analytics/routes/daily") == incremental
@@ -1,17 +1,32 @@
 import pytest
+from datetime import datetime
 from fastapi.encoders import jsonable_encoder
-from app.main import app
-from app import schemas, dependencies
-from app.database import Base, engine_tests
+from app import models, schemas
+from app.utils import SecurityUtils
 
 
-Base.metadata.create_all(bind=engine_tests)
+# every test runs in its own rolled back transaction (see tests/conftest.py), creating the users and rides it needs
 
 
-app.dependency_overrides[dependencies.get_db] = dependencies.override_get_db
+@pytest.fixture
+def admin(user_factory) -> models.User:
+    """Test fixture returning an active admin
+    """
+    return user_factory(is_admin=True)[0]
+
+
+@pytest.fixture
+def active_user(user_factory) -> models.User:
+    """Test fixture returning an active user, not an admin
+    """
+    return user_factory()[0]
 
 
-# all tests except activate_my_account - needs to figure out how to write it
+@pytest.fixture
+def inactive_user(user_factory) -> models.User:
+    """Test fixture returning a user who hasn't activated the account yet
+    """
+    return user_factory(is_active=False, activation_code="activation-code")[0]
 
 
 def test_welcome_to_the_app(client):
@@ -44,28 +59,30 @@ def test_create_user(client, test_user_schema):
         client (Generator): yields test client
         test_user_schema (schema.CreateUser): user data
     """
-    user = test_user_schema
-    user = jsonable_encoder(user)
+    user = jsonable_encoder(test_user_schema)
     response = client.post("/users/", json = user)
     assert response.status_code == 200
     assert response.json()['message'] == f"activation link has been sent to {user['login']}"
 
 
-def test_create_user_email_already_registered(client, test_user_schema):
+def test_create_user_email_already_registered(client, test_user_schema, user_factory, monkeypatch):
     """Trying:
         post("/users/") using login that is already registered
 
     Expecting: 
         status code: 405 (Method Not Allowed)
         
-        raises an exception with detail: "Email already registered"
+        raises an exception with detail: "Email already registered", without hashing the password
 
     Args:
         client (Generator): yields test client
         test_user_schema (schema.CreateUser): user data
+        user_factory (Callable): inserts users
+        monkeypatch (pytest.MonkeyPatch): makes hashing the password fail the test
     """
-    user = test_user_schema
-    user = jsonable_encoder(user)
+    user_factory(login=test_user_schema.login)
+    monkeypatch.setattr(SecurityUtils, "get_password_hash", pytest.fail)
+    user = jsonable_encoder(test_user_schema)
     response = client.post("/users/", json = user)
     assert response.status_code == 405
     assert response.json() == {"detail": "Email already registered"}
@@ -84,8 +101,7 @@ def test_create_user_admin(client, test_admin_schema):
         client (Generator): yields test client
         test_admin_schema (schema.CreateUser): admin data
     """
-    user = test_admin_schema
-    user = jsonable_encoder(user)
+    user = jsonable_encoder(test_admin_schema)
     response = client.post("/users/", json = user)
     assert response.status_code == 200
     assert response.json()['message'] == "user is a superuser. Automatic account activation."
@@ -112,7 +128,7 @@ def test_create_user_email_not_valid(client):
     assert response.json() == {"detail": "Login is not a valid email address."}
 
 
-def test_login(client, test_user):
+def test_login(client, test_user, user_factory):
     """Trying:
         post("/token") with valid credentials
 
@@ -125,13 +141,13 @@ def test_login(client, test_user):
 
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        test_user (dict): user credentials
+        user_factory (Callable): inserts users
     """
+    user_factory(login=test_user["username"], password=test_user["password"])
     response = client.post("/token", data = test_user)
     assert response.status_code == 200
-    token = response.json()["access_token"]
-    assert token is not None
-    return token
+    assert response.json()["access_token"] is not None
 
 
 def test_login_invalid_credentials(client):
@@ -151,7 +167,7 @@ def test_login_invalid_credentials(client):
     assert response.json() == {"detail": "Incorrect login or password"}
 
 
-def test_read_my_info_not_active(client, test_user):
+def test_read_my_info_not_active(client, inactive_user, auth_headers):
     """Trying:
         get("/user/me") as inactive user
 
@@ -162,15 +178,15 @@ def test_read_my_info_not_active(client, test_user):
 
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get("/users/me/", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/users/me/", headers=auth_headers(inactive_user))
     assert response.status_code == 401
     assert response.json() == {"detail": "Inactive user"}
 
 
-def test_get_all_rides_user_not_active(client, test_user):
+def test_get_all_rides_user_not_active(client, inactive_user, auth_headers):
     """Trying:
         get("/rides/") as inactive user
 
@@ -181,15 +197,15 @@ def test_get_all_rides_user_not_active(client, test_user):
 
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get("/rides/", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/rides/", headers=auth_headers(inactive_user))
     assert response.status_code == 401
     assert response.json() == {'detail':'Inactive user'}
 
 
-def test_get_all_rides_by_starting_city_user_not_active(client, test_user):
+def test_get_all_rides_by_starting_city_user_not_active(client, inactive_user, auth_headers):
     """Trying:
         get("/rides/city_1/") as inactive user
 
@@ -200,15 +216,15 @@ def test_get_all_rides_by_starting_city_user_not_active(client, test_user):
 
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get("/rides/city_1/", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/rides/city_1/", headers=auth_headers(inactive_user))
     assert response.status_code == 401
     assert response.json() == {'detail':'Inactive user'}
 
 
-def test_get_all_rides_by_destination_city_not_active(client, test_user):
+def test_get_all_rides_by_destination_city_not_active(client, inactive_user, auth_headers):
     """Trying:
         get("/rides/all/city_1/") as inactive user
 
@@ -219,15 +235,15 @@ def test_get_all_rides_by_destination_city_not_active(client, test_user):
 
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get("/rides/all/city_1/", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/rides/all/city_1/", headers=auth_headers(inactive_user))
     assert response.status_code == 401
     assert response.json() == {'detail':'Inactive user'}
 
 
-def test_get_all_rides_from_one_city_to_another_user_not_active(client, test_user):
+def test_get_all_rides_from_one_city_to_another_user_not_active(client, inactive_user, auth_headers):
     """Trying:
         get("/rides/city_1/city_2") as inactive user
 
@@ -238,15 +254,15 @@ def test_get_all_rides_from_one_city_to_another_user_not_active(client, test_use
 
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get("/rides/city_1/city_2", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/rides/city_1/city_2", headers=auth_headers(inactive_user))
     assert response.status_code == 401
     assert response.json() == {'detail':'Inactive user'}
 
 
-def test_reserve_ride_user_not_active(client, test_user):
+def test_reserve_ride_user_not_active(client, inactive_user, auth_headers):
     """Trying:
         post("/rides/1/reserve") as inactive user
 
@@ -257,15 +273,15 @@ def test_reserve_ride_user_not_active(client, test_user):
 
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.post("/rides/1/reserve", headers={"Authorization": f"Bearer {token}"})
+    response = client.post("/rides/1/reserve", headers=auth_headers(inactive_user))
     assert response.status_code == 401
     assert response.json() == {'detail':'Inactive user'}
 
 
-def test_send_activation_code(client, test_user):
+def test_send_activation_code(client, inactive_user, auth_headers):
     """Trying:
         get("/users/me/send-activation-code")
 
@@ -276,12 +292,12 @@ def test_send_activation_code(client, test_user):
 
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get("/users/me/send-activation-code", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/users/me/send-activation-code", headers=auth_headers(inactive_user))
     assert response.status_code == 200
-    assert response.json()['message'] == f"activation code has been sent to {test_user['username']}"
+    assert response.json()['message'] == f"activation code has been sent to {inactive_user.login}"
 
 
 def test_send_activation_code_not_logged_in(client):
@@ -290,7 +306,7 @@ def test_send_activation_code_not_logged_in(client):
 
     Expecting: 
         status code: 401 (Unauthorized)
-        
+
     Args:
         client (Generator): yields test client
     """
@@ -298,7 +314,7 @@ def test_send_activation_code_not_logged_in(client):
     assert response.status_code == 401
 
 
-def test_activate_my_account_incorrect_code(client, test_user):
+def test_activate_my_account_incorrect_code(client, inactive_user, auth_headers):
     """Trying:
         get("/users/1/activate/fake-code") with incorrect code
 
@@ -306,20 +322,18 @@ def test_activate_my_account_incorrect_code(client, test_user):
         status code: 401 (Unauthorized)
 
         raises an exception with detail: "Incorrect activation code."
-        
+
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get(f"/users/1/activate/fake-code",
-                          headers={"Authorization": f"Bearer {token}"})
+    response = client.get(f"/users/{inactive_user.id}/activate/fake-code", headers=auth_headers(inactive_user))
     assert response.status_code == 401
     assert response.json() == {"detail": "Incorrect activation code."}
 
 
-#instead of test_activate_my_account
-def test_activate_user(client, test_admin, test_user):
+def test_activate_user(client, admin, inactive_user, auth_headers):
     """Trying:
         login (see test_login docs)
 
@@ -329,19 +343,19 @@ def test_activate_user(client, test_admin, test_user):
         status code: 200
 
         response with login: test user username
-        
+
     Args:
         client (Generator): yields test client
-        test_admin(schema.CreateUser): admin credentials
-        test_user (schema.CreateUser): user credentials
+        admin (models.User): an admin
+        inactive_user (models.User): an inactive user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/activate", headers={"Authorization": f"Bearer {token}"})
+    response = client.patch(f"/users/{inactive_user.login}/activate", headers=auth_headers(admin))
     assert response.status_code == 200
-    assert test_user['username'] == response.json()['login']
+    assert inactive_user.login == response.json()['login']
 
 
-def test_send_activation_code_already_active(client, test_user):
+def test_send_activation_code_already_active(client, active_user, auth_headers):
     """Trying:
         get("/users/me/send-activation-code") with already active account
 
@@ -349,18 +363,18 @@ def test_send_activation_code_already_active(client, test_user):
         status code: 405 (Method Not Allowed)
 
         response with detail: "User already active"
-        
+
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        active_user (models.User): an active user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get("/users/me/send-activation-code", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/users/me/send-activation-code", headers=auth_headers(active_user))
     assert response.status_code == 405
     assert response.json() == {"detail": "User already active"}
 
 
-def test_read_my_info(client, test_user):
+def test_read_my_info(client, active_user, auth_headers):
     """Trying:
         get("/users/me/")
 
@@ -368,34 +382,34 @@ def test_read_my_info(client, test_user):
         status code: 200 (OK)
 
         response with login = username
-        
+
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        active_user (models.User): an active user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get("/users/me/", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/users/me/", headers=auth_headers(active_user))
     assert response.status_code == 200
-    assert test_user['username'] == response.json()['login']
+    assert active_user.login == response.json()['login']
 
 
-def test_view_user_info_not_an_admin(client, test_user):
+def test_view_user_info_not_an_admin(client, active_user, auth_headers):
     """Trying:
         get("/users/<test user username>") as a not superuser
 
     Expecting: 
         status code: 401 (Not Authorized)
-        
+
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        active_user (models.User): an active user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.get(f"/users/{test_user['username']}", headers={"Authorization": f"Bearer {token}"})
+    response = client.get(f"/users/{active_user.login}", headers=auth_headers(active_user))
     assert response.status_code == 401
 
 
-def test_view_user_info(client, test_admin):
+def test_view_user_info(client, admin, auth_headers):
     """Trying:
         get("/users/<test user username>") as an admin
 
@@ -403,18 +417,18 @@ def test_view_user_info(client, test_admin):
         status code: 200 (OK)
 
         reponse with login = test user username
-        
+
     Args:
         client (Generator): yields test client
-        test_admin (schema.CreateUser): admin credentials
+        admin (models.User): an admin
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_admin)
-    response = client.get(f"/users/{test_admin['username']}", headers={"Authorization": f"Bearer {token}"})
+    response = client.get(f"/users/{admin.login}", headers=auth_headers(admin))
     assert response.status_code == 200
-    assert test_admin['username'] == response.json()['login']
+    assert admin.login == response.json()['login']
 
 
-def test_view_user_info_no_user(client, test_admin):
+def test_view_user_info_no_user(client, admin, auth_headers):
     """Trying:
         get("/users/<fake login>") as an admin but there is not user
 
@@ -422,34 +436,34 @@ def test_view_user_info_no_user(client, test_admin):
         status code: 405 (Method Not Allowed)
 
         reponse with detail: "There's no user with email = totally-fake-login"
-        
+
     Args:
         client (Generator): yields test client
-        test_admin (schema.CreateUser): admin credentials
+        admin (models.User): an admin
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_admin)
-    response = client.get("/users/totally-fake-login", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/users/totally-fake-login", headers=auth_headers(admin))
     assert response.status_code == 405
     assert response.json() == {"detail": "There's no user with email = totally-fake-login"}
 
 
-def test_remove_adm_not_an_admin(client, test_user):
+def test_remove_adm_not_an_admin(client, active_user, auth_headers):
     """Trying:
         patch("/users/<test user username>/remove-adm") as a not superuser
 
     Expecting: 
         status code: 401 (Unauthorized)
-        
+
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        active_user (models.User): an active user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_user)
-    response = client.patch(f"/users/{test_user['username']}/remove-adm", headers={"Authorization": f"Bearer {token}"})
-    assert response.status_code == 401 
+    response = client.patch(f"/users/{active_user.login}/remove-adm", headers=auth_headers(active_user))
+    assert response.status_code == 401
 
 
-def test_remove_adm_no_user(client, test_admin):
+def test_remove_adm_no_user(client, admin, auth_headers):
     """Trying:
         patch("/users/<test user username>/remove-adm") as an admin but no user found
 
@@ -457,291 +471,308 @@ def test_remove_adm_no_user(client, test_admin):
         status code: 405 (Method Not Allowed)
 
         reponse with detail: "There's no user with email = totally-fake-login"
-        
+
     Args:
         client (Generator): yields test client
-        test_admin (schema.CreateUser): admin credentials
+        admin (models.User): an admin
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/totally-fake-login/remove-adm", headers={"Authorization": f"Bearer {token}"})
+    response = client.patch("/users/totally-fake-login/remove-adm", headers=auth_headers(admin))
     assert response.status_code == 405
     assert response.json() == {"detail": "There's no user with email = totally-fake-login"}
 
 
-def test_remove_adm_user_not_an_admin(client, test_admin, test_user):
+def test_remove_adm_user_not_an_admin(client, admin, active_user, auth_headers):
     """Trying:
         patch("/users/<test user username>/remove-adm") as a not superuser
 
     Expecting: 
         status code: 401 (Unauthorized)
-        
+
     Args:
         client (Generator): yields test client
-        test_user (schema.CreateUser): user credentials
+        admin (models.User): an admin
+        active_user (models.User): an active user
+        auth_headers (Callable): builds authorization headers of an user
     """
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/remove-adm", headers={"Authorization": f"Bearer {token}"})
-    assert response.status_code == 405 
+    response = client.patch(f"/users/{active_user.login}/remove-adm", headers=auth_headers(admin))
+    assert response.status_code == 405
     assert response.json() == {"detail": "User not an admin"}
 
 
-def test_grant_adm_not_an_admin(client, test_user):
-    token = test_login(client, test_user)
-    response = client.patch(f"/users/{test_user['username']}/grant-adm", headers={"Authorization": f"Bearer {token}"})
-    assert response.status_code == 401 
+def test_grant_adm_not_an_admin(client, active_user, auth_headers):
+    response = client.patch(f"/users/{active_user.login}/grant-adm", headers=auth_headers(active_user))
+    assert response.status_code == 401
 
 
-def test_grant_adm(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/grant-adm", headers={"Authorization": f"Bearer {token}"})
+def test_grant_adm(client, admin, active_user, auth_headers):
+    response = client.patch(f"/users/{active_user.login}/grant-adm", headers=auth_headers(admin))
     assert response.status_code == 200
-    assert test_user['username'] == response.json()['login']
-    
+    assert active_user.login == response.json()['login']
+
 
-def test_grant_adm_user_already_an_admin(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/grant-adm", headers={"Authorization": f"Bearer {token}"})
-    assert response.status_code == 405 
+def test_grant_adm_user_already_an_admin(client, admin, user_factory, auth_headers):
+    other_admin, = user_factory(is_admin=True)
+    response = client.patch(f"/users/{other_admin.login}/grant-adm", headers=auth_headers(admin))
+    assert response.status_code == 405
     assert response.json() == {"detail": "User already an admin"}
 
 
-def test_remove_adm(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/remove-adm", headers={"Authorization": f"Bearer {token}"})
-    assert response.status_code == 200 
-    assert test_user['username'] == response.json()['login']
+def test_remove_adm(client, admin, user_factory, auth_headers):
+    other_admin, = user_factory(is_admin=True)
+    response = client.patch(f"/users/{other_admin.login}/remove-adm", headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert other_admin.login == response.json()['login']
 
 
-def test_get_all_rides_no_rides(client, test_user):
-    token = test_login(client, test_user)
-    response = client.get("/rides/", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides_no_rides(client, active_user, auth_headers):
+    response = client.get("/rides/", headers=auth_headers(active_user))
     assert response.status_code == 200
     assert response.json() == []
 
 
-def test_create_ride(client, test_admin, test_ride_1_schema):
-    token = test_login(client, test_admin)
-    ride = test_ride_1_schema
-    ride = jsonable_encoder(ride)
-    response = client.post("/rides/", json = ride, headers={"Authorization": f"Bearer {token}"})
+def test_create_ride(client, admin, auth_headers, test_ride_1_schema):
+    ride = jsonable_encoder(test_ride_1_schema)
+    response = client.post("/rides/", json = ride, headers=auth_headers(admin))
     assert response.status_code == 200
     assert response.json()['start_city'] == "city_1"
 
 
-def test_get_all_rides(client, test_user):
-    token = test_login(client, test_user)
-    response = client.get("/rides/", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides(client, active_user, ride_factory, auth_headers):
+    ride_factory(start_city="city_1", destination_city="city_2")
+    response = client.get("/rides/", headers=auth_headers(active_user))
     assert response.status_code == 200
     assert len(response.json())
 
 
-def test_get_all_rides_by_starting_city(client, test_user):
-    token = test_login(client, test_user)
-    response = client.get("/rides/city_1", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides_by_starting_city(client, active_user, ride_factory, auth_headers):
+    ride_factory(start_city="city_1", destination_city="city_2")
+    response = client.get("/rides/city_1", headers=auth_headers(active_user))
     assert response.status_code == 200
     assert len(response.json())
 
 
-def test_get_all_rides_by_destination_city(client, test_user):
-    token = test_login(client, test_user)
-    response = client.get("/rides/all/city_2", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides_by_destination_city(client, active_user, ride_factory, auth_headers):
+    ride_factory(start_city="city_1", destination_city="city_2")
+    response = client.get("/rides/all/city_2", headers=auth_headers(active_user))
     assert response.status_code == 200
     assert len(response.json())
 
 
-def test_get_all_rides_from_one_city_to_another(client, test_user):
-    token = test_login(client, test_user)
-    response = client.get("/rides/city_1/city_2", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides_from_one_city_to_another(client, active_user, ride_factory, auth_headers):
+    ride_factory(start_city="city_1", destination_city="city_2")
+    response = client.get("/rides/city_1/city_2", headers=auth_headers(active_user))
     assert response.status_code == 200
     assert len(response.json())
 
 
-def test_reserve_ride_no_ride(client, test_user):
-    token = test_login(client, test_user)
-    response = client.post("/rides/5/reserve", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides_from_one_city_to_another_departure_range(client, active_user, ride_factory, auth_headers):
+    ride_factory(departure_date=datetime(2020, 1, 1, 19, 30))
+    ride_factory(departure_date=datetime(2020, 1, 3, 19, 30))
+    params = {"from": "2020-01-01T00:00", "to": "2020-01-02T00:00"}
+    response = client.get("/rides/city_1/city_2", params=params, headers=auth_headers(active_user))
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
+def test_get_all_rides_departure_range_no_rides(client, active_user, ride_factory, auth_headers):
+    ride_factory(departure_date=datetime(2020, 1, 1, 19, 30))
+    response = client.get("/rides/", params={"from": "2020-01-02T00:00"}, headers=auth_headers(active_user))
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_get_all_rides_invalid_order(client, active_user, auth_headers):
+    response = client.get("/rides/", params={"order": "distance"}, headers=auth_headers(active_user))
+    assert response.status_code == 422
+
+
+def test_reserve_ride_no_ride(client, active_user, auth_headers):
+    response = client.post("/rides/5/reserve", headers=auth_headers(active_user))
     assert response.status_code == 400
     assert response.json() == {"detail":"Can't find any ride with id = 5."}
 
 
-def test_reserve_ride(client, test_user):
-    token = test_login(client, test_user)
-    response = client.post("/rides/1/reserve", headers={"Authorization": f"Bearer {token}"})
+def test_reserve_ride(client, active_user, ride_factory, auth_headers):
+    ride, = ride_factory()
+    response = client.post(f"/rides/{ride.id}/reserve", headers=auth_headers(active_user))
     assert response.status_code == 200
-    assert response.json()['message'] == f"The ride was booked successfully and a detailed email has been sent to {test_user['username']}"
+    assert response.json()['message'] == f"The ride was booked successfully and a detailed email has been sent to {active_user.login}"
 
 
-def test_reserve_ride_inactive_ride(client, test_user):
-    token = test_login(client, test_user)
-    response = client.post("/rides/1/reserve", headers={"Authorization": f"Bearer {token}"})
+def test_reserve_ride_inactive_ride(client, active_user, ride_factory, auth_headers):
+    ride, = ride_factory(is_active=False, seats_available=0)
+    response = client.post(f"/rides/{ride.id}/reserve", headers=auth_headers(active_user))
     assert response.status_code == 405
     assert response.json() == {"detail":"The ride is no longer active."}
 
 
-def test_create_ride_2(client, test_admin, test_ride_2_schema):
-    token = test_login(client, test_admin)
-    ride = test_ride_2_schema
-    ride = jsonable_encoder(ride)
-    response = client.post("/rides/", json = ride, headers={"Authorization": f"Bearer {token}"})
+def test_create_ride_2(client, admin, auth_headers, test_ride_2_schema):
+    ride = jsonable_encoder(test_ride_2_schema)
+    response = client.post("/rides/", json = ride, headers=auth_headers(admin))
     assert response.status_code == 200
     assert response.json()['start_city'] == "city_2"
 
 
-def test_archivise_ride_no_ride(client, test_admin):
-    token = test_login(client, test_admin)
-    response = client.patch("/rides/5/archivise", headers={"Authorization": f"Bearer {token}"})
+def test_archivise_ride_no_ride(client, admin, auth_headers):
+    response = client.patch("/rides/5/archivise", headers=auth_headers(admin))
     assert response.status_code == 400
     assert response.json() == {"detail":"couldn't find a ride with id = 5"}
 
 
-def test_archivise_ride(client, test_admin):
-    token = test_login(client, test_admin)
-    response = client.patch("/rides/2/archivise", headers={"Authorization": f"Bearer {token}"})
+def test_archivise_ride(client, admin, ride_factory, auth_headers):
+    ride, = ride_factory(start_city="city_2", destination_city="city_1")
+    response = client.patch(f"/rides/{ride.id}/archivise", headers=auth_headers(admin))
     assert response.status_code == 200
     assert response.json()['start_city'] == "city_2"
 
 
-def test_archivise_ride_ride_already_inactive(client, test_admin):
-    token = test_login(client, test_admin)
-    response = client.patch("/rides/1/archivise", headers={"Authorization": f"Bearer {token}"})
+def test_archivise_ride_ride_already_inactive(client, admin, ride_factory, auth_headers):
+    ride, = ride_factory(is_active=False, seats_available=0)
+    response = client.patch(f"/rides/{ride.id}/archivise", headers=auth_headers(admin))
     assert response.status_code == 405
     assert response.json() == {"detail":"ride already deactivated."}
 
 
-def test_delete_ride(client, test_admin):
-    token = test_login(client, test_admin)
-    response = client.delete("/rides/1/delete", headers={"Authorization": f"Bearer {token}"})
+def test_delete_ride(client, admin, ride_factory, auth_headers):
+    ride, = ride_factory()
+    response = client.delete(f"/rides/{ride.id}/delete", headers=auth_headers(admin))
     assert response.status_code == 200
-    assert response.json()['message'] == "ride with id = 1 successfully deleted."
+    assert response.json()['message'] == f"ride with id = {ride.id} successfully deleted."
 
 
-def test_delete_ride_no_ride(client, test_admin):
-    token = test_login(client, test_admin)
-    response = client.delete("/rides/1/delete", headers={"Authorization": f"Bearer {token}"})
+def test_delete_ride_no_ride(client, admin, auth_headers):
+    response = client.delete("/rides/1/delete", headers=auth_headers(admin))
     assert response.status_code == 400
     assert response.json() == {"detail":"couldn't find a ride with id = 1."}
 
 
-def test_get_all_rides_by_starting_city_no_rides(client, test_user):
-    token = test_login(client, test_user)
-    response = client.get("/rides/test-city/", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides_by_starting_city_no_rides(client, active_user, ride_factory, auth_headers):
+    ride_factory()
+    response = client.get("/rides/test-city/", headers=auth_headers(active_user))
     assert response.status_code == 200
     assert response.json() == []
 
 
-def test_get_all_rides_by_destination_city_no_rides(client, test_user):
-    token = test_login(client, test_user)
-    response = client.get("/rides/all/test-city", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides_by_destination_city_no_rides(client, active_user, ride_factory, auth_headers):
+    ride_factory()
+    response = client.get("/rides/all/test-city", headers=auth_headers(active_user))
     assert response.status_code == 200
     assert response.json() == []
 
 
-def test_get_all_rides_from_one_city_to_another_no_rides(client, test_user):
-    token = test_login(client, test_user)
-    response = client.get("/rides/test-city/test-town", headers={"Authorization": f"Bearer {token}"})
+def test_get_all_rides_from_one_city_to_another_no_rides(client, active_user, ride_factory, auth_headers):
+    ride_factory()
+    response = client.get("/rides/test-city/test-town", headers=auth_headers(active_user))
     assert response.status_code == 200
     assert response.json() == []
 
 
-def test_create_ride_not_an_adm(client, test_user):
-    token = test_login(client, test_user)
-    response = client.post("/rides/", headers={"Authorization": f"Bearer {token}"})
+def test_create_ride_not_an_adm(client, active_user, auth_headers):
+    response = client.post(f"/rides/", headers=auth_headers(active_user))
     assert response.status_code == 401
 
-def test_archivise_ride_not_an_adm(client, test_user):
-    token = test_login(client, test_user)
-    response = client.patch("/rides/1/archivise", headers={"Authorization": f"Bearer {token}"})
+
+def test_archivise_ride_not_an_adm(client, active_user, auth_headers):
+    response = client.patch(f"/rides/1/archivise", headers=auth_headers(active_user))
     assert response.status_code == 401
 
 
-def test_delete_ride_not_an_adm(client, test_user):
-    token = test_login(client, test_user)
-    response = client.delete("/rides/1/delete", headers={"Authorization": f"Bearer {token}"})
+def test_delete_ride_not_an_adm(client, active_user, auth_headers):
+    response = client.delete(f"/rides/1/delete", headers=auth_headers(active_user))
     assert response.status_code == 401
 
-def test_deactivate_user_not_an_admin(client, test_user):
-    token = test_login(client, test_user)
-    response = client.patch(f"/users/{test_user['username']}/deactivate", headers={"Authorization": f"Bearer {token}"})
+
+def test_deactivate_user_not_an_admin(client, active_user, auth_headers):
+    response = client.patch(f"/users/{active_user.login}/deactivate", headers=auth_headers(active_user))
     assert response.status_code == 401
 
 
-def test_deactivate_user_no_user(client, test_admin):
-    token = test_login(client, test_admin)
-    response = client.patch("/users/totally-fake-login/deactivate", headers={"Authorization": f"Bearer {token}"})
+def test_deactivate_user_no_user(client, admin, auth_headers):
+    response = client.patch("/users/totally-fake-login/deactivate", headers=auth_headers(admin))
     assert response.status_code == 405
-    assert response.json() == {"detail": f"There's no user with email = totally-fake-login"}
+    assert response.json() == {"detail": "There's no user with email = totally-fake-login"}
 
 
-def test_deactivate_user(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/deactivate", headers={"Authorization": f"Bearer {token}"})
+def test_deactivate_user(client, admin, active_user, auth_headers):
+    response = client.patch(f"/users/{active_user.login}/deactivate", headers=auth_headers(admin))
     assert response.status_code == 200
-    assert test_user['username'] == response.json()['login']
+    assert active_user.login == response.json()['login']
 
 
-def test_deactivate_user_user_already_inactive(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/deactivate", headers={"Authorization": f"Bearer {token}"})
+def test_deactivate_user_user_already_inactive(client, admin, inactive_user, auth_headers):
+    response = client.patch(f"/users/{inactive_user.login}/deactivate", headers=auth_headers(admin))
     assert response.status_code == 405
     assert response.json() == {"detail": "User already inactive"}
 
 
-def test_activate_user_again(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/activate", headers={"Authorization": f"Bearer {token}"})
+def test_activate_user_again(client, admin, active_user, auth_headers):
+    assert client.patch(f"/users/{active_user.login}/deactivate", headers=auth_headers(admin)).status_code == 200
+    response = client.patch(f"/users/{active_user.login}/activate", headers=auth_headers(admin))
     assert response.status_code == 200
-    assert test_user['username'] == response.json()['login']
+    assert active_user.login == response.json()['login']
 
 
-def test_activate_user_not_an_admin(client, test_user):
-    token = test_login(client, test_user)
-    response = client.patch(f"/users/{test_user['username']}/activate", headers={"Authorization": f"Bearer {token}"})
+def test_activate_user_not_an_admin(client, active_user, auth_headers):
+    response = client.patch(f"/users/{active_user.login}/activate", headers=auth_headers(active_user))
     assert response.status_code == 401
 
 
-def test_activate_user_no_user(client, test_admin):
-    token = test_login(client, test_admin)
-    response = client.patch("/users/totally-fake-login/activate", headers={"Authorization": f"Bearer {token}"})
+def test_activate_user_no_user(client, admin, auth_headers):
+    response = client.patch("/users/totally-fake-login/activate", headers=auth_headers(admin))
     assert response.status_code == 405
     assert response.json() == {"detail": "There's no user with email = totally-fake-login"}
 
 
-def test_activate_user_user_already_active(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.patch(f"/users/{test_user['username']}/activate", headers={"Authorization": f"Bearer {token}"})
+def test_activate_user_user_already_active(client, admin, active_user, auth_headers):
+    response = client.patch(f"/users/{active_user.login}/activate", headers=auth_headers(admin))
     assert response.status_code == 405
     assert response.json() == {"detail": "User already active"}
 
 
-def test_delete_user_not_an_admin(client, test_user):
-    token = test_login(client, test_user)
-    response = client.patch(f"/users/{test_user['username']}/activate", headers={"Authorization": f"Bearer {token}"})
+def test_delete_user_not_an_admin(client, active_user, auth_headers):
+    response = client.patch(f"/users/{active_user.login}/activate", headers=auth_headers(active_user))
     assert response.status_code == 401
 
 
-def test_delete_user(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.delete(f"/users/{test_user['username']}/delete", headers={"Authorization": f"Bearer {token}"})
+def test_delete_user(client, admin, active_user, auth_headers):
+    response = client.delete(f"/users/{active_user.login}/delete", headers=auth_headers(admin))
     assert response.status_code == 200
-    assert response.json()['message'] == f"user has been deleted. An email has been sent to the {test_user['username']}."
+    assert response.json()['message'] == f"user has been deleted. An email has been sent to the {active_user.login}."
 
 
-def test_delete_user_no_user(client, test_admin, test_user):
-    token = test_login(client, test_admin)
-    response = client.delete(f"/users/{test_user['username']}/delete", headers={"Authorization": f"Bearer {token}"})
+def test_delete_user_no_user(client, admin, test_user, auth_headers):
+    response = client.delete(f"/users/{test_user['username']}/delete", headers=auth_headers(admin))
     assert response.status_code == 405
     assert response.json() == {"detail": f"There's no user with email = {test_user['username']}"}
 
 
 def test_delete_my_account(client, test_user, test_user_schema):
-    test_create_user(client, test_user_schema)
-    token = test_login(client, test_user)
+    assert client.post("/users/", json = jsonable_encoder(test_user_schema)).status_code == 200
+    token = client.post("/token", data = test_user).json()["access_token"]
     response = client.delete(f"/users/me/delete", headers={"Authorization": f"Bearer {token}"})
     assert response.status_code == 200
     assert response.json()['message'] == f"Your account has been deleted. An email has been sent to the {test_user['username']}."
 
 
-def test_delete_my_account_admin(client, test_admin):
-    token = test_login(client, test_admin)
-    response = client.delete(f"/users/me/delete", headers={"Authorization": f"Bearer {token}"})
+def test_delete_my_account_admin(client, admin, auth_headers):
+    response = client.delete(f"/users/me/delete", headers=auth_headers(admin))
+    assert response.status_code == 200
+
+
+def test_activate_my_account(client, inactive_user):
+    """Trying:
+        get("/users/<id>/activate/<code>") with the activation code of the account
+
+    Expecting:
+        status code: 200 (OK)
+
+        response with message: "your account has been activated."
+
+    Args:
+        client (Generator): yields test client
+        inactive_user (models.User): an inactive user
+    """
+    response = client.get(f"/users/{inactive_user.id}/activate/activation-code")
     assert response.status_code == 200
-    assert response.json()['message'] == "Your account has been deleted."
\ No newline at end of file
+    assert response.json()['message'] == "your account has been activated."
@@ -0,0 +1,29 @@
+import asyncio
+from benchmarks.rows import compare as compare_rows
+from benchmarks.run import ENDPOINTS, compare, run, summarize
+
+
+def test_summarize_percentiles():
+    summary = summarize([i / 1000 for i in range(1, 101)], {200: 100}, elapsed=2)
+    assert summary["requests"] == 100
+    assert summary["throughput_rps"] == 50
+    assert summary["p50_ms"] < summary["p95_ms"] < summary["p99_ms"] <= summary["max_ms"] == 100
+    assert summary["statuses"] == {"200": 100}
+
+
+def test_run_small_benchmark(tmp_path):
+    report = asyncio.run(run(f"sqlite:///{tmp_path / 'bench.db'}", users=5, rides=200, requests=10, concurrency=4))
+    assert set(report["results"]) == set(ENDPOINTS)
+    assert report["meta"]["rides"] == 200
+    for name, result in report["results"].items():
+        assert result["requests"] == 10
+        assert set(result["statuses"]) <= {"200", "405", "409"}, name
+    assert "throughput_rps" in compare(report, report)
+
+
+def test_rows_skip_the_identity_map_and_render_the_same_body():
+    results = compare_rows(200, repeat=1)
+    assert results["orm"]["identity_map"] == 200
+    assert results["rows"]["identity_map"] == 0
+    assert results["rows"]["bytes"] == results["orm"]["bytes"]
+    assert results["rows"]["peak_mib"] < results["orm"]["peak_mib"]
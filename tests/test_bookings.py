@@ -0,0 +1,164 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from app import crud, migrate, models, schemas
+from app.database import Base
+
+
+@pytest.fixture(params=["sqlite", pytest.param("postgresql", marks=pytest.mark.postgres),
+                        pytest.param("postgresql-partitioned", marks=pytest.mark.postgres)])
+def booking_sessions(request, tmp_path):
+    """Test fixture yielding a session maker bound to a file database, or to PostgreSQL for the postgres variants,
+    plain or with the rides table partitioned, so that every thread books through its own connection
+
+    Yields:
+        sessionmaker: session maker
+    """
+    if request.param.startswith("postgresql"):
+        engine = request.getfixturevalue("postgres_engine")
+    else:
+        engine = create_engine(f"sqlite:///{tmp_path / 'bookings.db'}", connect_args={"check_same_thread": False, "timeout": 60})
+    if request.param == "postgresql-partitioned":
+        migrate.migrate(engine, partition_rides=True)
+    else:
+        Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def create_bus(sessions, seats: int) -> int:
+    """Creates a ride with given seat capacity and returns its id
+    """
+    with sessions() as db:
+        return crud.create_ride(db, schemas.RideCreate(start_city="Kraków", destination_city="Gdańsk", distance=600,
+                                                       km_fee=0.1, departure_date="2030-01-01 08:00", seats=seats)).id
+
+
+def create_passengers(sessions, count: int) -> list[int]:
+    """Inserts users that will book the rides and returns their ids
+    """
+    with sessions() as db:
+        users = [models.User(login=f"passenger_{i}@test.com", is_active=True, is_admin=False) for i in range(count)]
+        db.add_all(users)
+        db.commit()
+        return [user.id for user in users]
+
+
+def test_reserve_ride_partially(booking_sessions):
+    ride_id = create_bus(booking_sessions, seats=3)
+    user_id, = create_passengers(booking_sessions, 1)
+    with booking_sessions() as db:
+        booking = crud.reserve_ride(db, ride_id=ride_id, user_id=user_id, seats=2)
+        ride = crud.get_ride_by_ID(db, ride_id)
+        assert booking.seats == 2
+        assert ride.seats_available == 1
+        assert ride.is_active == True
+
+
+def test_reserve_ride_not_enough_seats(booking_sessions):
+    ride_id = create_bus(booking_sessions, seats=2)
+    user_id, = create_passengers(booking_sessions, 1)
+    with booking_sessions() as db:
+        assert crud.reserve_ride(db, ride_id=ride_id, user_id=user_id, seats=3) is None
+        assert crud.reserve_ride(db, ride_id=ride_id, user_id=user_id, seats=2) is not None
+        ride = crud.get_ride_by_ID(db, ride_id)
+        assert ride.seats_available == 0
+        assert ride.is_active == False
+        assert crud.reserve_ride(db, ride_id=ride_id, user_id=user_id, seats=1) is None
+
+
+def test_reserve_ride_high_concurrency_no_overbooking(booking_sessions):
+    """Trying:
+        400 concurrent bookers fighting for 50 seats
+
+    Expecting:
+        every seat is sold exactly once, the counter ends at zero and the ride gets archivised
+
+    SQLite runs one writer at a time, so only the postgres variants (TEST_POSTGRES_URL) can catch a lost update,
+    and the partitioned one the bookers racing the move of the sold out ride to the archive partition
+    """
+    capacity, bookers = 50, 400
+    ride_id = create_bus(booking_sessions, seats=capacity)
+    user_ids = create_passengers(booking_sessions, bookers)
+    start = threading.Barrier(64)
+
+    def book(user_id: int) -> int:
+        if user_id <= user_ids[63]:
+            start.wait()
+        with booking_sessions() as db:
+            booking = crud.reserve_ride(db, ride_id=ride_id, user_id=user_id)
+            return booking.seats if booking is not None else 0
+
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        booked = list(pool.map(book, user_ids))
+
+    with booking_sessions() as db:
+        ride = crud.get_ride_by_ID(db, ride_id)
+        stored = db.query(func.sum(models.Booking.seats)).filter(models.Booking.ride_id == ride_id).scalar()
+        assert sum(booked) == stored == capacity
+        assert ride.seats_available == 0
+        assert ride.is_active == False
+
+
+def test_read_my_rides_keyset_pages(client, user_factory, ride_factory, auth_headers):
+    """Trying:
+        get("/users/me/rides") page after page, passing the booking id of the last booking of a page as before
+
+    Expecting:
+        the bookings of the user only, newest first, each with the booked ride
+    """
+    user, other = user_factory(2)
+    rides = ride_factory(3, seats=5)
+    for ride in rides:
+        assert client.post(f"/rides/{ride.id}/reserve", params={"seats": 2}, headers=auth_headers(user)).status_code == 200
+    assert client.post(f"/rides/{rides[0].id}/reserve", headers=auth_headers(other)).status_code == 200
+    first = client.get("/users/me/rides", params={"limit": 2}, headers=auth_headers(user)).json()
+    second = client.get("/users/me/rides", params={"limit": 2, "before": first[-1]["booking_id"]}, headers=auth_headers(user)).json()
+    bookings = first + second
+    assert [booking["id"] for booking in bookings] == [ride.id for ride in reversed(rides)]
+    assert [booking["booking_id"] for booking in bookings] == sorted((booking["booking_id"] for booking in bookings), reverse=True)
+    assert all(booking["seats_booked"] == 2 and booking["seats_available"] == 3 - (booking["id"] == rides[0].id)
+               for booking in bookings)
+
+
+def test_archivise_ride_keeps_user_id_taken(client, user_factory, ride_factory, auth_headers):
+    user, admin = user_factory(2, is_admin=True)
+    ride, = ride_factory(seats=2)
+    client.post(f"/rides/{ride.id}/reserve", headers=auth_headers(user))
+    response = client.patch(f"/rides/{ride.id}/archivise", headers=auth_headers(admin))
+    assert response.status_code == 200
+    # a shared ride is taken by its bookings, archiving it writes no passenger
+    assert response.json()["user_id_taken"] is None
+
+
+def test_reserve_single_seat_ride_sets_user_id_taken(db, client, user_factory, ride_factory, auth_headers):
+    first, second = user_factory(2)
+    single, = ride_factory(seats=1)
+    shared, = ride_factory(seats=2)
+    client.post(f"/rides/{single.id}/reserve", headers=auth_headers(first))
+    client.post(f"/rides/{shared.id}/reserve", headers=auth_headers(first))
+    client.post(f"/rides/{shared.id}/reserve", headers=auth_headers(second))
+    db.expire_all()
+    assert db.get(models.Ride, single.id).user_id_taken == first.id
+    assert db.get(models.Ride, shared.id).user_id_taken is None
+
+
+def test_remove_user_gives_seats_back(db, user_factory, ride_factory):
+    """Trying:
+        book a ride full and another partially, then remove the booking user
+
+    Expecting:
+        the seats back on both rides and the ride archivised when full active again
+    """
+    user, other = user_factory(2)
+    full, = ride_factory(seats=2)
+    partial, = ride_factory(seats=3)
+    crud.reserve_ride(db, ride_id=full.id, user_id=user.id, seats=2)
+    crud.reserve_ride(db, ride_id=partial.id, user_id=user.id, seats=1)
+    crud.reserve_ride(db, ride_id=partial.id, user_id=other.id, seats=1)
+    crud.remove_user(db, user_id=user.id)
+    rides = {ride.id: ride for ride in db.query(models.Ride).filter(models.Ride.id.in_([full.id, partial.id]))}
+    assert (rides[full.id].seats_available, rides[full.id].is_active) == (2, True)
+    assert (rides[partial.id].seats_available, rides[partial.id].is_active) == (2, True)
@@ -0,0 +1,109 @@
+import pytest
+from app.database import engine_tests
+
+
+@pytest.fixture(autouse=True)
+def ride(ride_factory):
+    """Test fixture inserting the ride the endpoints find and book
+    """
+    return ride_factory(start_city="budget_city_1", destination_city="budget_city_2", seats=100)[0]
+
+
+@pytest.fixture
+def headers(user_factory, auth_headers) -> dict:
+    """Test fixture returning the authorization headers of an admin
+    """
+    return auth_headers(user_factory(login="budget.admin@example.com", is_admin=True)[0])
+
+
+# statement and wall time budgets per endpoint, lower them along with optimizations, never raise them silently.
+# The statement counts always hold, the wall times only with --budget-time-factor
+BUDGETS = {
+    ("GET", "/users/me/"): (1, 0.5),
+    ("GET", "/users/"): (2, 0.5),
+    ("GET", "/users/me/rides"): (2, 0.5),
+    ("GET", "/rides/"): (2, 0.5),
+    ("GET", "/rides/budget_city_1/"): (2, 0.5),
+    ("GET", "/rides/all/budget_city_2"): (2, 0.5),
+    ("GET", "/rides/budget_city_1/budget_city_2"): (2, 0.5),
+    ("GET", "/rides/changes?since=0"): (2, 0.5),
+    # one more for the ride change log entry
+    ("POST", "/rides/{ride_id}/reserve"): (9, 0.5),
+}
+
+
+@pytest.mark.parametrize("method, url", BUDGETS)
+def test_endpoint_budget(client, query_budget, headers, ride, method, url):
+    statements, seconds = BUDGETS[(method, url)]
+    with query_budget(statements=statements, seconds=seconds, label=f"{method} {url}"):
+        response = client.request(method, url.format(ride_id=ride.id), headers=headers)
+    assert response.status_code == 200
+
+
+def test_login_budget(client, query_budget, headers):
+    """Trying:
+        post("/token")
+
+    Expecting:
+        a single user lookup and the refresh token insert, bcrypt within the wall time budget
+    """
+    with query_budget(statements=2, seconds=1, label="POST /token"):
+        response = client.post("/token", data={"username": "budget.admin@example.com", "password": "admin123"})
+    assert response.status_code == 200
+
+
+def test_query_budget_fails_when_exceeded(client, query_budget, headers):
+    with pytest.raises(AssertionError, match="ran 2 SQL statements, budget is 1"):
+        with query_budget(statements=1, label="GET /rides/"):
+            client.get("/rides/", headers=headers)
+
+
+# one conditional UPDATE on the target user, read back by a second SELECT where UPDATE ... RETURNING is unsupported (SQLite)
+UPDATE_STATEMENTS = 1 if engine_tests.dialect.full_returning else 2
+
+
+def test_create_user_budget(client, query_budget):
+    """Trying:
+        post("/users/") with a new login, then with the same login again
+
+    Expecting:
+        the login probe and a single INSERT, a taken login turned away by the probe alone
+    """
+    user = {"login": "budget.user@example.com", "first_name": "John", "last_name": "Tester",
+            "address": "Cyberworld", "is_admin": False, "hashed_password": "admin123"}
+    with query_budget(statements=2, seconds=1, label="POST /users/"):
+        response = client.post("/users/", json=user)
+    assert response.status_code == 200
+    with query_budget(statements=1, seconds=1, label="POST /users/ taken login"):
+        response = client.post("/users/", json=user)
+    assert response.status_code == 405
+    assert response.json() == {"detail": "Email already registered"}
+
+
+def test_activate_my_account_budget(client, query_budget, user_factory):
+    user, = user_factory(is_active=False, activation_code="budget-code")
+    with query_budget(statements=1, label="GET /users/{user_id}/activate/{activation_code}"):
+        response = client.get(f"/users/{user.id}/activate/budget-code")
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("action, fields", [
+    ("grant-adm", {}),
+    ("remove-adm", {"is_admin": True}),
+    ("activate", {"is_active": False}),
+    ("deactivate", {}),
+])
+def test_user_update_budget(client, query_budget, headers, user_factory, action, fields):
+    """Trying:
+        patch("/users/<username>/<action>") as an admin
+
+    Expecting:
+        the current user lookup and the conditional update of the target user,
+        deactivating also revokes the refresh tokens of the user
+    """
+    user, = user_factory(**fields)
+    revoke_statements = 1 if action == "deactivate" else 0
+    with query_budget(statements=1 + UPDATE_STATEMENTS + revoke_statements, label=f"PATCH /users/{{username}}/{action}"):
+        response = client.patch(f"/users/{user.login}/{action}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["login"] == user.login
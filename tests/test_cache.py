@@ -0,0 +1,164 @@
+import asyncio
+import time
+import pytest
+from app import crud
+from app.cache import CHANNEL, InvalidationListener, LocalCache, invalidator, ride_list_cache, user_cache
+from app.database import engine_tests
+from app.utils import Envs
+
+
+@pytest.fixture
+def caches():
+    """Test fixture enabling the caches, coherent as with a single process, and clearing them at the test end
+    """
+    previous_ttl = Envs.CACHE_TTL_SECONDS
+    Envs.CACHE_TTL_SECONDS = 60
+    invalidator.resync()
+    yield
+    invalidator.suspend()
+    Envs.CACHE_TTL_SECONDS = previous_ttl
+
+
+def test_local_cache_expiry_and_eviction():
+    cache = LocalCache("test", max_entries=2, ttl=0.05)
+    for key in ("a", "b", "c"):
+        cache.set(key, key.upper(), cache.generation)
+    assert cache.get("a") is None
+    assert cache.get("b") == "B"
+    time.sleep(0.06)
+    assert cache.get("b") is None
+
+
+def test_local_cache_skips_values_read_before_an_invalidation():
+    """Trying:
+        store a value read before an invalidation, then invalidate the matching entries only
+
+    Expecting:
+        the stale value not stored, the other entries kept
+    """
+    cache = LocalCache("test", max_entries=10, ttl=60)
+    generation = cache.generation
+    cache.invalidate()
+    cache.set("stale", 1, generation)
+    assert cache.get("stale") is None
+    for key in ("a", "b"):
+        cache.set(key, key, cache.generation)
+    assert cache.invalidate(lambda key, value: key == "a") == 1
+    assert cache.get("a") is None
+    assert cache.get("b") == "b"
+
+
+def test_current_user_cached_until_deactivated(caches, client, user_factory, auth_headers, query_budget):
+    """Trying:
+        get("/users/me/") twice, deactivate the user as an admin, then get("/users/me/") again
+
+    Expecting:
+        no statement for the second request, the deactivated user rejected right away
+    """
+    admin, = user_factory(is_admin=True)
+    user, = user_factory()
+    admin_headers = auth_headers(admin)
+    headers = auth_headers(user)
+    assert client.get("/users/me/", headers=headers).status_code == 200
+    with query_budget(statements=0, label="cached GET /users/me/"):
+        assert client.get("/users/me/", headers=headers).status_code == 200
+    assert client.patch(f"/users/{user.login}/deactivate", headers=admin_headers).status_code == 200
+    assert client.get("/users/me/", headers=headers).status_code == 401
+
+
+def test_cached_ride_list_follows_reservations(caches, client, user_factory, auth_headers, ride_factory):
+    user, = user_factory()
+    headers = auth_headers(user)
+    ride, = ride_factory(start_city="cache_1", destination_city="cache_2", seats=3)
+    url = "/rides/cache_1/cache_2"
+    assert client.get(url, headers=headers).json()[0]["seats_available"] == 3
+    assert client.post(f"/rides/{ride.id}/reserve", params={"seats": 2}, headers=headers).status_code == 200
+    assert client.get(url, headers=headers).json()[0]["seats_available"] == 1
+
+
+def test_cached_ride_list_follows_removed_user(caches, client, db, user_factory, auth_headers, ride_factory):
+    user, reader = user_factory(count=2)
+    headers = auth_headers(reader)
+    ride, = ride_factory(start_city="cache_3", destination_city="cache_4", seats=3)
+    url = "/rides/cache_3/cache_4"
+    assert client.post(f"/rides/{ride.id}/reserve", params={"seats": 2}, headers=auth_headers(user)).status_code == 200
+    assert client.get(url, headers=headers).json()[0]["seats_available"] == 1
+    crud.remove_user(db, user_id=user.id)
+    assert client.get(url, headers=headers).json()[0]["seats_available"] == 3
+
+
+def test_invalidations_applied_on_commit_only(caches, db):
+    """Trying:
+        queue invalidations of a route, then roll back; queue them again, then commit
+
+    Expecting:
+        the cached lists of the route, its start city and all rides dropped after the commit only,
+        the lists of other routes kept
+    """
+    keys = [("a", "b", None), ("a", None, None), (None, None, 0, 100), ("a", "c", None)]
+    for key in keys:
+        ride_list_cache.set(key, [], ride_list_cache.generation)
+    invalidator.invalidate(db, route=["a", "b"])
+    db.rollback()
+    assert all(ride_list_cache.get(key) is not None for key in keys)
+    invalidator.invalidate(db, route=["a", "b"])
+    db.commit()
+    assert [ride_list_cache.get(key) is not None for key in keys] == [False, False, False, True]
+
+
+def test_listener_applies_notifications(caches):
+    user_cache.set("cached@example.com", object(), user_cache.generation)
+    listener = InvalidationListener(engine_tests)
+    listener._apply(CHANNEL, '{"user":"cached@example.com"}')
+    listener._apply(CHANNEL, "not json")
+    assert user_cache.get("cached@example.com") is None
+
+
+def test_listener_suspends_caches_until_reconnected(caches, monkeypatch):
+    """Trying:
+        run the listener with a failing connection attempt, then a connection failing while listening
+
+    Expecting:
+        the caches cleared and bypassed after every failure, trusted again once connected, the failed connection closed
+    """
+    user_cache.set("cached@example.com", object(), user_cache.generation)
+    listener = InvalidationListener(engine_tests, reconnect_delay=0, max_reconnect_delay=0)
+    coherent, closed = [], []
+
+    class Connection:
+        def close(self):
+            closed.append(self)
+
+    outcomes = [OSError("connection refused"), Connection()]
+
+    def connect():
+        coherent.append(invalidator.coherent)
+        outcome = outcomes.pop(0) if outcomes else OSError("connection refused")
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def listen(connection):
+        coherent.append(invalidator.coherent)
+        raise OSError("server closed the connection")
+
+    monkeypatch.setattr(listener, "_connect", connect)
+    monkeypatch.setattr(listener, "_listen", listen)
+
+    async def drive():
+        listener.start()
+        while len(coherent) < 4:
+            await asyncio.sleep(0.01)
+        await listener.stop()
+    asyncio.run(drive())
+    assert coherent[:4] == [True, False, True, False]
+    assert len(closed) == 1
+    assert user_cache.get("cached@example.com") is None
+    assert not invalidator.coherent
+
+
+def test_caches_bypassed_while_suspended(caches, db, user_factory):
+    user, = user_factory()
+    invalidator.suspend()
+    assert crud.get_cached_user_by_login(db, user.login).login == user.login
+    assert not user_cache.entries
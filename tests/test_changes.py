@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+from app import changes, crud, models
+
+
+RIDE = {"start_city": "sync_1", "destination_city": "sync_2", "distance": 10, "km_fee": 1,
+        "departure_date": "2030-01-01 08:00", "seats": 3}
+
+
+def test_sync_after_cursor(client, user_factory, auth_headers, ride_factory):
+    """Trying:
+        take the current cursor, then create, reserve twice and delete rides, then get the changes after the cursor
+
+    Expecting:
+        a single change per ride with its current row, the deleted ride without it, and nothing after the next cursor
+    """
+    admin, = user_factory(is_admin=True)
+    headers = auth_headers(admin)
+    untouched, removed = ride_factory(2)
+    cursor = client.get("/rides/changes", headers=headers).json()["cursor"]
+    created = client.post("/rides/", headers=headers, json=RIDE).json()
+    for _ in range(2):
+        client.post(f"/rides/{created['id']}/reserve", headers=headers)
+    client.delete(f"/rides/{removed.id}/delete", headers=headers)
+
+    page = client.get("/rides/changes", params={"since": cursor}, headers=headers).json()
+    assert page["has_more"] is False
+    assert [(change["operation"], change["ride_id"]) for change in page["changes"]] == [("update", created["id"]),
+                                                                                      ("delete", removed.id)]
+    assert page["changes"][0]["ride"]["seats_available"] == 1
+    assert page["changes"][1]["ride"] is None
+    assert untouched.id not in {change["ride_id"] for change in page["changes"]}
+    assert client.get("/rides/changes", params={"since": page["cursor"]}, headers=headers).json()["changes"] == []
+
+
+def test_pages_hold_whole_transactions(db, ride_factory):
+    """Trying:
+        record a change of three rides in one statement and two single changes, read them two at a time
+
+    Expecting:
+        the three rides on a page of their own, then the single changes, pages joined by their cursors
+    """
+    rides = ride_factory(5)
+    since = changes.current_cursor(db)
+    changes.record(db, changes.UPDATE, models.Ride.id.in_([ride.id for ride in rides[:3]]))
+    for ride in rides[3:]:
+        changes.record(db, changes.UPDATE, models.Ride.id == ride.id)
+    db.commit()
+    first = changes.changes_since(db, since, limit=2)
+    assert [change["ride_id"] for change in first["changes"]] == [ride.id for ride in rides[:3]]
+    assert first["has_more"] is True
+    second = changes.changes_since(db, first["cursor"], limit=2)
+    assert [change["ride_id"] for change in second["changes"]] == [ride.id for ride in rides[3:]]
+    assert changes.changes_since(db, second["cursor"], limit=2)["changes"] == []
+
+
+def test_expired_rides_recorded(db, ride_factory):
+    ride, = ride_factory(departure_date=datetime.utcnow() - timedelta(hours=1))
+    since = changes.current_cursor(db)
+    assert crud.archivise_expired_rides(db, now=datetime.utcnow()) == 1
+    change, = changes.changes_since(db, since)["changes"]
+    assert (change["operation"], change["ride_id"], change["ride"]["is_active"]) == ("update", ride.id, False)
+
+
+def test_compaction(client, db, user_factory, auth_headers, ride_factory):
+    """Trying:
+        compact the log after changing a ride twice, then compact it with no retention
+
+    Expecting:
+        the superseded entry dropped, then a cursor older than the dropped entries rejected with 410
+        and the current cursor accepted
+    """
+    headers = auth_headers(user_factory()[0])
+    ride, = ride_factory()
+    since = changes.current_cursor(db)
+    for _ in range(2):
+        changes.record(db, changes.UPDATE, models.Ride.id == ride.id)
+    db.commit()
+    now = datetime.utcnow()
+    assert changes.compact(db, now=now, retention=timedelta(days=7)) == 1
+    assert len(changes.changes_since(db, since)["changes"]) == 1
+
+    changes.compact(db, now=now + timedelta(seconds=1), retention=timedelta(0))
+    assert client.get("/rides/changes", params={"since": since}, headers=headers).status_code == 410
+    cursor = client.get("/rides/changes", headers=headers).json()["cursor"]
+    assert client.get("/rides/changes", params={"since": cursor}, headers=headers).json()["changes"] == []
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import threading
+import pytest
+from sqlalchemy.orm import Session
+from app import crud, schemas
+from app.cache import InvalidationListener
+from app.database import Base
+from app.metrics import metrics
+from app.feed import KEEPALIVE, LAGGED, RideFeed, ride_feed
+
+
+RIDE = {"id": 1, "start_city": "city_1", "destination_city": "city_2", "seats_available": 3}
+
+
+def parse(frame: bytes) -> tuple[str, dict]:
+    event, data = frame.decode().strip().split("\n")
+    return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+def test_publish_fans_out_by_route():
+    """Trying:
+        publish a ride change to subscribers of its route, its cities, all rides and another route
+
+    Expecting:
+        a single copy of the event for every matching subscriber, none for the other route
+    """
+    async def main():
+        feed = RideFeed(buffer_size=10)
+        matching = [feed.subscribe("city_1", "city_2"), feed.subscribe("city_1"),
+                    feed.subscribe(destination_city="city_2"), feed.subscribe()]
+        other = feed.subscribe("city_1", "city_3")
+        feed.publish("reserve", RIDE)
+        assert [subscriber.queue.qsize() for subscriber in matching] == [1, 1, 1, 1]
+        assert other.queue.empty()
+        assert parse(matching[0].queue.get_nowait()) == ("reserve", RIDE)
+    asyncio.run(main())
+
+
+def test_slow_subscriber_gets_lagged():
+    async def main():
+        feed = RideFeed(buffer_size=2)
+        slow = feed.subscribe()
+        for _ in range(3):
+            feed.publish("create", RIDE)
+        assert slow.queue.qsize() == 1
+        assert slow.queue.get_nowait() == LAGGED
+    asyncio.run(main())
+
+
+def test_publish_from_another_thread():
+    async def main():
+        feed = RideFeed()
+        subscriber = feed.subscribe()
+        thread = threading.Thread(target=feed.publish, args=("delete", RIDE))
+        thread.start()
+        thread.join()
+        assert parse(await asyncio.wait_for(subscriber.queue.get(), 1)) == ("delete", RIDE)
+    asyncio.run(main())
+
+
+def test_stream_keepalive_and_unsubscribe():
+    """Trying:
+        stream a subscription with no events, then close the stream
+
+    Expecting:
+        the subscribed event, keepalive comments in the silence and the subscription ended with the stream
+    """
+    async def main():
+        feed = RideFeed(heartbeat=0.01)
+        subscriber = feed.subscribe("city_1")
+        stream = feed.stream(subscriber)
+        assert parse(await anext(stream)) == ("subscribed", {"start_city": "city_1", "destination_city": None})
+        assert await anext(stream) == KEEPALIVE
+        await stream.aclose()
+        assert not feed.active
+    asyncio.run(main())
+
+
+def test_ride_mutations_publish(client, user_factory, auth_headers):
+    """Trying:
+        create, reserve, archivise and delete a ride through the API while subscribed to its route
+
+    Expecting:
+        the events in order, with the seats left after the reservation
+    """
+    admin, = user_factory(is_admin=True)
+    headers = auth_headers(admin)
+
+    def mutate():
+        ride = client.post("/rides/", headers=headers, json={"start_city": "feed_1", "destination_city": "feed_2",
+                                                             "distance": 10, "km_fee": 1, "departure_date": "2030-01-01 08:00",
+                                                             "seats": 3}).json()
+        client.post(f"/rides/{ride['id']}/reserve", params={"seats": 2}, headers=headers)
+        client.patch(f"/rides/{ride['id']}/archivise", headers=headers)
+        client.delete(f"/rides/{ride['id']}/delete", headers=headers)
+
+    async def main():
+        subscriber = ride_feed.subscribe("feed_1", "feed_2")
+        try:
+            await asyncio.to_thread(mutate)
+            return [parse(await asyncio.wait_for(subscriber.queue.get(), 1)) for _ in range(4)]
+        finally:
+            ride_feed.unsubscribe(subscriber)
+
+    events = asyncio.run(main())
+    assert [event for event, _ in events] == ["create", "reserve", "archive", "delete"]
+    assert events[1][1]["seats_available"] == 1
+    assert events[2][1]["is_active"] is False
+
+
+def test_shared_feed_delivers_notified_events():
+    """Trying:
+        publish to a shared feed, receive a notified event, then mark the subscribers lagged
+
+    Expecting:
+        the published change left to the notification, the received event delivered, then the lagged event
+    """
+    async def main():
+        feed = RideFeed(buffer_size=10)
+        feed.shared = True
+        subscriber = feed.subscribe()
+        assert not feed.publishing
+        feed.publish("create", RIDE)
+        assert subscriber.queue.empty()
+        feed.receive(json.dumps({"event": "reserve", "ride": RIDE}))
+        assert parse(subscriber.queue.get_nowait()) == ("reserve", RIDE)
+        feed.publish("create", RIDE)
+        feed.lagged()
+        assert subscriber.queue.get_nowait() == LAGGED
+    asyncio.run(main())
+
+
+def test_remove_user_publishes_seats_given_back(db, user_factory, ride_factory):
+    user, = user_factory()
+    ride, = ride_factory(start_city="feed_3", destination_city="feed_4", seats=2)
+    assert crud.reserve_ride(db, ride_id=ride.id, user_id=user.id, seats=2) is not None
+
+    async def main():
+        subscriber = ride_feed.subscribe("feed_3", "feed_4")
+        try:
+            await asyncio.to_thread(crud.remove_user, db, user.id)
+            return parse(await asyncio.wait_for(subscriber.queue.get(), 1))
+        finally:
+            ride_feed.unsubscribe(subscriber)
+
+    event, data = asyncio.run(main())
+    assert event == "update"
+    assert (data["id"], data["seats_available"], data["is_active"]) == (ride.id, 2, True)
+
+
+@pytest.mark.postgres
+def test_shared_feed_delivers_other_workers_changes(postgres_engine):
+    """Trying:
+        create a ride through a session of its own while subscribed to a shared feed with its listener running
+
+    Expecting:
+        the create event delivered by the listener, as for a change made through another worker
+    """
+    Base.metadata.create_all(bind=postgres_engine)
+
+    def create():
+        with Session(postgres_engine) as db:
+            return crud.create_ride(db, schemas.RideCreate(start_city="feed_5", destination_city="feed_6", distance=10,
+                                                           km_fee=1, departure_date="2030-01-01 08:00", seats=3)).id
+
+    async def main():
+        connects = metrics.get("cache.listener.connects")
+        listener = InvalidationListener(postgres_engine)
+        listener.start()
+        ride_feed.shared = True
+        subscriber = ride_feed.subscribe("feed_5", "feed_6")
+        try:
+            while metrics.get("cache.listener.connects") == connects:
+                await asyncio.sleep(0.01)
+            ride_id = await asyncio.to_thread(create)
+            return ride_id, parse(await asyncio.wait_for(subscriber.queue.get(), 5))
+        finally:
+            ride_feed.unsubscribe(subscriber)
+            ride_feed.shared = False
+            await listener.stop()
+
+    ride_id, (event, data) = asyncio.run(main())
+    assert event == "create"
+    assert (data["id"], data["seats_available"], data["is_active"]) == (ride_id, 3, True)
+
+
+def test_feed_not_authenticated(client):
+    assert client.get("/rides/feed").status_code == 401
@@ -0,0 +1,136 @@
+import asyncio
+import warnings
+import httpx
+from fastapi.encoders import jsonable_encoder
+from datetime import datetime, timedelta
+from app.main import app
+from app import schemas, models
+from app.database import Base
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from starlette.responses import JSONResponse
+from app.idempotency import IdempotencyGuard, idempotency_store, request_fingerprint
+from app.utils import Envs
+
+
+ADMIN = schemas.CreateUser(login="idempotent.admin@example.com", first_name="Ida", last_name="Tester", address="Cyberworld",
+                           is_admin=True, hashed_password="admin123")
+
+
+def test_create_user_replayed(client, db):
+    """Trying:
+        post("/users/") twice with the same Idempotency-Key
+
+    Expecting:
+        the same response twice, the second one marked as a replay, and one account created
+    """
+    headers = {"Idempotency-Key": "signup-1"}
+    first = client.post("/users/", json=jsonable_encoder(ADMIN), headers=headers)
+    second = client.post("/users/", json=jsonable_encoder(ADMIN), headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert db.query(models.User).filter(models.User.login == ADMIN.login).count() == 1
+
+
+def test_create_user_key_reused_for_another_payload(client):
+    assert client.post("/users/", json=jsonable_encoder(ADMIN), headers={"Idempotency-Key": "signup-1"}).status_code == 200
+    other = ADMIN.model_copy(update={"first_name": "Other"})
+    response = client.post("/users/", json=jsonable_encoder(other), headers={"Idempotency-Key": "signup-1"})
+    assert response.status_code == 422
+    assert response.json() == {"detail": "Idempotency-Key has already been used with a different request."}
+
+
+def test_create_user_key_scoped_by_login(client):
+    assert client.post("/users/", json=jsonable_encoder(ADMIN), headers={"Idempotency-Key": "signup-1"}).status_code == 200
+    other = ADMIN.model_copy(update={"login": "other.admin@example.com"})
+    response = client.post("/users/", json=jsonable_encoder(other), headers={"Idempotency-Key": "signup-1"})
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+
+
+def test_abandoned_claim_taken_over_after_its_lease(client, db):
+    """Trying:
+        post("/users/") with the key of a claim left in progress by a dead worker, before and after its lease expired
+
+    Expecting:
+        409 while the lease holds, then the request done and its response kept for the full TTL
+    """
+    digest = idempotency_store.digest(f"POST /users/ login={ADMIN.login}", "signup-1")
+    now = datetime.utcnow()
+    db.add(models.IdempotencyKey(key=digest, fingerprint=request_fingerprint(ADMIN.model_dump(exclude={"hashed_password"})), created_at=now, expires_at=now + timedelta(seconds=30)))
+    db.commit()
+    previous_wait, Envs.IDEMPOTENCY_WAIT_SECONDS = Envs.IDEMPOTENCY_WAIT_SECONDS, 0.1
+    try:
+        assert client.post("/users/", json=jsonable_encoder(ADMIN), headers={"Idempotency-Key": "signup-1"}).status_code == 409
+        db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == digest) \
+            .update({models.IdempotencyKey.expires_at: now - timedelta(seconds=1)})
+        db.commit()
+        assert client.post("/users/", json=jsonable_encoder(ADMIN), headers={"Idempotency-Key": "signup-1"}).status_code == 200
+    finally:
+        Envs.IDEMPOTENCY_WAIT_SECONDS = previous_wait
+    stored = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == digest).one()
+    assert stored.status_code == 200
+    assert stored.expires_at > datetime.utcnow() + timedelta(hours=1)
+
+
+def test_claim_lease_taken_over_and_renewed(tmp_path):
+    """Trying:
+        claim a key whose expired row is loaded in the session, renew the claim, then renew it after completion
+
+    Expecting:
+        the claim taken without a session conflict, its lease extended while in progress only
+    """
+    # the lease is renewed in a session of its own, which the rolled back test transaction can't host
+    engine = create_engine(f"sqlite:///{tmp_path / 'idempotency.db'}")
+    Base.metadata.create_all(bind=engine)
+    digest = idempotency_store.digest("test", "lease-1")
+    past = datetime.utcnow() - timedelta(minutes=1)
+    with Session(engine) as db:
+        db.add(models.IdempotencyKey(key=digest, fingerprint="", created_at=past, expires_at=past))
+        db.commit()
+        assert db.get(models.IdempotencyKey, digest) is not None
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            claimed_at, stored = idempotency_store._claim(db, digest, "")
+        assert claimed_at is not None and stored is None
+        guard = IdempotencyGuard(digest, "", claimed_at=claimed_at)
+        assert idempotency_store._renew(engine, guard)
+        expires_at = db.query(models.IdempotencyKey.expires_at).filter(models.IdempotencyKey.key == digest).scalar()
+        assert expires_at > datetime.utcnow() + idempotency_store.lease() - timedelta(seconds=5)
+        guard.save(JSONResponse({"done": True}))
+        idempotency_store._complete(db, guard)
+        assert not idempotency_store._renew(engine, guard)
+    engine.dispose()
+
+
+def test_create_user_without_key_not_replayed(client):
+    assert client.post("/users/", json=jsonable_encoder(ADMIN), headers={"Idempotency-Key": "signup-1"}).status_code == 200
+    response = client.post("/users/", json=jsonable_encoder(ADMIN))
+    assert response.status_code == 405
+    assert response.json() == {"detail": "Email already registered"}
+
+
+def test_reserve_ride_concurrent_duplicates(client, user_factory, auth_headers):
+    """Trying:
+        five concurrent post("/rides/<id>/reserve") with the same Idempotency-Key, then a sequential retry
+
+    Expecting:
+        all of them succeed with the same booking and only one seat is taken
+    """
+    headers = auth_headers(user_factory(login=ADMIN.login, is_admin=True)[0])
+    ride = schemas.RideCreate(start_city="Kraków", destination_city="Gdańsk", distance=600, km_fee=0.1,
+                              departure_date="2030-01-01 08:00", seats=3)
+    ride_id = client.post("/rides/", json=jsonable_encoder(ride), headers=headers).json()["id"]
+    headers["Idempotency-Key"] = "reserve-1"
+
+    async def reserve_concurrently() -> list[httpx.Response]:
+        async with httpx.AsyncClient(app=app, base_url="http://test") as async_client:
+            return await asyncio.gather(*(async_client.post(f"/rides/{ride_id}/reserve", headers=headers) for _ in range(5)))
+
+    responses = asyncio.run(reserve_concurrently())
+    responses.append(client.post(f"/rides/{ride_id}/reserve", headers=headers))
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.json()["booking_id"] for response in responses}) == 1
+    assert client.get(f"/rides/Kraków/Gdańsk", headers=headers).json()[0]["seats_available"] == 2
+
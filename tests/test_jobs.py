@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app import crud, models
+from app.database import Base
+from app.jobs import RideExpiryJob
+
+
+@pytest.fixture()
+def job_sessions(tmp_path):
+    """Test fixture yielding a session maker bound to a file database, shared by the job threads
+
+    Yields:
+        sessionmaker: session maker
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def create_rides(sessions, departed: int, upcoming: int):
+    """Inserts departed and upcoming active rides
+    """
+    now = datetime.utcnow()
+    with sessions() as db:
+        dates = [now - timedelta(hours=i + 1) for i in range(departed)] + [now + timedelta(hours=i + 1) for i in range(upcoming)]
+        db.add_all(models.Ride(start_city="Kraków", destination_city="Gdańsk", distance=600, km_fee=0.1, price=60,
+                               departure_date=date, is_active=True, seats=1, seats_available=1) for date in dates)
+        db.commit()
+
+
+def active_rides(sessions) -> int:
+    with sessions() as db:
+        return db.query(models.Ride).filter(models.Ride.is_active == True).count()
+
+
+def test_archivise_expired_rides_batch(job_sessions):
+    create_rides(job_sessions, departed=5, upcoming=3)
+    with job_sessions() as db:
+        assert crud.archivise_expired_rides(db, now=datetime.utcnow(), batch_size=2) == 2
+    assert active_rides(job_sessions) == 6
+
+
+def test_ride_expiry_job_run_once(job_sessions):
+    create_rides(job_sessions, departed=7, upcoming=3)
+    job = RideExpiryJob(job_sessions, batch_size=3, pause=0)
+    assert asyncio.run(job.run_once()) == 7
+    assert active_rides(job_sessions) == 3
+    assert asyncio.run(job.run_once()) == 0
+
+
+class FakeLockConnection:
+    """Connection to a fake PostgreSQL granting the advisory lock, until it is killed
+    """
+    def __init__(self):
+        self.alive = True
+        self.invalidated = False
+
+    def execution_options(self, **options):
+        return self
+
+    def execute(self, statement, parameters=None):
+        if not self.alive:
+            raise OperationalError(str(statement), parameters, Exception("server closed the connection unexpectedly"))
+        return SimpleNamespace(scalar=lambda: True)
+
+    def invalidate(self):
+        self.invalidated = True
+
+
+def test_leader_takes_the_lock_again_after_losing_its_connection():
+    """Trying:
+        lead, kill the lock connection, then lead again
+
+    Expecting:
+        the dead connection dropped and the lock taken on a new connection
+    """
+    connections = []
+
+    def connect():
+        connections.append(FakeLockConnection())
+        return connections[-1]
+
+    bind = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"), connect=connect)
+    job = RideExpiryJob(sessionmaker(bind=bind))
+    assert job._try_lead()
+    assert job._try_lead()
+    assert len(connections) == 1
+    connections[0].alive = False
+    assert job._try_lead()
+    assert connections[0].invalidated
+    assert len(connections) == 2 and job._lock_connection is connections[1]
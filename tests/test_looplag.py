@@ -0,0 +1,72 @@
+import asyncio
+import time
+import httpx
+from fastapi import FastAPI
+from app.looplag import LoopLagMiddleware, LoopLagMonitor
+from app.metrics import metrics
+from app.utils import SecurityUtils
+
+
+def serve(monitor: LoopLagMonitor, path: str) -> int:
+    app = FastAPI()
+
+    @app.get("/sleep/{seconds}")
+    async def blocking_sleep(seconds: float):
+        time.sleep(seconds)
+        return {}
+
+    @app.get("/hash")
+    async def blocking_hash():
+        SecurityUtils.get_password_hash("password")
+        return {}
+
+    app.add_middleware(LoopLagMiddleware, monitor=monitor)
+
+    async def request():
+        monitor.start()
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                response = await client.get(path)
+            await asyncio.sleep(monitor.interval * 2)
+        finally:
+            await monitor.stop()
+        return response.status_code
+
+    return asyncio.run(request())
+
+
+def test_stall_is_tagged_with_route_and_blocking_frame():
+    monitor = LoopLagMonitor(interval=0.02, threshold=0.05)
+    stalls = metrics.get("loop.lag.stalls")
+    assert serve(monitor, "/sleep/0.3") == 200
+    assert len(monitor.stalls) == 1
+    stall = monitor.stalls[0]
+    assert stall.route == "GET /sleep/{seconds}"
+    assert stall.location == "tests.test_looplag:serve.<locals>.blocking_sleep"
+    assert stall.blocked_ms >= 50
+    assert "time.sleep(seconds)" in stall.stack[-1]
+    assert metrics.get("loop.lag.stalls") == stalls + 1
+    assert metrics.get("loop.lag.max_ms") >= 250
+
+
+def test_stall_is_blamed_on_the_innermost_app_frame():
+    monitor = LoopLagMonitor(interval=0.005, threshold=0.01)
+    SecurityUtils.get_password_hash("warm up")
+    assert serve(monitor, "/hash") == 200
+    assert [stall.location for stall in monitor.stalls] == ["app.utils:SecurityUtils.get_password_hash"]
+    assert monitor.stalls[0].route == "GET /hash"
+
+
+def test_no_stalls_without_blocking_calls():
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.1)
+    assert serve(monitor, "/sleep/0") == 200
+    assert list(monitor.stalls) == []
+
+
+def test_view_loop_lag_is_admin_only(client, user_factory, auth_headers):
+    admin, = user_factory(is_admin=True)
+    user, = user_factory()
+    response = client.get("/ops/loop-lag", headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert set(response.json()) == {"interval_s", "threshold_s", "stalls"}
+    assert client.get("/ops/loop-lag", headers=auth_headers(user)).status_code == 401
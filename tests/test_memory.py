@@ -0,0 +1,67 @@
+import pytest
+from app.memory import MemoryTracker, main
+from app.utils import MemoryGroup
+
+
+@pytest.fixture
+def tracker():
+    tracker = MemoryTracker(max_snapshots=2)
+    tracker.start()
+    yield tracker
+    tracker.stop()
+
+
+def test_diff_groups_allocations_by_module(tracker):
+    base = tracker.take()
+    retained = [bytearray(1024) for _ in range(1000)]
+    current = tracker.take()
+    diff = tracker.diff(base, current, MemoryGroup.module)
+    assert diff[0]["group"] == "tests.test_memory"
+    assert diff[0]["size_diff_kib"] >= 1000
+    assert diff[0]["count_diff"] >= 1000
+    line = tracker.diff(base, current, MemoryGroup.line, limit=1)[0]["group"]
+    assert line.startswith("tests.test_memory:")
+    assert tracker.top(current, MemoryGroup.package, limit=3)
+    del retained
+
+
+def test_oldest_snapshots_are_dropped(tracker):
+    first = tracker.take()
+    tracker.take()
+    tracker.take()
+    assert first not in tracker.snapshots
+    with pytest.raises(KeyError):
+        tracker.top(first)
+
+
+def test_snapshot_needs_tracing():
+    with pytest.raises(RuntimeError):
+        MemoryTracker().take()
+
+
+def test_memory_endpoints(client, user_factory, ride_factory, auth_headers):
+    admin, = user_factory(is_admin=True)
+    user, = user_factory()
+    headers = auth_headers(admin)
+    assert client.post("/ops/memory/start", headers=auth_headers(user)).status_code == 401
+    assert client.post("/ops/memory/snapshots", headers=headers).status_code == 400
+    try:
+        assert client.post("/ops/memory/start", headers=headers).json()["tracing"] is True
+        base = client.post("/ops/memory/snapshots", headers=headers).json()
+        assert base["top"] and {"group", "size_kib", "count"} == set(base["top"][0])
+        ride_factory(50)
+        assert client.get("/rides/", headers=headers).status_code == 200
+        response = client.get("/ops/memory/diff", params={"base": base["id"], "group_by": "module"}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["current"] == base["id"] + 1
+        assert {"group", "size_kib", "size_diff_kib", "count", "count_diff"} == set(response.json()["diff"][0])
+        view = client.get(f"/ops/memory/snapshots/{base['id']}", params={"group_by": "line", "limit": 5}, headers=headers)
+        assert len(view.json()["top"]) == 5
+        assert client.get("/ops/memory/snapshots/999", headers=headers).status_code == 404
+    finally:
+        assert client.post("/ops/memory/stop", headers=headers).json()["tracing"] is False
+
+
+def test_cli_requires_a_command():
+    with pytest.raises(SystemExit):
+        main(["--token", "secret"])
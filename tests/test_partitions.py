@@ -0,0 +1,56 @@
+from datetime import date, datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from app import crud, migrate, models, partitions, schemas
+
+
+def test_month_start():
+    assert partitions.month_start(date(2023, 9, 23)) == date(2023, 9, 1)
+    assert partitions.month_start(date(2023, 12, 31), 1) == date(2024, 1, 1)
+    assert partitions.month_start(date(2023, 1, 15), -13) == date(2021, 12, 1)
+
+
+def test_archive_partition_name():
+    assert partitions.archive_partition_name(date(2023, 9, 23)) == "rides_archive_2023_09"
+
+
+def test_migration_statements():
+    statements = partitions.migration_statements()
+    copy = statements.index("INSERT INTO rides SELECT * FROM rides_legacy")
+    drop = statements.index("DROP TABLE rides_legacy")
+    primary_key = next(i for i, statement in enumerate(statements) if "PRIMARY KEY" in statement)
+    indexes = [i for i, statement in enumerate(statements) if statement.startswith("CREATE INDEX")]
+    assert statements.index("ALTER SEQUENCE rides_id_seq OWNED BY NONE") < drop
+    assert copy < drop < primary_key < min(indexes)
+    assert any("ix_rides_route_departure" in statements[i] for i in indexes)
+
+
+def test_migrate_not_postgres():
+    assert partitions.migrate(create_engine("sqlite://")) == False
+
+
+@pytest.mark.postgres
+def test_migrate_and_archive_across_partitions(postgres_engine):
+    """Trying:
+        migrate a fresh PostgreSQL schema with the rides partitioned, book and archivise a ride, then migrate again
+
+    Expecting:
+        the ride moved from rides_active to the archive partition of its month with its booking kept,
+        and no table nor foreign key left to migrate
+    """
+    assert "partitioned table rides" in migrate.migrate(postgres_engine, partition_rides=True)
+    departure = datetime.utcnow() + timedelta(days=1)
+    with sessionmaker(bind=postgres_engine)() as db:
+        user = models.User(login="partitioned@example.com", is_active=True, is_admin=False)
+        db.add(user)
+        db.commit()
+        ride = crud.create_ride(db, schemas.RideCreate(start_city="Kraków", destination_city="Gdańsk", distance=600,
+                                                       km_fee=0.1, departure_date=departure, seats=2))
+        partition = text("SELECT tableoid::regclass::text FROM rides WHERE id = :id")
+        assert db.execute(partition, {"id": ride.id}).scalar() == "rides_active"
+        assert crud.reserve_ride(db, ride_id=ride.id, user_id=user.id, seats=1) is not None
+        crud.archivise_ride(db, ride.id)
+        assert db.execute(partition, {"id": ride.id}).scalar() == partitions.archive_partition_name(departure)
+        assert db.query(models.Booking).filter(models.Booking.ride_id == ride.id).count() == 1
+    assert not [change for change in migrate.migrate(postgres_engine) if "foreign key" in change or "table" in change]
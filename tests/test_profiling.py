@@ -0,0 +1,69 @@
+import io
+import marshal
+import pstats
+from app.profiling import categorize
+
+
+def test_categorize_by_innermost_known_frame():
+    stack = ("asyncio.runners:run", "app.routers.rides:get_all_rides", "app.crud:get_all_rides",
+             "sqlalchemy.orm.query:Query.all", "sqlalchemy.engine.default:DefaultDialect.do_execute")
+    assert categorize(stack) == "sql"
+    assert categorize(stack[:3]) == "crud"
+    assert categorize(("app.routers.rides:get_all_rides", "app.utils:RowsResponse.render", "json:dumps")) == "serialization"
+    assert categorize(("app.routers.users:create_user", "app.utils:EmailUtils.send")) == "email"
+    assert categorize(("starlette.routing:Router.__call__",)) == "other"
+
+
+def test_requests_without_the_flag_are_not_profiled(client, user_factory, auth_headers, ride_factory):
+    user, = user_factory()
+    ride_factory(3)
+    response = client.get("/rides/", headers=auth_headers(user))
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+    assert "X-Profile-Status" not in response.headers
+
+
+def test_profiling_is_admin_only(client, user_factory, auth_headers):
+    user, = user_factory()
+    assert client.get("/rides/", headers={**auth_headers(user), "X-Profile": "summary"}).status_code == 401
+    assert client.get("/rides/?profile=summary").status_code == 401
+
+
+def test_profile_summary(client, user_factory, auth_headers, ride_factory):
+    admin, = user_factory(is_admin=True)
+    ride_factory(200)
+    response = client.get("/rides/?profile=summary", headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert response.headers["X-Profile-Status"] == "200"
+    summary = response.json()
+    assert summary["path"] == "/rides/"
+    assert summary["status"] == 200
+    assert set(summary) == {"path", "status", "wall_ms", "samples", "breakdown_ms", "top_functions_ms"}
+    assert sum(summary["breakdown_ms"].values()) <= summary["wall_ms"] + 1
+
+
+def test_profile_collapsed_stacks(client, user_factory, auth_headers, ride_factory):
+    admin, = user_factory(is_admin=True)
+    ride_factory(200)
+    response = client.get("/rides/", headers={**auth_headers(admin), "X-Profile": "collapsed"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0 and ":" in stack
+
+
+def test_profile_pstats(client, user_factory, auth_headers):
+    admin, = user_factory(is_admin=True)
+    response = client.get("/rides/", headers={**auth_headers(admin), "X-Profile": "pstats"})
+    assert response.status_code == 200
+    stats = pstats.Stats()
+    stats.stats = marshal.loads(response.content)
+    stats.stream = io.StringIO()
+    stats.print_stats("crud.py")
+    assert "get_all_rides" in stats.stream.getvalue()
+
+
+def test_unknown_profile_format(client, user_factory, auth_headers):
+    admin, = user_factory(is_admin=True)
+    assert client.get("/rides/", headers={**auth_headers(admin), "X-Profile": "flame"}).status_code == 400
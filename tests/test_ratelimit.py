@@ -0,0 +1,103 @@
+import time
+import pytest
+from app.main import app
+from app.dependencies import get_login_limiter
+from app.metrics import metrics
+from app.ratelimit import InMemoryBackend, Limit, LoginRateLimiter, RateLimitBackend
+from tests.conftest import unlimited_login_limiter
+
+
+@pytest.fixture()
+def strict_limiter():
+    """Test fixture replacing the login rate limiter with a strict one for a single test
+
+    Yields:
+        LoginRateLimiter: limiter allowing 3 attempts per client IP and 2 per login
+    """
+    limiter = LoginRateLimiter(ip_limit=Limit(3, 1), login_limit=Limit(2, 1), max_concurrent=4)
+    app.dependency_overrides[get_login_limiter] = lambda: limiter
+    yield limiter
+    app.dependency_overrides[get_login_limiter] = lambda: unlimited_login_limiter
+
+
+def test_token_bucket_refill(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    backend, limit = InMemoryBackend(), Limit(2, 60)
+    assert backend.take("key", limit) == 0
+    assert backend.take("key", limit) == 0
+    assert backend.take("key", limit) == pytest.approx(1)
+    now[0] += 0.5
+    assert backend.take("key", limit) == pytest.approx(0.5)
+    now[0] += 0.5
+    assert backend.take("key", limit) == 0
+
+
+def test_backend_must_implement_take():
+    class Incomplete(RateLimitBackend):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
+    assert not InMemoryBackend.blocking
+
+
+def test_in_memory_backend_bounded(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    backend, limit = InMemoryBackend(max_buckets=10), Limit(1, 60)
+    for i in range(25):
+        backend.take(f"key-{i}", limit)
+        now[0] += 0.1
+    assert len(backend._buckets) <= 10
+
+
+def test_in_memory_backend_keeps_active_buckets(monkeypatch):
+    """Trying:
+        keep retrying a drained key while spraying new keys well beyond the bucket limit
+
+    Expecting:
+        the retried key throttled throughout, the other buckets evicted oldest first
+    """
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    backend, ip_limit, login_limit = InMemoryBackend(max_buckets=3), Limit(1, 1), Limit(5, 600)
+    assert backend.take("ip", ip_limit) == 0
+    for i in range(20):
+        now[0] += 0.1
+        backend.take(f"login-{i}", login_limit)
+        assert backend.take("ip", ip_limit) > 0
+    assert list(backend._buckets) == ["login-18", "login-19", "ip"]
+
+
+def test_login_limited_per_login(client, strict_limiter):
+    """Trying:
+        post("/token") three times with the same unknown login
+
+    Expecting:
+        two regular 401 responses, then 429 with Retry-After header and a counted rejection
+    """
+    rejected = metrics.get("login.rejected.login")
+    credentials = {"username": "stuffed@example.com", "password": "guess"}
+    assert client.post("/token", data=credentials).status_code == 401
+    assert client.post("/token", data=credentials).status_code == 401
+    response = client.post("/token", data=credentials)
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Too many login attempts. Try again later."}
+    assert int(response.headers["Retry-After"]) >= 1
+    assert metrics.get("login.rejected.login") == rejected + 1
+
+
+def test_login_limited_per_ip(client, strict_limiter):
+    rejected = metrics.get("login.rejected.ip")
+    for i in range(3):
+        assert client.post("/token", data={"username": f"user-{i}@example.com", "password": "guess"}).status_code == 401
+    response = client.post("/token", data={"username": "user-3@example.com", "password": "guess"})
+    assert response.status_code == 429
+    assert metrics.get("login.rejected.ip") == rejected + 1
+
+
+def test_login_shed_when_saturated(client, strict_limiter):
+    strict_limiter._in_flight = strict_limiter.max_concurrent
+    response = client.post("/token", data={"username": "busy@example.com", "password": "guess"})
+    strict_limiter._in_flight = 0
+    assert response.status_code == 503
@@ -0,0 +1,75 @@
+import pytest
+from app import crud, models
+from app.utils import SecurityUtils
+
+
+LOGIN = "refreshing.admin@example.com"
+
+
+@pytest.fixture(autouse=True)
+def admin(user_factory):
+    """Test fixture inserting the admin who logs in
+    """
+    return user_factory(login=LOGIN, is_admin=True)[0]
+
+
+def test_login_issues_refresh_token(client):
+    response = client.post("/token", data={"username": LOGIN, "password": "admin123"})
+    assert response.status_code == 200
+    assert response.json()["refresh_token"]
+
+
+def test_refresh_access_token_without_bcrypt(client, monkeypatch):
+    """Trying:
+        post("/token/refresh") with the refresh token got at login
+
+    Expecting:
+        new working access token and a rotated refresh token, without any password verification
+    """
+    refresh_token = client.post("/token", data={"username": LOGIN, "password": "admin123"}).json()["refresh_token"]
+
+    def no_bcrypt(*args):
+        raise AssertionError("password verified on refresh")
+
+    monkeypatch.setattr(SecurityUtils, "verify_password", no_bcrypt)
+    response = client.post("/token/refresh", data={"refresh_token": refresh_token})
+    assert response.status_code == 200
+    assert response.json()["refresh_token"] != refresh_token
+    me = client.get("/users/me/", headers={"Authorization": f"Bearer {response.json()['access_token']}"})
+    assert me.json()["login"] == LOGIN
+
+
+def test_refresh_token_reuse_revokes_family(client):
+    first = client.post("/token", data={"username": LOGIN, "password": "admin123"}).json()["refresh_token"]
+    second = client.post("/token/refresh", data={"refresh_token": first}).json()["refresh_token"]
+    reused = client.post("/token/refresh", data={"refresh_token": first})
+    assert reused.status_code == 401
+    assert reused.json() == {"detail": "Invalid refresh token"}
+    assert client.post("/token/refresh", data={"refresh_token": second}).status_code == 401
+
+
+def test_deactivated_user_cannot_refresh(client, db):
+    first = client.post("/token", data={"username": LOGIN, "password": "admin123"}).json()["refresh_token"]
+    second = client.post("/token", data={"username": LOGIN, "password": "admin123"}).json()["refresh_token"]
+    assert crud.deactivate_user(db, LOGIN) is not None
+    assert db.query(models.RefreshToken).filter(models.RefreshToken.revoked_at == None).count() == 0
+    for refresh_token in (first, second):
+        assert client.post("/token/refresh", data={"refresh_token": refresh_token}).status_code == 401
+
+
+def test_inactive_user_cannot_refresh(client, db, admin):
+    refresh_token = client.post("/token", data={"username": LOGIN, "password": "admin123"}).json()["refresh_token"]
+    # deactivated behind the back of deactivate_user, leaving the refresh token unrevoked
+    db.query(models.User).filter(models.User.id == admin.id).update({models.User.is_active: False})
+    db.commit()
+    assert client.post("/token/refresh", data={"refresh_token": refresh_token}).status_code == 401
+
+
+def test_refresh_invalid_token(client):
+    response = client.post("/token/refresh", data={"refresh_token": "made-up"})
+    assert response.status_code == 401
+
+
+def test_delete_refreshing_admin(client):
+    token = client.post("/token", data={"username": LOGIN, "password": "admin123"}).json()["access_token"]
+    assert client.delete("/users/me/delete", headers={"Authorization": f"Bearer {token}"}).status_code == 200
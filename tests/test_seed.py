@@ -0,0 +1,79 @@
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from app import analytics, changes, models
+from app.migrate import migrate
+from app.seed import CITIES, DEFAULT_PASSWORD, build_routes, seed, truncate
+from app.utils import SecurityUtils
+
+
+def test_build_routes_limits_outgoing_routes():
+    routes = build_routes(CITIES, routes_per_city=3)
+    assert len(routes) == 3 * len(CITIES)
+    assert all(route.start_city != route.destination_city and route.distance > 0 for route in routes)
+    assert {route.destination_city for route in routes if route.start_city == "gdansk"} >= {"gdynia"}
+
+
+def test_seed_inserts_consistent_data(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'seed.db'}")
+    migrate(engine)
+    summary = seed(engine, users=20, rides=3000, booked_ratio=0.5, batch_size=700)
+    assert (summary["users"], summary["rides"]) == (20, 3000)
+    now = datetime.utcnow()
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM rides")).scalar() == 3000
+        assert connection.execute(text("SELECT COUNT(*) FROM bookings")).scalar() == summary["bookings"]
+        assert 1200 < summary["bookings"] < 1800
+        assert connection.execute(text("SELECT COUNT(*) FROM rides WHERE seats_available < 0 "
+                                       "OR seats_available > seats")).scalar() == 0
+        assert connection.execute(text("SELECT COUNT(*) FROM rides WHERE is_active AND departure_date < :now"),
+                                  {"now": now}).scalar() == 0
+        assert connection.execute(text("SELECT COUNT(*) FROM rides WHERE is_active")).scalar() > 0
+        hashed_password = connection.execute(text("SELECT hashed_password FROM users WHERE login = 'user20@example.com'")).scalar()
+    assert SecurityUtils.verify_password(DEFAULT_PASSWORD, hashed_password)
+
+    seed(engine, users=5, rides=10)
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT MAX(id) FROM rides")).scalar() == 3010
+        assert connection.execute(text("SELECT COUNT(*) FROM users WHERE login = 'user25@example.com'")).scalar() == 1
+
+
+def test_seed_rebuilds_derived_data(tmp_path):
+    """Trying:
+        seed a database after taking a ride change log cursor
+
+    Expecting:
+        route stats counting every seeded booking, the cursor taken before rejected so the client refetches the rides
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'seed.db'}")
+    migrate(engine)
+    with Session(engine) as db:
+        since = changes.current_cursor(db)
+    summary = seed(engine, users=5, rides=200, booked_ratio=0.5)
+    with Session(engine) as db:
+        assert sum(stats.bookings for stats in analytics.route_stats(db, limit=1000)) == summary["bookings"]
+        assert changes.changes_since(db, since) is None
+
+
+def test_truncate_removes_derived_data(tmp_path):
+    """Trying:
+        truncate a seeded database with route stats and ride change log entries
+
+    Expecting:
+        no rows left but the compaction marker, a cursor taken before rejected and the current cursor accepted
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'seed.db'}")
+    migrate(engine)
+    seed(engine, users=5, rides=50)
+    with Session(engine) as db:
+        changes.record(db, changes.UPDATE, models.Ride.id <= 10)
+        db.commit()
+        since = changes.current_cursor(db)
+    truncate(engine)
+    with engine.connect() as connection:
+        for table in ("users", "rides", "bookings", "route_daily_stats", "route_stats_deltas", "idempotency_keys"):
+            assert connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() == 0
+        assert connection.execute(text("SELECT operation FROM ride_changes")).scalars().all() == [changes.COMPACTED]
+    with Session(engine) as db:
+        assert changes.changes_since(db, since) is None
+        assert changes.changes_since(db, changes.current_cursor(db))["changes"] == []
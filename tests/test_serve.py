@@ -0,0 +1,25 @@
+from app import serve
+
+
+def test_pool_per_worker_stays_within_connections():
+    for workers in (1, 2, 3, 7, 16, 44):
+        pool_size, max_overflow = serve.pool_per_worker(workers, 90)
+        assert pool_size >= 1
+        # the pools, the listener of every worker and the lock of the job leader
+        assert workers * (pool_size + max_overflow + 1) + 1 <= 90
+
+
+def test_plan_defaults_to_available_cores(monkeypatch):
+    monkeypatch.setattr(serve, "available_cores", lambda: 6)
+    monkeypatch.setattr(serve.Envs, "WEB_CONCURRENCY", None)
+    server = serve.plan(max_connections=60)
+    assert server.workers == 6
+    assert (server.pool_size, server.max_overflow) == (4, 4)
+    assert server.loop in ("uvloop", "asyncio")
+    assert server.http in ("httptools", "h11")
+
+
+def test_plan_caps_workers_at_connections():
+    server = serve.plan(workers=8, max_connections=7)
+    assert server.workers == 3
+    assert (server.pool_size, server.max_overflow) == (1, 0)
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+from pathlib import Path
+from sqlalchemy import create_engine, inspect, text
+from app.migrate import migrate
+
+
+IMPORT_BUDGET_SECONDS = 2.0
+
+
+IMPORT_CHECK = """
+import sys, time
+started = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - started
+from app.config import get_settings
+from app.database import get_engine, get_test_engine
+from app.utils import EmailUtils
+assert get_settings.cache_info().currsize == 0, "settings loaded on import"
+assert get_engine.cache_info().currsize == 0, "engine created on import"
+assert get_test_engine.cache_info().currsize == 0, "tests engine created on import"
+assert EmailUtils.mail.cache_info().currsize == 0, "mail client created on import"
+assert "fastapi_mail" not in sys.modules, "mail library loaded on import"
+print(elapsed)
+"""
+
+
+def test_import_is_fast_and_side_effect_free(tmp_path, request):
+    result = subprocess.run([sys.executable, "-c", IMPORT_CHECK], capture_output=True, text=True,
+                            cwd=tmp_path, env={"PYTHONPATH": str(Path(__file__).parents[1]),
+                                               "DATABASE_URL": "postgresql://nobody@unreachable:1/none"})
+    assert result.returncode == 0, result.stderr
+    time_factor = request.config.getoption("--budget-time-factor")
+    if time_factor is not None:
+        assert float(result.stdout) < IMPORT_BUDGET_SECONDS * time_factor
+
+
+def test_migrate_creates_schema_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    changes = migrate(engine)
+    assert "created table rides" in changes
+    assert "ix_rides_departure" in {index["name"] for index in inspect(engine).get_indexes("rides")}
+    assert migrate(engine) == []
+
+
+def test_migrate_upgrades_existing_rides_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE rides (id INTEGER PRIMARY KEY, start_city VARCHAR, destination_city VARCHAR, "
+                                "distance FLOAT, km_fee FLOAT, price FLOAT, departure_date DATETIME, "
+                                "is_active BOOLEAN, user_id_taken INTEGER)"))
+        connection.execute(text("INSERT INTO rides (id, is_active) VALUES (1, 1), (2, 0)"))
+    changes = migrate(engine)
+    assert "added column rides.seats" in changes
+    assert "added column rides.seats_available" in changes
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT id, seats, seats_available FROM rides ORDER BY id")).all()
+    assert [tuple(row) for row in rows] == [(1, 1, 1), (2, 1, 0)]
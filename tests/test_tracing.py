@@ -0,0 +1,111 @@
+import asyncio
+import json
+from app.tracing import Span, SpanKind, Tracer, TracingMiddleware, span, summarize, traced
+
+
+def _spans(client, headers, trace_id) -> tuple[dict, list[dict]]:
+    response = client.get(f"/ops/traces/{trace_id}", headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    return body["summary"], body["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+
+def test_reserve_ride_trace_splits_time_between_sql_and_email(client, user_factory, ride_factory, auth_headers):
+    admin, = user_factory(is_admin=True)
+    ride, = ride_factory()
+    response = client.post(f"/rides/{ride.id}/reserve", headers=auth_headers(admin))
+    assert response.status_code == 200
+    summary, spans = _spans(client, auth_headers(admin), response.headers["X-Trace-Id"])
+
+    by_name = {span["name"]: span for span in spans}
+    root = spans[0]
+    assert root["name"] == "POST /rides/{ride_id}/reserve"
+    assert root["kind"] == SpanKind.server and "parentSpanId" not in root
+    handler = by_name["app.routers.rides.reserve_ride"]
+    assert handler["parentSpanId"] == root["spanId"]
+    reserve = by_name["app.crud.reserve_ride"]
+    assert reserve["parentSpanId"] == handler["spanId"]
+    email = by_name["app.utils.EmailUtils.send"]
+    assert email["kind"] == SpanKind.client
+    sql = [span for span in spans if any(attribute["key"] == "db.statement" for attribute in span["attributes"])]
+    assert any(span["parentSpanId"] == reserve["spanId"] for span in sql)
+    assert any(span["name"] == "SELECT users" for span in sql)
+
+    assert summary["name"] == root["name"]
+    assert summary["sql_statements"] == len(sql) > 0
+    assert summary["sql_ms"] + summary["email_ms"] + summary["other_ms"] >= summary["total_ms"] - 0.01
+
+
+def test_traceparent_is_continued(client, user_factory, auth_headers):
+    user, = user_factory()
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    response = client.get("/users/me/", headers={**auth_headers(user), "traceparent": f"00-{trace_id}-{parent_id}-01"})
+    assert response.headers["X-Trace-Id"] == trace_id
+    admin, = user_factory(is_admin=True)
+    _, spans = _spans(client, auth_headers(admin), trace_id)
+    assert spans[0]["parentSpanId"] == parent_id
+
+    response = client.get("/users/me/", headers={**auth_headers(user), "traceparent": f"00-{trace_id}-{parent_id}-00"})
+    assert response.status_code == 200
+    assert "X-Trace-Id" not in response.headers
+
+
+def test_unknown_trace(client, user_factory, auth_headers):
+    admin, = user_factory(is_admin=True)
+    assert client.get("/ops/traces/0123", headers=auth_headers(admin)).status_code == 404
+    assert client.get("/ops/traces", headers=auth_headers(admin)).json()["resourceSpans"]
+
+
+def test_spans_are_noop_outside_of_a_trace():
+    calls = []
+
+    @traced
+    def work():
+        calls.append(1)
+        return 42
+
+    with span("outside") as outside:
+        assert outside is None
+    assert work() == 42 and calls == [1]
+
+
+def test_file_exporter_writes_otlp_json_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = Tracer(buffer_size=1, path=str(path))
+    for number in range(2):
+        trace = []
+        trace.append(Span(f"{number:032x}", "a" * 16, None, "GET /", SpanKind.server, 1_000_000, trace, end_ns=3_000_000,
+                          attributes={"http.status_code": 200, "http.route": "/"}))
+        exporter.export(trace)
+    exporter.flush()
+    assert list(exporter.traces) == [f"{1:032x}"]
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) == 2
+    otlp = lines[1]["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert otlp["startTimeUnixNano"] == "1000000" and otlp["endTimeUnixNano"] == "3000000"
+    assert {"key": "http.status_code", "value": {"intValue": "200"}} in otlp["attributes"]
+    assert summarize(exporter.traces[f"{1:032x}"])["total_ms"] == 2
+
+
+def test_client_sampled_flag_needs_the_sample_ratio():
+    """Trying:
+        send a sampled traceparent through a middleware sampling no requests, then through one trusting the flag
+
+    Expecting:
+        no trace unless the flag is trusted, then a trace continuing the trace id
+    """
+    async def app(scope, receive, send):
+        pass
+
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"traceparent", f"00-{trace_id}-00f067aa0ba902b7-01".encode())]}
+    exporter = Tracer(buffer_size=10)
+    asyncio.run(TracingMiddleware(app, exporter, sample_ratio=0)(scope, None, None))
+    assert not exporter.traces
+    asyncio.run(TracingMiddleware(app, exporter, sample_ratio=0, trust_parent=True)(scope, None, None))
+    assert list(exporter.traces) == [trace_id]
+
+
+def test_sampling_off(client):
+    middleware = TracingMiddleware(None, sample_ratio=0)
+    assert middleware.sample_ratio == 0
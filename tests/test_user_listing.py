@@ -0,0 +1,61 @@
+import pytest
+from app import models
+
+
+@pytest.fixture
+def admin(user_factory) -> models.User:
+    """Test fixture returning an active admin
+    """
+    return user_factory(is_admin=True)[0]
+
+
+def test_list_users_not_an_admin(client, user_factory, auth_headers):
+    user, = user_factory()
+    response = client.get("/users/", headers=auth_headers(user))
+    assert response.status_code == 401
+
+
+def test_list_users_keyset_pages(client, admin, user_factory, auth_headers):
+    """Trying:
+        get("/users/") page after page, passing the id of the last user of a page as after
+
+    Expecting:
+        every user exactly once in id order, without password hashes and activation codes
+    """
+    users = user_factory(5)
+    ids, after = [], 0
+    while True:
+        response = client.get("/users/", params={"after": after, "limit": 2}, headers=auth_headers(admin))
+        assert response.status_code == 200
+        page = response.json()
+        ids.extend(user["id"] for user in page)
+        assert all(set(user) == {"id", "login", "first_name", "last_name", "address", "is_admin", "is_active"} for user in page)
+        if len(page) < 2:
+            break
+        after = page[-1]["id"]
+    assert ids == sorted(user.id for user in [admin, *users])
+
+
+def test_list_users_filters(client, admin, user_factory, auth_headers):
+    inactive, = user_factory(is_active=False)
+    other_admin, = user_factory(is_admin=True)
+    response = client.get("/users/", params={"is_active": False}, headers=auth_headers(admin))
+    assert [user["id"] for user in response.json()] == [inactive.id]
+    response = client.get("/users/", params={"is_admin": True, "is_active": True}, headers=auth_headers(admin))
+    assert [user["id"] for user in response.json()] == [admin.id, other_admin.id]
+
+
+def test_list_users_login_prefix(client, admin, user_factory, auth_headers):
+    """Trying:
+        get("/users/") with a login prefix holding a LIKE wildcard
+
+    Expecting:
+        only the logins starting with the prefix, the wildcard matched literally
+    """
+    anna, = user_factory(login="anna@example.com")
+    user_factory(login="annabel@example.com")
+    user_factory(login="an_other@example.com")
+    response = client.get("/users/", params={"login_prefix": "anna@"}, headers=auth_headers(admin))
+    assert [user["login"] for user in response.json()] == [anna.login]
+    response = client.get("/users/", params={"login_prefix": "an_"}, headers=auth_headers(admin))
+    assert [user["login"] for user in response.json()] == ["an_other@example.com"]